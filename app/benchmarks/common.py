@@ -0,0 +1,136 @@
+import json
+import time
+from typing import Any, Dict, Iterable, List
+
+from elasticsearch import Elasticsearch, helpers
+
+from app.business.client_manager import client_manager
+from app.business.operation_file import file_data_generator
+from app.models.models import config
+from app.utils.logger_config import logger_index_txt
+
+
+def get_client() -> Elasticsearch:
+    """
+    restituisce il client condiviso, interrompendo il benchmark se il cluster non è raggiungibile.
+
+    :return: client elasticsearch
+    """
+
+    es = client_manager.get_client()
+    if es is None:
+        raise SystemExit(f"Elasticsearch non raggiungibile: {client_manager.last_error}")
+    return es
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    percentile q (0-100) con interpolazione sul valore più vicino.
+
+    :param values: campioni
+    :param q: percentile richiesto
+    :return: valore del percentile (0 se non ci sono campioni)
+    """
+
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    """
+    riepilogo delle latenze in millisecondi.
+
+    :param samples: latenze in secondi
+    :return: dict con media, p50, p95, p99
+    """
+
+    return {
+        "count": len(samples),
+        "mean_ms": sum(samples) / len(samples) * 1000 if samples else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000
+    }
+
+
+def load_index(es: Elasticsearch, index_name: str, body: Dict[str, Any], actions: Iterable[Dict[str, Any]] = None) \
+        -> Dict[str, Any]:
+    """
+    crea (o ricrea) un indice di benchmark e lo carica con i documenti indicati
+    (default i file di config.DIRECTORY_PATH), misurando il throughput di ingest.
+
+    :param es: client elasticsearch
+    :param index_name: nome dell'indice di benchmark
+    :param body: settings e mappings dell'indice
+    :param actions: azioni bulk da caricare
+    :return: dict con documenti, secondi e doc/s
+    """
+
+    es.indices.delete(index=index_name, ignore_unavailable=True)
+    es.indices.create(index=index_name, body=body)
+    if actions is None:
+        actions = file_data_generator(config.DIRECTORY_PATH)
+    actions = (dict(action, _index=index_name) for action in actions)
+    start = time.perf_counter()
+    success, errors = helpers.bulk(es.options(request_timeout=120), actions, chunk_size=500, raise_on_error=False)
+    es.indices.refresh(index=index_name)
+    elapsed = time.perf_counter() - start
+    if errors:
+        logger_index_txt.error(f"Errori bulk benchmark su '{index_name}': {errors[:3]}")
+    return {"docs": success, "errors": len(errors), "seconds": elapsed,
+            "docs_per_second": success / elapsed if elapsed else 0.0}
+
+
+def index_size(es: Elasticsearch, index_name: str) -> Dict[str, int]:
+    """
+    dimensione su disco e numero di segmenti di un indice, dopo un force merge a un segmento.
+
+    :param es: client elasticsearch
+    :param index_name: nome dell'indice
+    :return: dict con byte e segmenti
+    """
+
+    es.options(request_timeout=600).indices.forcemerge(index=index_name, max_num_segments=1)
+    stats = es.indices.stats(index=index_name, metric=["store", "segments"])["_all"]["primaries"]
+    return {"size_in_bytes": stats["store"]["size_in_bytes"], "segments": stats["segments"]["count"]}
+
+
+def time_searches(es: Elasticsearch, index_name: str, bodies: List[Dict[str, Any]], repeat: int) \
+        -> Dict[str, Any]:
+    """
+    esegue ogni query repeat volte (dopo un giro di riscaldamento) e misura latenza lato client e took.
+
+    :param es: client elasticsearch
+    :param index_name: indice su cui eseguire le query
+    :param bodies: body delle ricerche
+    :param repeat: ripetizioni per query
+    :return: riepilogo delle latenze client e del took elasticsearch
+    """
+
+    for body in bodies:
+        es.search(index=index_name, body=body, request_cache=False)
+    wall, took = [], []
+    for _ in range(repeat):
+        for body in bodies:
+            start = time.perf_counter()
+            res = es.search(index=index_name, body=body, request_cache=False)
+            wall.append(time.perf_counter() - start)
+            took.append(res["took"] / 1000)
+    return {"client": latency_summary(wall), "took": latency_summary(took)}
+
+
+def write_results(results: Dict[str, Any], output: str = None) -> None:
+    """
+    stampa i risultati in json e, se indicato, li salva su file.
+
+    :param results: risultati del benchmark
+    :param output: percorso del file json di output
+    """
+
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    print(text)
+    if output:
+        with open(output, 'w', encoding='utf-8') as file:
+            file.write(text)
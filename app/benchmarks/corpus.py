@@ -0,0 +1,173 @@
+"""
+genera corpora sintetici con la forma degli articoli di directory_file_txt (Title/Summary/Link più corpo):
+titoli, riassunti, frasi del corpo e fonti vengono campionati dai file reali, le dimensioni seguono
+una distribuzione configurabile. a parità di parametri e seed il corpus generato è identico.
+
+uso: python -m app.benchmarks.corpus --files 10000 --output /tmp/corpus-10k --size-dist lognormal
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+from app.business.operation_file import iter_txt_files
+from app.models.models import config
+
+SIZE_DISTRIBUTIONS = ("sample", "lognormal", "fixed")
+FILES_PER_DIRECTORY = 1000
+CORPUS_INFO = "corpus.json"
+WORD_RE = re.compile(r"[^\W\d_]{4,}", re.UNICODE)
+TAG_RE = re.compile(r"<[^>]+>")
+
+
+class CorpusModel:
+    """
+    campioni estratti dai file .txt reali: fonti (prefisso del nome), parole dei titoli con frequenza,
+    riassunti, domini dei link, frasi del corpo e dimensioni dei file.
+    """
+
+    def __init__(self, directory_path: str):
+        self.sources: List[str] = []
+        self.title_words: Counter = Counter()
+        self.summaries: List[str] = []
+        self.domains: List[str] = []
+        self.sentences: List[str] = []
+        self.sizes: List[int] = []
+
+        for file_path, stat in iter_txt_files(directory_path):
+            name = os.path.basename(file_path)
+            if "_" in name:
+                self.sources.append(name.split("_", 1)[0])
+            self.sizes.append(stat.st_size)
+            with open(file_path, "r", encoding="utf-8", errors="replace") as file:
+                body = []
+                for line in file:
+                    line = line.strip()
+                    if line.startswith("Title:"):
+                        self.title_words.update(word.lower() for word in WORD_RE.findall(line[6:]))
+                    elif line.startswith("Summary:"):
+                        summary = TAG_RE.sub(" ", line[8:]).strip()
+                        if summary:
+                            self.summaries.append(summary)
+                    elif line.startswith("Link:"):
+                        match = re.match(r"https?://([^/]+)", line[5:].strip())
+                        if match:
+                            self.domains.append(match.group(1))
+                    elif line:
+                        body.append(TAG_RE.sub(" ", line))
+                text = " ".join(body) or " ".join(self.summaries[-1:])
+                self.sentences.extend(sentence.strip() for sentence in re.split(r"(?<=[.!?])\s+", text)
+                                      if len(sentence.split()) >= 4)
+
+        if not self.sentences or not self.title_words:
+            raise ValueError(f"Nessun articolo utilizzabile in {directory_path}")
+        self.sources = self.sources or ["source"]
+        self.domains = self.domains or ["example.org"]
+        self.summaries = self.summaries or self.sentences[:100]
+        self._title_vocabulary = list(self.title_words)
+        self._title_weights = list(self.title_words.values())
+
+    def title(self, rng: random.Random) -> str:
+        words = rng.choices(self._title_vocabulary, weights=self._title_weights, k=rng.randint(5, 10))
+        return " ".join(words).capitalize()
+
+    def file_size(self, rng: random.Random, size_dist: str, median_bytes: int, sigma: float) -> int:
+        """dimensione obiettivo del file secondo la distribuzione scelta"""
+        if size_dist == "sample":
+            return rng.choice(self.sizes)
+        if size_dist == "lognormal":
+            return max(200, int(rng.lognormvariate(0, sigma) * median_bytes))
+        if size_dist == "fixed":
+            return median_bytes
+        raise ValueError(f"Distribuzione non valida: {size_dist}")
+
+    def article(self, rng: random.Random, title: str, size: int) -> str:
+        """articolo con intestazioni Title/Summary/Link e corpo di frasi reali fino a circa size byte"""
+        link = f"https://{rng.choice(self.domains)}/articles/{rng.getrandbits(48):012x}"
+        parts = [f"Title: {title}", "", f"Summary: {rng.choice(self.summaries)}", "", f"Link: {link}", ""]
+        length = sum(len(part) + 1 for part in parts)
+        paragraph: List[str] = []
+        while length < size:
+            sentence = rng.choice(self.sentences)
+            paragraph.append(sentence)
+            length += len(sentence.encode("utf-8")) + 1
+            if len(paragraph) == 5:
+                parts.append(" ".join(paragraph))
+                paragraph = []
+        if paragraph:
+            parts.append(" ".join(paragraph))
+        return "\n".join(parts)
+
+
+def generate_corpus(output_dir: str, files: int, size_dist: str = "sample", median_bytes: int = 4096,
+                    sigma: float = 1.0, seed: int = 42, source_dir: str = None) -> Dict[str, Any]:
+    """
+    scrive files articoli sintetici in output_dir, in sottocartelle da FILES_PER_DIRECTORY file.
+    se la directory contiene già un corpus generato con gli stessi parametri non viene rigenerato.
+
+    :param output_dir: directory del corpus
+    :param files: numero di file da generare
+    :param size_dist: "sample" (dimensioni dei file reali), "lognormal" o "fixed"
+    :param median_bytes: mediana (lognormal) o dimensione (fixed) in byte
+    :param sigma: deviazione standard del logaritmo per lognormal
+    :param seed: seed del generatore
+    :param source_dir: directory degli articoli reali (default config.DIRECTORY_PATH)
+    :return: dict con parametri, file, byte e secondi di generazione
+    """
+
+    source_dir = source_dir or config.DIRECTORY_PATH
+    params = {"files": files, "size_dist": size_dist, "median_bytes": median_bytes, "sigma": sigma, "seed": seed,
+              "source": os.path.basename(os.path.normpath(source_dir))}
+    info_path = os.path.join(output_dir, CORPUS_INFO)
+    if os.path.exists(info_path):
+        with open(info_path, "r", encoding="utf-8") as file:
+            info = json.load(file)
+        if info["params"] == params:
+            return info
+
+    model = CorpusModel(source_dir)
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    total_bytes = 0
+    digest = hashlib.sha1()
+    for number in range(files):
+        directory = os.path.join(output_dir, f"part_{number // FILES_PER_DIRECTORY:05d}")
+        if number % FILES_PER_DIRECTORY == 0:
+            os.makedirs(directory, exist_ok=True)
+        title = model.title(rng)
+        text = model.article(rng, title, model.file_size(rng, size_dist, median_bytes, sigma))
+        data = text.encode("utf-8")
+        name = f"{rng.choice(model.sources)}_{title[:120]} {number}.txt"
+        with open(os.path.join(directory, name), "wb") as file:
+            file.write(data)
+        total_bytes += len(data)
+        digest.update(data)
+
+    info = {"params": params, "bytes": total_bytes, "sha1": digest.hexdigest(),
+            "seconds": time.perf_counter() - start}
+    with open(info_path, "w", encoding="utf-8") as file:
+        json.dump(info, file, indent=2)
+    return info
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generazione corpus sintetico per i benchmark")
+    parser.add_argument("--files", type=int, default=10000, help="numero di file")
+    parser.add_argument("--output", required=True, help="directory del corpus")
+    parser.add_argument("--size-dist", choices=SIZE_DISTRIBUTIONS, default="sample", help="distribuzione dimensioni")
+    parser.add_argument("--median-bytes", type=int, default=4096, help="mediana (lognormal) o dimensione (fixed)")
+    parser.add_argument("--sigma", type=float, default=1.0, help="sigma della lognormale")
+    parser.add_argument("--seed", type=int, default=42, help="seed del generatore")
+    args = parser.parse_args()
+
+    info = generate_corpus(args.output, args.files, args.size_dist, args.median_bytes, args.sigma, args.seed)
+    print(json.dumps(info, indent=2))
+
+
+if __name__ == "__main__":
+    main()
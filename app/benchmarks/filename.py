@@ -0,0 +1,96 @@
+"""
+misura il costo delle modalità di ricerca sul nome file ("ngram" 2-20 originale, "edge_ngram", "wildcard"):
+termini indicizzati, spazio su disco del sottocampo, dimensione dei segmenti, ingest e latenza delle query sul nome.
+
+uso: python -m app.benchmarks.filename --query amazon --query outage --repeat 50 --output filename.json
+"""
+import argparse
+from typing import Any, Dict, Optional
+
+from elasticsearch import Elasticsearch
+
+from app.benchmarks.common import get_client, load_index, index_size, time_searches, write_results
+from app.business.mapping import FILENAME_MODES
+from app.business.operation_elasticsearch import index_body
+from app.business.query_builder import build_search_body
+from app.models.models import config
+
+DEFAULT_QUERIES = ["amazon", "outage", "chatgpt", "apple", "ai smart"]
+SUBFIELDS = {"ngram": "nome_file.ngram", "edge_ngram": "nome_file.prefix", "wildcard": "nome_file.wildcard"}
+
+
+def subfield_terms(es: Elasticsearch, index_name: str, field: str) -> Optional[Dict[str, Any]]:
+    """
+    statistiche dei termini del sottocampo tramite termvectors (non disponibili per il tipo wildcard).
+
+    :param es: client elasticsearch
+    :param index_name: indice di benchmark
+    :param field: sottocampo di nome_file
+    :return: dict con sum_ttf (token indicizzati) e sum_doc_freq (postings), None se non disponibili
+    """
+
+    hits = es.search(index=index_name, size=1, _source=False)["hits"]["hits"]
+    if not hits:
+        return None
+    try:
+        res = es.termvectors(index=index_name, id=hits[0]["_id"], fields=[field],
+                             field_statistics=True, term_statistics=False, positions=False, offsets=False)
+    except Exception:
+        return None
+    statistics = res.get("term_vectors", {}).get(field, {}).get("field_statistics")
+    if not statistics:
+        return None
+    return {"sum_ttf": statistics["sum_ttf"], "sum_doc_freq": statistics["sum_doc_freq"],
+            "doc_count": statistics["doc_count"]}
+
+
+def subfield_disk_usage(es: Elasticsearch, index_name: str, field: str) -> Dict[str, Any]:
+    """
+    spazio su disco occupato dal sottocampo (analyze index disk usage).
+
+    :param es: client elasticsearch
+    :param index_name: indice di benchmark
+    :param field: sottocampo di nome_file
+    :return: dict con byte totali e dell'inverted index
+    """
+
+    res = es.indices.disk_usage(index=index_name, run_expensive_tasks=True)
+    usage = res.get(index_name, {}).get("fields", {}).get(field, {})
+    return {"total_in_bytes": usage.get("total_in_bytes", 0),
+            "inverted_index_in_bytes": usage.get("inverted_index", {}).get("total_in_bytes", 0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Confronto modalità di ricerca sul nome file")
+    parser.add_argument("--mode", action="append", choices=FILENAME_MODES, help="modalità da misurare (ripetibile)")
+    parser.add_argument("--query", action="append", help="query sul nome file (ripetibile)")
+    parser.add_argument("--repeat", type=int, default=50, help="ripetizioni per query")
+    parser.add_argument("--output", help="file json dove salvare i risultati")
+    parser.add_argument("--keep", action="store_true", help="non eliminare gli indici di benchmark")
+    args = parser.parse_args()
+
+    es = get_client()
+    queries = args.query or DEFAULT_QUERIES
+    results = {"queries": queries, "repeat": args.repeat, "modes": {}}
+    for mode in args.mode or FILENAME_MODES:
+        index_name = f"{config.INDEX_NAME}-bench-filename-{mode.replace('_', '-')}"
+        ingest = load_index(es, index_name, index_body(filename_mode=mode))
+        bodies = [{**build_search_body(query, "", filename_mode=mode), "size": 10} for query in queries]
+        results["modes"][mode] = {
+            "ingest": ingest,
+            "index": index_size(es, index_name),
+            "subfield": {
+                "field": SUBFIELDS[mode],
+                "terms": subfield_terms(es, index_name, SUBFIELDS[mode]),
+                "disk": subfield_disk_usage(es, index_name, SUBFIELDS[mode])
+            },
+            "search": time_searches(es, index_name, bodies, args.repeat)
+        }
+        if not args.keep:
+            es.indices.delete(index=index_name)
+
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+benchmark a/b della modalità di highlight: confronta latenza delle ricerche e dimensione dell'indice
+tra "reanalyze" (mapping originale, testo rianalizzato a ogni query) e "offsets" (offset nelle postings).
+
+uso: python -m app.benchmarks.highlight --query "amazon outage" --query "intelligenza artificiale" --repeat 20
+"""
+import argparse
+
+from app.benchmarks.common import get_client, load_index, index_size, time_searches, write_results
+from app.business.mapping import HIGHLIGHT_MODES
+from app.business.operation_elasticsearch import index_body
+from app.business.query_builder import build_search_body
+from app.models.models import config
+
+DEFAULT_QUERIES = ["amazon outage", "artificial intelligence", "cyber attack", "digital id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark highlight reanalyze vs offsets")
+    parser.add_argument("--query", action="append", help="query sul contenuto (ripetibile)")
+    parser.add_argument("--repeat", type=int, default=20, help="ripetizioni per query")
+    parser.add_argument("--output", help="file json dove salvare i risultati")
+    parser.add_argument("--keep", action="store_true", help="non eliminare gli indici di benchmark")
+    args = parser.parse_args()
+
+    es = get_client()
+    queries = args.query or DEFAULT_QUERIES
+    results = {"queries": queries, "repeat": args.repeat, "modes": {}}
+    for mode in HIGHLIGHT_MODES:
+        index_name = f"{config.INDEX_NAME}-bench-highlight-{mode}"
+        ingest = load_index(es, index_name, index_body(highlight_mode=mode))
+        bodies = [{**build_search_body("", query, highlight_mode=mode), "size": 10} for query in queries]
+        results["modes"][mode] = {
+            "ingest": ingest,
+            "index": index_size(es, index_name),
+            "search": time_searches(es, index_name, bodies, args.repeat)
+        }
+        if not args.keep:
+            es.indices.delete(index=index_name)
+
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
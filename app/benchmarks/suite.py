@@ -0,0 +1,243 @@
+"""
+benchmark riproducibile di indicizzazione e ricerca su corpora sintetici di dimensione crescente.
+per ogni scala genera (o riusa) il corpus, indicizza con run_indexing() del backend scelto e misura
+throughput, picco di memoria (RSS) e dimensione dell'indice, poi riproduce un mix di query
+(nome, contenuto, combinata, frase, pagine lontane) tramite search_documents() e riporta p50/p95/p99.
+ogni scala viene eseguita in un processo separato, così il picco di RSS non dipende dalle scale precedenti.
+
+uso: python -m app.benchmarks.suite --scale 10000 --scale 100000 --backend local --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from app.benchmarks.common import latency_summary, write_results
+from app.benchmarks.corpus import CorpusModel, SIZE_DISTRIBUTIONS, generate_corpus
+from app.models.models import config
+
+DEFAULT_SCALES = [10000, 100000, 1000000]
+QUERY_KINDS = ("name", "content", "combined", "phrase", "deep_page")
+
+
+def query_mix(source_dir: str, queries_per_kind: int, deep_page: int, seed: int) -> List[Dict[str, Any]]:
+    """
+    costruisce il mix di query dalle stesse parole e frasi usate per generare il corpus,
+    così ogni query ha risultati a qualsiasi scala.
+
+    :param source_dir: directory degli articoli reali
+    :param queries_per_kind: query distinte per tipo
+    :param deep_page: pagina richiesta dalle query "deep_page"
+    :param seed: seed del generatore
+    :return: lista di parametri per search_documents()
+    """
+
+    model = CorpusModel(source_dir)
+    rng = random.Random(seed)
+    title_words = [word for word, _ in model.title_words.most_common(200)]
+    content_words = [word.lower() for sentence in model.sentences[:2000]
+                     for word in re.findall(r"[^\W\d_]{5,}", sentence)]
+    mix = []
+    for _ in range(queries_per_kind):
+        words = rng.choice(model.sentences).split()
+        start = rng.randrange(len(words) - 1)
+        mix.extend([
+            {"kind": "name", "query_nome_file": rng.choice(title_words), "query_contenuto": ""},
+            {"kind": "content", "query_nome_file": "", "query_contenuto": rng.choice(content_words)},
+            {"kind": "combined", "query_nome_file": rng.choice(title_words),
+             "query_contenuto": rng.choice(content_words)},
+            {"kind": "phrase", "query_nome_file": "", "query_contenuto": " ".join(words[start:start + 2]),
+             "is_phrase_query": True},
+            {"kind": "deep_page", "query_nome_file": "", "query_contenuto": rng.choice(content_words),
+             "page": deep_page}
+        ])
+    return mix
+
+
+def peak_rss_bytes() -> int:
+    """picco di memoria residente del processo (ru_maxrss è in KB su linux, in byte su macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure_index_size(client) -> Dict[str, Any]:
+    """
+    dimensione dell'indice del backend attivo: file dell'indice locale, oppure store della generazione
+    elasticsearch corrente dopo il force merge (più l'heap JVM usato dal nodo).
+
+    :param client: client restituito da get_search_client()
+    :return: dict con i byte dell'indice
+    """
+
+    if config.SEARCH_BACKEND == "local":
+        return {"size_in_bytes": os.path.getsize(client)}
+    from app.benchmarks.common import index_size
+    from app.business.operation_elasticsearch import current_index
+
+    size = index_size(client, current_index(client))
+    nodes = client.nodes.stats(metric="jvm")["nodes"]
+    size["jvm_heap_used_in_bytes"] = sum(node["jvm"]["mem"]["heap_used_in_bytes"] for node in nodes.values())
+    return size
+
+
+def cleanup_index(client) -> None:
+    """elimina l'indice di benchmark (file locale oppure alias e generazioni elasticsearch)"""
+    if config.SEARCH_BACKEND == "local":
+        os.remove(client)
+        return
+    from app.business.operation_elasticsearch import list_index_generations
+
+    # per nome: con action.destructive_requires_name (default in es 8/9) i wildcard vengono rifiutati
+    generations = list_index_generations(client)
+    if generations:
+        client.indices.delete(index=",".join(generations), ignore_unavailable=True)
+
+
+def run_case(queries: List[Dict[str, Any]], repeat: int, page_size: int, keep: bool) -> Dict[str, Any]:
+    """
+    eseguito nel processo figlio con config già puntata sul corpus: indicizza e misura le query.
+    la cache dei risultati è disattivata, così ogni ripetizione arriva al backend.
+
+    :param queries: mix di query da query_mix()
+    :param repeat: ripetizioni del mix
+    :param page_size: risultati per pagina
+    :param keep: se true non elimina l'indice alla fine
+    :return: risultati della scala
+    """
+
+    from app.business.backend import get_search_client, run_indexing, search_documents
+    from app.business.search_cache import search_cache
+
+    search_cache.max_size = 0
+    client = get_search_client()
+    if not client:
+        raise SystemExit(f"Backend '{config.SEARCH_BACKEND}' non disponibile")
+
+    rss_before = peak_rss_bytes()
+    start = time.perf_counter()
+    indexing = run_indexing(client, incremental=False)
+    elapsed = time.perf_counter() - start
+    if not indexing["success"]:
+        raise SystemExit(f"Indicizzazione fallita: {indexing['error']}")
+    result = {
+        "indexing": {
+            "seconds": elapsed,
+            "docs": indexing["indexed_docs"],
+            "docs_per_second": indexing["indexed_docs"] / elapsed if elapsed else 0.0,
+            "mb_per_second": indexing.get("mb_per_second"),
+            "errors": indexing["errors"],
+            "peak_rss_bytes": peak_rss_bytes(),
+            "rss_before_bytes": rss_before
+        },
+        "index": measure_index_size(client)
+    }
+
+    samples: Dict[str, List[float]] = {kind: [] for kind in QUERY_KINDS}
+    failures = 0
+    for round_number in range(repeat + 1):
+        for query in queries:
+            params = {key: value for key, value in query.items() if key != "kind"}
+            # cursori nuovi a ogni ripetizione: le pagine lontane vengono raggiunte da zero
+            cursor_cache = {} if config.SEARCH_BACKEND == "elasticsearch" else None
+            start = time.perf_counter()
+            res = search_documents(client, page_size=page_size, cursor_cache=cursor_cache, **params)
+            latency = time.perf_counter() - start
+            if not res["success"]:
+                failures += 1
+            elif round_number > 0:
+                samples[query["kind"]].append(latency)
+    result["queries"] = {kind: latency_summary(values) for kind, values in samples.items()}
+    result["queries"]["failures"] = failures
+    result["peak_rss_bytes"] = peak_rss_bytes()
+    if not keep:
+        cleanup_index(client)
+    return result
+
+
+def run_scale(args: argparse.Namespace, scale: int) -> Dict[str, Any]:
+    """
+    genera il corpus della scala ed esegue run_case() in un processo figlio con
+    DIRECTORY_PATH, INDEX_NAME, STATE_DIR e SEARCH_BACKEND dedicati.
+
+    :return: risultati della scala, parametri del corpus compresi
+    """
+
+    corpus_dir = os.path.join(args.corpus_dir, f"corpus-{scale}-{args.size_dist}-{args.seed}")
+    corpus = generate_corpus(corpus_dir, scale, args.size_dist, args.median_bytes, args.sigma, args.seed)
+    with tempfile.TemporaryDirectory() as state_dir:
+        output = os.path.join(state_dir, "case.json")
+        env = {
+            **os.environ,
+            "DIRECTORY_PATH": corpus_dir,
+            "INDEX_NAME": f"{config.INDEX_NAME}-bench-{scale}",
+            "STATE_DIR": state_dir,
+            "SEARCH_BACKEND": args.backend
+        }
+        command = [sys.executable, "-m", "app.benchmarks.suite", "--case-output", output,
+                   "--repeat", str(args.repeat), "--queries", str(args.queries), "--deep-page", str(args.deep_page),
+                   "--page-size", str(args.page_size), "--seed", str(args.seed)]
+        if args.keep:
+            command.append("--keep")
+        subprocess.run(command, env=env, check=True)
+        with open(output, "r", encoding="utf-8") as file:
+            result = json.load(file)
+    seconds = result["indexing"]["seconds"]
+    result["indexing"]["corpus_mb_per_second"] = corpus["bytes"] / (1024 * 1024) / seconds if seconds else 0.0
+    return {"scale": scale, "corpus": corpus, **result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark di indicizzazione e ricerca su corpora sintetici")
+    parser.add_argument("--scale", type=int, action="append", help="numero di file del corpus (ripetibile)")
+    parser.add_argument("--backend", choices=("elasticsearch", "local"), default=config.SEARCH_BACKEND,
+                        help="backend da misurare")
+    parser.add_argument("--corpus-dir", default=os.path.join(config.STATE_DIR, "bench"),
+                        help="directory dove generare i corpora")
+    parser.add_argument("--size-dist", choices=SIZE_DISTRIBUTIONS, default="sample", help="distribuzione dimensioni")
+    parser.add_argument("--median-bytes", type=int, default=4096, help="mediana (lognormal) o dimensione (fixed)")
+    parser.add_argument("--sigma", type=float, default=1.0, help="sigma della lognormale")
+    parser.add_argument("--seed", type=int, default=42, help="seed di corpus e query")
+    parser.add_argument("--queries", type=int, default=10, help="query distinte per tipo")
+    parser.add_argument("--repeat", type=int, default=5, help="ripetizioni del mix di query")
+    parser.add_argument("--deep-page", type=int, default=50, help="pagina delle query deep_page")
+    parser.add_argument("--page-size", type=int, default=10, help="risultati per pagina")
+    parser.add_argument("--output", help="file json dove salvare i risultati")
+    parser.add_argument("--keep", action="store_true", help="non eliminare gli indici di benchmark")
+    parser.add_argument("--case-output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    source_dir = os.environ.get("BENCH_SOURCE_DIR", config.DIRECTORY_PATH)
+    if args.case_output:
+        queries = query_mix(source_dir, args.queries, args.deep_page, args.seed)
+        result = run_case(queries, args.repeat, args.page_size, args.keep)
+        with open(args.case_output, "w", encoding="utf-8") as file:
+            json.dump(result, file)
+        return
+
+    # i figli puntano DIRECTORY_PATH al corpus: le query vanno comunque estratte dagli articoli reali
+    os.environ["BENCH_SOURCE_DIR"] = source_dir
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "backend": args.backend,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "params": {key: value for key, value in vars(args).items() if key not in ("output", "case_output")}
+        },
+        "runs": [run_scale(args, scale) for scale in args.scale or DEFAULT_SCALES]
+    }
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
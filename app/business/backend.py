@@ -0,0 +1,80 @@
+import threading
+from types import ModuleType
+
+from app.business import operation_elasticsearch, operation_local
+from app.business.operation_elasticsearch_async import async_facade
+from app.models.models import config
+
+SEARCH_BACKENDS = ("elasticsearch", "local")
+
+
+def _operations() -> ModuleType:
+    """
+    restituisce il modulo che implementa le operazioni del backend scelto in config.SEARCH_BACKEND.
+    entrambi espongono le stesse funzioni con la stessa forma dei risultati.
+
+    :return: operation_elasticsearch oppure operation_local
+    """
+
+    if config.SEARCH_BACKEND not in SEARCH_BACKENDS:
+        raise ValueError(f"Backend di ricerca non valido: {config.SEARCH_BACKEND}")
+    return operation_local if config.SEARCH_BACKEND == "local" else operation_elasticsearch
+
+
+def _use_async() -> bool:
+    """true se le operazioni elasticsearch vanno eseguite con il client asincrono (config.ES_ASYNC)"""
+    return config.SEARCH_BACKEND == "elasticsearch" and config.ES_ASYNC and async_facade.available()
+
+
+def get_search_client():
+    """client del backend: client elasticsearch oppure percorso dell'indice locale (None se non disponibile)"""
+    if config.SEARCH_BACKEND == "local":
+        return operation_local.get_local_client()
+    return operation_elasticsearch.get_elasticsearch_client()
+
+
+def run_indexing(client, progress_bar=None, incremental: bool = True, cancel_event: threading.Event = None):
+    if _use_async():
+        return async_facade.run_indexing(client, progress_bar, incremental, cancel_event)
+    return _operations().run_indexing(client, progress_bar, incremental, cancel_event)
+
+
+def rebuild_index(client, progress_bar=None, cancel_event: threading.Event = None):
+    return _operations().rebuild_index(client, progress_bar, cancel_event)
+
+
+def rollback_index(client):
+    return _operations().rollback_index(client)
+
+
+def check_index_exists(client):
+    return _operations().check_index_exists(client)
+
+
+def search_documents(client, *args, **kwargs):
+    return _operations().search_documents(client, *args, **kwargs)
+
+
+def search_with_index_check(client, *args, **kwargs):
+    """
+    controllo dell'indice e ricerca: con il client asincrono le due richieste partono in parallelo
+    (senza cursor_cache, vedi operation_elasticsearch_async.search_documents()), altrimenti in sequenza.
+
+    :return: esistenza dell'indice, numero di documenti e risultato di search_documents()
+    """
+
+    if _use_async():
+        kwargs.pop("cursor_cache", None)
+        return async_facade.search_with_index_check(*args, **kwargs)
+    exists, doc_count = check_index_exists(client)
+    return exists, doc_count, search_documents(client, *args, **kwargs)
+
+
+def get_documents_content(client, doc_ids):
+    if _use_async():
+        return async_facade.get_documents_content(doc_ids)
+    return _operations().get_documents_content(client, doc_ids)
+
+
+def get_all_sources(client, raise_errors: bool = False):
+    return _operations().get_all_sources(client, raise_errors=raise_errors)
@@ -0,0 +1,212 @@
+"""
+esecuzione in batch di ricerche salvate (termini di alert, set di test di rilevanza) con _msearch.
+legge le query da un file jsonl, una per riga:
+
+    {"id": "q1", "name": "report", "content": "fattura scaduta", "phrase": false, "sources": ["a.txt"]}
+
+e scrive i risultati in jsonl, nello stesso ordine, con i tempi di ogni query.
+
+uso: python -m app.business.batch_search queries.jsonl -o risultati.jsonl [--aggs] [--highlight]
+"""
+import argparse
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Generator, Iterable, List
+
+from elasticsearch import Elasticsearch
+
+from app.business.operation_elasticsearch import collapsed_page_body, get_elasticsearch_client, get_index_meta
+from app.business.query_builder import build_search_body
+from app.models.models import config
+from app.utils.logger_config import logger_index_txt
+from app.utils.metrics import SEARCH_STAGE_SECONDS, SEARCH_REQUESTS
+
+
+def read_queries(lines: Iterable[str]) -> Generator[Dict[str, Any], None, None]:
+    """
+    legge le query da righe jsonl, saltando righe vuote e commenti (#).
+    le righe non valide diventano query con "error", riportate così nell'output.
+
+    :param lines: righe del file di input
+    :return: query con il numero di riga in "line"
+    """
+
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            query = json.loads(line)
+            if not isinstance(query, dict):
+                raise ValueError("la riga non è un oggetto json")
+        except ValueError as e:
+            query = {"error": f"Riga non valida: {e}"}
+        yield {**query, "line": number}
+
+
+def build_batch_body(query: Dict[str, Any], meta: Dict[str, Any], size: int, aggregations: bool,
+                     highlight: bool) -> Dict[str, Any]:
+    """
+    costruisce il body di una query come search_documents() (build_search_body() e collapse per file),
+    togliendo aggregazioni e highlight se non richiesti (senza aggregazioni total_hits conta i passaggi,
+    non i file distinti).
+
+    :param query: query letta da read_queries()
+    :param meta: modalità dell'indice restituite da get_index_meta()
+    :param size: risultati per query
+    :param aggregations: se true calcola fonti e numero di file distinti
+    :param highlight: se true restituisce i frammenti evidenziati
+    :return: body, None se la query non ha termini di ricerca
+    """
+
+    base_body = build_search_body(query.get("name", ""), query.get("content", ""), bool(query.get("phrase")),
+                                  query.get("sources"), highlight_mode=meta["highlight_mode"],
+                                  filename_mode=meta["filename_mode"])
+    if base_body is None:
+        return None
+    if not highlight:
+        base_body.pop("highlight")
+    body = collapsed_page_body(base_body, 1, size)
+    if not aggregations:
+        body.pop("aggs")
+    return body
+
+
+def _query_result(query: Dict[str, Any], response: Dict[str, Any], batch_seconds: float) -> Dict[str, Any]:
+    result = {"line": query["line"], "id": query.get("id"), "batch_ms": round(batch_seconds * 1000, 3)}
+    if "error" in response:
+        error = response["error"]
+        return {**result, "success": False, "error": error.get("reason", str(error)) if isinstance(error, dict)
+                else str(error)}
+    aggregations = response.get("aggregations", {})
+    hits = []
+    for hit in response["hits"]["hits"]:
+        source = hit["_source"]
+        entry = {"id": hit["_id"], "score": hit["_score"], "nome_file": source.get("nome_file"),
+                 "percorso_completo": source.get("percorso_completo")}
+        if "highlight" in hit:
+            entry["highlight"] = hit["highlight"]
+        hits.append(entry)
+    result.update({
+        "success": True,
+        "took_ms": response.get("took"),
+        "total_hits": aggregations.get("files", {}).get("value", response["hits"]["total"]["value"]),
+        "hits": hits
+    })
+    if aggregations:
+        result["sources"] = {bucket["key"]: bucket["doc_count"]
+                             for bucket in aggregations.get("sources", {}).get("buckets", [])}
+    return result
+
+
+def run_batch(es: Elasticsearch, queries: List[Dict[str, Any]], meta: Dict[str, Any], size: int,
+              aggregations: bool, highlight: bool) -> List[Dict[str, Any]]:
+    """
+    esegue un blocco di query con una sola richiesta _msearch.
+
+    :param es: client elasticsearch
+    :param queries: query lette da read_queries()
+    :param meta: modalità dell'indice restituite da get_index_meta()
+    :param size: risultati per query
+    :param aggregations: se true calcola fonti e numero di file distinti
+    :param highlight: se true restituisce i frammenti evidenziati
+    :return: un risultato per query, nello stesso ordine
+    """
+
+    searches, sent = [], []
+    results: List[Dict[str, Any]] = [None] * len(queries)
+    for position, query in enumerate(queries):
+        body = None if "error" in query else build_batch_body(query, meta, size, aggregations, highlight)
+        if body is None:
+            results[position] = {"line": query["line"], "id": query.get("id"), "success": False,
+                                 "error": query.get("error", "Nessun termine di ricerca")}
+            continue
+        searches.extend(({"index": config.INDEX_NAME}, body))
+        sent.append(position)
+
+    if sent:
+        start = time.perf_counter()
+        try:
+            responses = es.msearch(searches=searches)["responses"]
+        except Exception as e:
+            logger_index_txt.error(f"Errore msearch: {e}")
+            responses = [{"error": str(e)}] * len(sent)
+        batch_seconds = time.perf_counter() - start
+        SEARCH_STAGE_SECONDS.observe(batch_seconds, stage="msearch")
+        for position, response in zip(sent, responses):
+            results[position] = _query_result(queries[position], response, batch_seconds)
+            SEARCH_REQUESTS.inc(backend="elasticsearch_batch",
+                                outcome="success" if results[position]["success"] else "error")
+    return results
+
+
+def run_queries(es: Elasticsearch, queries: Iterable[Dict[str, Any]], batch_size: int = None,
+                concurrency: int = None, size: int = 10, aggregations: bool = False,
+                highlight: bool = False) -> Generator[Dict[str, Any], None, None]:
+    """
+    esegue le query in blocchi _msearch di batch_size, con al massimo concurrency richieste in volo.
+    le query vengono lette man mano e i risultati restituiti nell'ordine di input, a memoria limitata.
+
+    :param es: client elasticsearch
+    :param queries: query lette da read_queries()
+    :param batch_size: query per richiesta _msearch (default config.MSEARCH_BATCH_SIZE)
+    :param concurrency: richieste _msearch in parallelo (default config.MSEARCH_CONCURRENCY)
+    :param size: risultati per query
+    :param aggregations: se true calcola fonti e numero di file distinti
+    :param highlight: se true restituisce i frammenti evidenziati
+    :return: risultati, uno per query
+    """
+
+    batch_size = batch_size or config.MSEARCH_BATCH_SIZE
+    concurrency = concurrency or config.MSEARCH_CONCURRENCY
+    meta = get_index_meta(es)
+    queries = iter(queries)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="msearch") as executor:
+        in_flight = deque()
+        while batch := list(islice(queries, batch_size)):
+            if len(in_flight) >= concurrency:
+                yield from in_flight.popleft().result()
+            in_flight.append(executor.submit(run_batch, es, batch, meta, size, aggregations, highlight))
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Esegue ricerche salvate in batch con _msearch")
+    parser.add_argument("input", help="file jsonl con le query (- per stdin)")
+    parser.add_argument("-o", "--output", default="-", help="file jsonl dei risultati (default stdout)")
+    parser.add_argument("--batch-size", type=int, default=config.MSEARCH_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=config.MSEARCH_CONCURRENCY)
+    parser.add_argument("--size", type=int, default=10, help="risultati per query")
+    parser.add_argument("--aggs", action="store_true", help="calcola fonti e numero di file distinti")
+    parser.add_argument("--highlight", action="store_true", help="restituisce i frammenti evidenziati")
+    args = parser.parse_args()
+
+    es = get_elasticsearch_client()
+    if es is None:
+        raise SystemExit("Elasticsearch non raggiungibile")
+    source = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    start, count, errors = time.perf_counter(), 0, 0
+    try:
+        for result in run_queries(es, read_queries(source), args.batch_size, args.concurrency, args.size,
+                                  args.aggs, args.highlight):
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            count += 1
+            errors += not result["success"]
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.perf_counter() - start
+    logger_index_txt.info(f"Batch: {count} query ({errors} errori) in {elapsed:.2f}s, "
+                          f"{count / elapsed if elapsed else 0:.1f} query/s.")
+
+
+if __name__ == "__main__":
+    main()
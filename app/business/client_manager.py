@@ -0,0 +1,132 @@
+import threading
+import time
+from typing import Optional
+
+from elasticsearch import Elasticsearch
+
+from app.models.models import config
+from app.utils.logger_config import logger_index_txt
+
+
+class ElasticsearchClientManager:
+    """
+    gestisce un unico client elasticsearch condiviso da tutte le sessioni del processo.
+    il pool di connessioni viene riutilizzato, lo stato del cluster è verificato da un thread in background
+    ogni config.ES_HEALTH_CHECK_INTERVAL secondi e un circuit breaker fa fallire subito le richieste
+    quando il cluster non risponde, invece di attendere il request_timeout a ogni rerun.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client: Optional[Elasticsearch] = None
+        self._healthy = False
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._monitor: Optional[threading.Thread] = None
+        self.last_error = ""
+
+    def _build_client(self) -> Elasticsearch:
+        return Elasticsearch(
+            config.ELASTICSEARCH_HOST,
+            verify_certs=False,
+            request_timeout=30,
+            connections_per_node=config.ES_CONNECTIONS_PER_NODE,
+            max_retries=config.ES_MAX_RETRIES,
+            retry_on_timeout=True,
+        )
+
+    @staticmethod
+    def _ping(client: Elasticsearch) -> bool:
+        """ping veloce con fallback su info(), senza retry del transport"""
+        fast_client = client.options(request_timeout=config.ES_HEALTH_CHECK_TIMEOUT, max_retries=0)
+        try:
+            if fast_client.ping():
+                return True
+            return bool(fast_client.info())
+        except Exception:
+            return False
+
+    def _record(self, healthy: bool) -> None:
+        with self._lock:
+            self._healthy = healthy
+            if healthy:
+                if self._opened_at is not None:
+                    logger_index_txt.info("Elasticsearch di nuovo raggiungibile, circuit breaker chiuso.")
+                self._failures = 0
+                self._opened_at = None
+                self.last_error = ""
+                return
+            self._failures += 1
+            if self._failures >= config.ES_BREAKER_THRESHOLD:
+                if self._opened_at is None:
+                    logger_index_txt.warning(f"Circuit breaker aperto dopo {self._failures} errori consecutivi.")
+                self._opened_at = time.monotonic()
+
+    def record_failure(self, error: Exception = None) -> None:
+        """
+        registra un errore di connessione rilevato da una richiesta.
+
+        :param error: eccezione sollevata dalla richiesta
+        """
+
+        if error is not None:
+            self.last_error = str(error)
+        self._record(False)
+
+    def breaker_remaining(self) -> float:
+        """
+        secondi mancanti alla riapertura del circuito (0 se chiuso o in prova).
+
+        :return: secondi di attesa
+        """
+
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self._opened_at + config.ES_BREAKER_COOLDOWN - time.monotonic())
+
+    def _check_with_backoff(self, client: Elasticsearch) -> bool:
+        for attempt in range(config.ES_MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(config.ES_RETRY_BACKOFF * 2 ** (attempt - 1))
+            if self._ping(client):
+                return True
+        return False
+
+    def _monitor_loop(self) -> None:
+        while True:
+            time.sleep(config.ES_HEALTH_CHECK_INTERVAL)
+            self._record(self._ping(self._client))
+
+    def get_client(self) -> Optional[Elasticsearch]:
+        """
+        restituisce il client condiviso. il controllo di salute viene fatto in linea solo alla prima
+        connessione o dopo un errore; se il circuito è aperto restituisce subito None.
+
+        :return: client elasticsearch oppure None se il cluster non è raggiungibile
+        """
+
+        if self.breaker_remaining() > 0:
+            return None
+
+        with self._lock:
+            if self._client is None:
+                self._client = self._build_client()
+            client, healthy = self._client, self._healthy
+
+        if not healthy:
+            healthy = self._check_with_backoff(client)
+            if not healthy and not self.last_error:
+                self.last_error = f"Ping fallito su {config.ELASTICSEARCH_HOST}"
+            self._record(healthy)
+            if not healthy:
+                return None
+
+        with self._lock:
+            if self._monitor is None:
+                self._monitor = threading.Thread(target=self._monitor_loop, name="es-health", daemon=True)
+                self._monitor.start()
+        return client
+
+
+client_manager = ElasticsearchClientManager()
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import re
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.models.models import config
+from app.utils.logger_config import logger_index_txt
+from app.utils.metrics import INGEST_DUPLICATES
+
+WORD_RE = re.compile(r"[^\W_]+")
+HASH_BITS = 64
+Fingerprint = Tuple[str, List[int]]
+
+
+def dedup_store_path(index_name: str) -> Path:
+    """
+    restituisce il percorso dell'archivio delle firme associato a un indice.
+
+    :param index_name: nome dell'indice elasticsearch
+    :return: percorso del file json delle firme
+    """
+
+    return Path(config.STATE_DIR) / f"dedup_{index_name}.json"
+
+
+def content_fingerprint(text: str, shingle_size: int = None, num_perm: int = None) -> Optional[Fingerprint]:
+    """
+    calcola l'impronta di un testo: hash esatto delle parole normalizzate (minuscole, senza punteggiatura
+    e spazi superflui) e firma minhash degli shingle di parole. la firma usa un solo hash per shingle
+    (one permutation hashing: l'hash sceglie il bin e il resto è il valore), con i bin vuoti riempiti
+    dal bin successivo, così il costo è lineare nella lunghezza del testo.
+
+    :param text: contenuto del documento
+    :param shingle_size: parole per shingle (default config.DEDUP_SHINGLE_SIZE)
+    :param num_perm: lunghezza della firma (default config.DEDUP_NUM_PERM)
+    :return: hash esatto e firma, None se il testo non contiene parole
+    """
+
+    shingle_size = shingle_size or config.DEDUP_SHINGLE_SIZE
+    num_perm = num_perm or config.DEDUP_NUM_PERM
+    words = WORD_RE.findall(text.lower())
+    if not words:
+        return None
+    exact = hashlib.sha1(" ".join(words).encode("utf-8")).hexdigest()
+    shingles = {" ".join(words[start:start + shingle_size])
+                for start in range(max(len(words) - shingle_size + 1, 1))}
+
+    empty = 1 << HASH_BITS
+    bins = [empty] * num_perm
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+        position, value = value % num_perm, value // num_perm
+        if value < bins[position]:
+            bins[position] = value
+    filled = [position for position, value in enumerate(bins) if value != empty]
+    for position in range(num_perm):
+        if bins[position] == empty:
+            donor = next((other for other in filled if other > position), filled[0])
+            bins[position] = bins[donor] + (position - donor) % num_perm
+    return exact, bins
+
+
+def signature_similarity(first: List[int], second: List[int]) -> float:
+    """stima della similarità di jaccard tra due testi: frazione di valori uguali nelle firme"""
+    return sum(a == b for a, b in zip(first, second)) / len(first)
+
+
+class DedupStore:
+    """
+    archivio persistente delle impronte dei documenti di un indice (config.STATE_DIR/dedup_<indice>.json).
+    ogni file è canonico oppure duplicato di un file canonico: i duplicati esatti si trovano per hash,
+    quelli quasi identici con lsh (la firma divisa in config.DEDUP_BANDS bande, i candidati condividono
+    almeno una banda) e la similarità stimata sopra config.DEDUP_THRESHOLD.
+    le firme salvate rendono incrementali i controlli tra un'indicizzazione e l'altra.
+    """
+
+    def __init__(self, index_name: str, entries: Dict[str, Dict[str, Any]] = None):
+        self.index_name = index_name
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._by_hash: Dict[str, str] = {}
+        self._buckets: Dict[int, Set[str]] = defaultdict(set)
+        self._dependents: Dict[str, Set[str]] = defaultdict(set)
+        for path, entry in (entries or {}).items():
+            self._add(path, entry)
+
+    def _band_keys(self, signature: List[int]) -> List[int]:
+        rows = max(len(signature) // config.DEDUP_BANDS, 1)
+        return [hash((start, tuple(signature[start:start + rows]))) for start in range(0, len(signature), rows)]
+
+    def _add(self, path: str, entry: Dict[str, Any]) -> None:
+        self.entries[path] = entry
+        if entry["canonical"] is not None:
+            self._dependents[entry["canonical"]].add(path)
+            return
+        self._by_hash.setdefault(entry["hash"], path)
+        for key in self._band_keys(entry["sig"]):
+            self._buckets[key].add(path)
+
+    def find_canonical(self, exact: str, signature: List[int]) -> Tuple[Optional[str], str]:
+        """
+        cerca il documento canonico di cui il testo è un duplicato.
+
+        :param exact: hash esatto restituito da content_fingerprint()
+        :param signature: firma restituita da content_fingerprint()
+        :return: percorso del canonico (None se il testo è nuovo) e tipo di duplicato ("exact" o "near")
+        """
+
+        canonical = self._by_hash.get(exact)
+        if canonical is not None:
+            return canonical, "exact"
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates.update(self._buckets.get(key, ()))
+        best, best_similarity = None, config.DEDUP_THRESHOLD
+        for candidate in sorted(candidates):
+            similarity = signature_similarity(signature, self.entries[candidate]["sig"])
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return best, "near"
+
+    def register(self, path: str, fingerprint: Fingerprint) -> Optional[str]:
+        """
+        registra l'impronta di un file appena letto.
+
+        :param path: percorso del file
+        :param fingerprint: impronta restituita da content_fingerprint()
+        :return: percorso del documento canonico se il file è un duplicato, altrimenti None
+        """
+
+        self.remove(path)
+        exact, signature = fingerprint
+        canonical, kind = self.find_canonical(exact, signature)
+        self._add(path, {"hash": exact, "sig": signature, "canonical": canonical})
+        if canonical is not None:
+            INGEST_DUPLICATES.inc(kind=kind)
+        return canonical
+
+    def remove(self, path: str) -> List[str]:
+        """
+        elimina l'impronta di un file (modificato o cancellato).
+
+        :param path: percorso del file
+        :return: duplicati che avevano il file come canonico e vanno rivalutati
+        """
+
+        entry = self.entries.pop(path, None)
+        if entry is None:
+            return []
+        if entry["canonical"] is not None:
+            self._dependents.get(entry["canonical"], set()).discard(path)
+            return []
+        if self._by_hash.get(entry["hash"]) == path:
+            del self._by_hash[entry["hash"]]
+        for key in self._band_keys(entry["sig"]):
+            self._buckets.get(key, set()).discard(path)
+        return sorted(self._dependents.pop(path, set()))
+
+    def prepare(self, changed: List[Tuple[str, int, float]], deleted: List[str],
+                manifest: Dict[str, Dict[str, Any]]) -> List[Tuple[str, int, float]]:
+        """
+        prepara un'indicizzazione incrementale: i duplicati di un canonico modificato o cancellato vengono
+        aggiunti ai file da reinviare (con il testo completo, o come duplicati di un altro canonico).
+        nel manifest sono marcati come da rileggere, così un'indicizzazione interrotta li riprende.
+
+        :param changed: file nuovi o modificati (percorso, size, mtime)
+        :param deleted: percorsi eliminati
+        :param manifest: manifest dell'indice
+        :return: changed con i duplicati da rivalutare
+        """
+
+        touched = {path for path, _, _ in changed}
+        extra = []
+        for path in list(touched) + list(deleted):
+            for dependent in self.remove(path):
+                self.remove(dependent)
+                if dependent in touched or dependent not in manifest:
+                    continue
+                try:
+                    stat = os.stat(dependent)
+                except OSError:
+                    continue
+                manifest[dependent] = {**manifest[dependent], "hash": None, "mtime": -1}
+                extra.append((dependent, stat.st_size, stat.st_mtime))
+                touched.add(dependent)
+        if extra:
+            logger_index_txt.info(f"Duplicati da rivalutare dopo la modifica dei canonici: {len(extra)}.")
+        return changed + extra
+
+    def save(self) -> None:
+        """salva le impronte su disco in modo atomico"""
+        path = dedup_store_path(self.index_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.entries, file)
+        os.replace(tmp_path, path)
+
+
+def load_dedup_store(index_name: str) -> DedupStore:
+    """
+    carica l'archivio delle impronte di un indice; se manca o non è leggibile ne restituisce uno vuoto.
+
+    :param index_name: nome dell'indice elasticsearch
+    :return: archivio delle impronte
+    """
+
+    path = dedup_store_path(index_name)
+    if not path.exists():
+        return DedupStore(index_name)
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return DedupStore(index_name, json.load(file))
+    except Exception as e:
+        logger_index_txt.warning(f"Archivio impronte '{path}' non leggibile, verrà ricostruito: {e}")
+        return DedupStore(index_name)
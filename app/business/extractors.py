@@ -0,0 +1,85 @@
+import html
+import re
+from typing import Any, Callable, Dict, List
+
+from app.models.models import config
+from app.utils.logger_config import logger_index_txt
+
+Extractor = Callable[[str], Dict[str, Any]]
+
+ARTICLE_HEADER_RE = re.compile(r"^(Title|Summary|Link):[ \t]*", re.M)
+HTML_TAG_RE = re.compile(r"<[^>]+>")
+ARTICLE_HEAD_CHARS = 20000
+SUMMARY_MAX_CHARS = 2000
+
+
+def extract_article_fields(text: str) -> Dict[str, Any]:
+    """
+    estrae titolo, sommario e link dagli articoli con intestazioni "Title:", "Summary:" e "Link:"
+    (il formato dei file di directory_file_txt). il sommario viene ripulito dai tag html.
+    i testi che non iniziano con "Title:" non vengono modificati.
+
+    :param text: contenuto del file (o il suo primo passaggio)
+    :return: dict con title, summary e link trovati, vuoto se il formato non corrisponde
+    """
+
+    head = text[:ARTICLE_HEAD_CHARS].lstrip("\ufeff \t\r\n")
+    if not head.startswith("Title:"):
+        return {}
+    parts = ARTICLE_HEADER_RE.split(head)
+    headers = {}
+    for name, value in zip(parts[1::2], parts[2::2]):
+        headers.setdefault(name, value)
+    fields = {}
+    title = headers.get("Title", "").split("\n", 1)[0].strip()
+    if title:
+        fields["title"] = title
+    summary = " ".join(html.unescape(HTML_TAG_RE.sub(" ", headers.get("Summary", ""))).split())
+    if summary:
+        fields["summary"] = summary[:SUMMARY_MAX_CHARS]
+    link = headers.get("Link", "").split()
+    if link:
+        fields["link"] = link[0]
+    return fields
+
+
+EXTRACTORS: Dict[str, Extractor] = {"article": extract_article_fields}
+
+
+def register_extractor(name: str, extractor: Extractor) -> None:
+    """
+    registra un estrattore utilizzabile in config.INGEST_EXTRACTORS.
+
+    :param name: nome dell'estrattore
+    :param extractor: funzione che riceve il testo e restituisce i campi trovati (dict vuoto se nessuno)
+    """
+
+    EXTRACTORS[name] = extractor
+
+
+def active_extractors() -> List[Extractor]:
+    """estrattori elencati in config.INGEST_EXTRACTORS (separati da virgola), nell'ordine indicato"""
+    names = [name.strip() for name in config.INGEST_EXTRACTORS.split(",") if name.strip()]
+    unknown = [name for name in names if name not in EXTRACTORS]
+    if unknown:
+        raise ValueError(f"Estrattori non validi: {', '.join(unknown)}")
+    return [EXTRACTORS[name] for name in names]
+
+
+def extract_fields(text: str) -> Dict[str, Any]:
+    """
+    applica gli estrattori attivi al testo: i campi del primo estrattore che li trova hanno la precedenza.
+    un errore di un estrattore non blocca l'indicizzazione, il documento resta solo testo.
+
+    :param text: contenuto del file (o il suo primo passaggio)
+    :return: campi strutturati da aggiungere al documento
+    """
+
+    fields = {}
+    for extractor in active_extractors():
+        try:
+            for name, value in extractor(text).items():
+                fields.setdefault(name, value)
+        except Exception as e:
+            logger_index_txt.warning(f"Estrattore {extractor.__name__} fallito: {e}")
+    return fields
@@ -0,0 +1,361 @@
+import heapq
+import json
+import os
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # windows: il journal viene scritto senza lock tra processi
+    fcntl = None
+
+from app.models.models import config
+from app.utils.logger_config import logger_index_txt
+from app.utils.metrics import SEARCH_STAGE_SECONDS
+
+WORD_START_RE = re.compile(r"(?<=[\W_])[^\W_]|(?<=[a-z])[A-Z]|(?<=[^\W\d_])\d")
+RETRY_SECONDS = 30
+# maggiore di qualsiasi carattere: prefix + PREFIX_END delimita le stringhe che iniziano con prefix
+PREFIX_END = "\U0010ffff"
+# separatore dei nomi nei buffer: minore di qualsiasi carattere, quindi una chiave letta fino al separatore
+# si ordina come la stringa isolata
+NAME_END = "\0"
+# variazioni oltre cui il journal viene azzerato (i lettori ricaricano tutti i nomi) invece di registrarle
+JOURNAL_MAX_NAMES = 10000
+JOURNAL_MAX_BYTES = 4 * 1024 * 1024
+# nomi aggiunti o rimossi in memoria oltre cui l'indice compatto viene ricostruito
+COMPACT_DELTA_NAMES = 10000
+
+
+def filename_keys(name: str) -> List[str]:
+    """
+    chiavi di ricerca di un nome file: il nome intero e i suoi suffissi che iniziano una parola
+    (dopo separatori, cambi minuscola/maiuscola e tra lettere e cifre), in minuscolo.
+    l'estensione non genera una chiave propria.
+    es. "ilFatto_omicidio2024.txt" -> "ilfatto_omicidio2024.txt", "fatto_omicidio2024.txt", "omicidio2024.txt",
+    "2024.txt"
+
+    :param name: nome del file
+    :return: chiavi per la ricerca per prefisso
+    """
+
+    lowered = name.lower()
+    return [lowered[start:] for start in _key_starts(name, lowered)]
+
+
+def _key_starts(name: str, lowered: str) -> List[int]:
+    """posizioni in lowered delle chiavi di filename_keys() (solo il nome intero se lower() cambia la lunghezza)"""
+    if len(lowered) != len(name):
+        return [0]
+    extension = name.rfind(".")
+    end = extension if extension > 0 else len(name)
+    return [0] + [match.start() for match in WORD_START_RE.finditer(name, 0, end)]
+
+
+def name_journal_path() -> Path:
+    """
+    journal delle variazioni dei nomi indicizzati, condiviso tra i processi che usano config.STATE_DIR:
+    una riga json {"added": [...], "removed": [...]} per ogni invio all'indice.
+    """
+
+    return Path(config.STATE_DIR) / f"names_{config.SEARCH_BACKEND}_{config.INDEX_NAME}.journal"
+
+
+def _write_name_journal(line: Optional[str]) -> None:
+    """
+    aggiunge una riga al journal sotto un lock su file; con line None, o se il journal è troppo grande,
+    lo sostituisce con un file nuovo (un altro inode), così i lettori sanno di dover ricaricare tutti i nomi.
+    """
+
+    path = name_journal_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_suffix(".lock"), "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if line is None or (path.exists() and path.stat().st_size > JOURNAL_MAX_BYTES):
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_bytes(b"")
+            os.replace(tmp_path, path)
+        if line is not None:
+            with open(path, "a", encoding="utf-8") as file:
+                file.write(line + "\n")
+
+
+def reset_name_journal() -> None:
+    """segnala ai suggerimenti che l'indice è stato sostituito (ricostruzione, rollback, ripristino)"""
+    try:
+        _write_name_journal(None)
+    except OSError as e:
+        logger_index_txt.warning(f"Impossibile azzerare il journal dei nomi file: {e}")
+
+
+def record_name_changes(manifest: Dict[str, Dict[str, Any]], changed_paths: Iterable[str],
+                        deleted_paths: Iterable[str]) -> None:
+    """
+    registra nel journal i nomi file aggiunti e rimossi da un invio all'indice, dopo l'aggiornamento del manifest:
+    un nome è aggiunto se un file modificato è nel manifest, rimosso se nessun file del manifest lo usa più.
+    gli invii con più di JOURNAL_MAX_NAMES variazioni azzerano il journal.
+
+    :param manifest: manifest dell'indice aggiornato con gli esiti del bulk
+    :param changed_paths: percorsi dei file nuovi o modificati inviati
+    :param deleted_paths: percorsi eliminati inviati
+    """
+
+    added = {os.path.basename(path) for path in changed_paths if path in manifest}
+    removed = {os.path.basename(path) for path in deleted_paths if path not in manifest} - added
+    if removed:
+        removed -= {os.path.basename(path) for path in manifest}
+    if not added and not removed:
+        return
+    try:
+        if len(added) + len(removed) > JOURNAL_MAX_NAMES:
+            _write_name_journal(None)
+        else:
+            _write_name_journal(json.dumps({"added": sorted(added), "removed": sorted(removed)}, ensure_ascii=False))
+    except OSError as e:
+        logger_index_txt.warning(f"Impossibile aggiornare il journal dei nomi file: {e}")
+
+
+def _journal_state() -> Tuple[Optional[Tuple[int, int]], int]:
+    """identità (device, inode) e dimensione del journal; (None, 0) se non esiste"""
+    try:
+        stat = os.stat(name_journal_path())
+    except OSError:
+        return None, 0
+    return (stat.st_dev, stat.st_ino), stat.st_size
+
+
+class CompactNames:
+    """
+    nomi file ordinati e chiavi di filename_keys() in forma compatta: i nomi sono concatenati in due stringhe
+    (originali e in minuscolo, separati da NAME_END) e ogni chiave è un offset nella stringa minuscola,
+    con il numero del nome a cui appartiene. tutte le posizioni sono array di interi, non oggetti python.
+    """
+
+    def __init__(self, names: Iterable[str]):
+        unique_names = sorted(set(names), key=str.lower)
+        self.count = len(unique_names)
+        self.names = NAME_END.join(unique_names) + NAME_END
+        self.lowered = NAME_END.join(name.lower() for name in unique_names) + NAME_END
+        self.name_starts, self.lowered_starts = array("Q"), array("Q")
+        buckets: Dict[str, Tuple[array, array]] = {}
+        position, lowered_position = 0, 0
+        for owner, name in enumerate(unique_names):
+            lowered = self.lowered[lowered_position:self.lowered.index(NAME_END, lowered_position)]
+            self.name_starts.append(position)
+            self.lowered_starts.append(lowered_position)
+            for start in _key_starts(name, lowered):
+                offsets, owners = buckets.setdefault(lowered[start], (array("Q"), array("I")))
+                offsets.append(lowered_position + start)
+                owners.append(owner)
+            position += len(name) + 1
+            lowered_position += len(lowered) + 1
+        del unique_names
+        # ordinamento per iniziale: le stringhe temporanee delle chiavi esistono per un gruppo alla volta
+        self.key_offsets, self.key_owners = array("Q"), array("I")
+        for first_char in sorted(buckets):
+            offsets, owners = buckets.pop(first_char)
+            order = sorted(range(len(offsets)), key=lambda i: self._read(self.lowered, offsets[i]))
+            self.key_offsets.extend(offsets[i] for i in order)
+            self.key_owners.extend(owners[i] for i in order)
+
+    @staticmethod
+    def _read(buffer: str, start: int) -> str:
+        return buffer[start:buffer.index(NAME_END, start)]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names.split(NAME_END)[:-1])
+
+    def name(self, number: int) -> str:
+        return self._read(self.names, self.name_starts[number])
+
+    def name_range(self, prefix: str) -> Tuple[int, int]:
+        """intervallo [first, last) dei numeri dei nomi che iniziano con prefix (in minuscolo)"""
+        size = len(prefix)
+        key = lambda number: self.lowered[self.lowered_starts[number]:self.lowered_starts[number] + size]
+        return (bisect_left(range(self.count), prefix, key=key),
+                bisect_left(range(self.count), prefix + PREFIX_END, key=key))
+
+    def key_range(self, prefix: str) -> array:
+        """numeri dei nomi con una chiave che inizia con prefix (con ripetizioni)"""
+        size = len(prefix)
+        key = lambda offset: self.lowered[offset:offset + size]
+        return self.key_owners[bisect_left(self.key_offsets, prefix, key=key):
+                               bisect_left(self.key_offsets, prefix + PREFIX_END, key=key)]
+
+    def __contains__(self, name: str) -> bool:
+        first, last = self.name_range(name.lower() + NAME_END)
+        return any(self.name(number) == name for number in range(first, last))
+
+
+class FilenameSuggester:
+    """
+    suggerimenti sul nome file mentre si scrive, serviti dalla memoria senza interrogare il cluster.
+    le chiavi di filename_keys() sono tenute ordinate in un CompactNames: un prefisso si trova con una ricerca
+    binaria (O(log n)), quindi un nome corrisponde se il testo è l'inizio del nome o di una sua parola.
+    dopo ogni invio all'indice si applicano in background solo i nomi aggiunti e rimossi letti dal journal
+    (name_journal_path()); tutti i nomi vengono ricaricati dal backend solo al primo uso, quando il journal è
+    azzerato (ricostruzione, rollback, ripristino) o dopo config.SUGGEST_REFRESH_INTERVAL secondi.
+    durante l'aggiornamento si continua a rispondere con l'elenco precedente.
+    """
+
+    def __init__(self):
+        self._base: Optional[CompactNames] = None
+        # variazioni rispetto a _base: sostituite, mai modificate, così suggest() le legge senza copiarle
+        self._added: Dict[str, None] = {}
+        self._removed: Set[str] = set()
+        self._journal_id = None
+        self._journal_offset = 0
+        self._loaded_at = 0.0
+        self._retry_at = 0.0
+        self._loading = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._base is not None
+
+    @property
+    def count(self) -> int:
+        with self._lock:
+            base, added, removed = self._base, self._added, self._removed
+        return (base.count if base is not None else 0) + len(added) - len(removed)
+
+    def build(self, names: Iterable[str]) -> None:
+        """
+        costruisce l'indice dei nomi e lo sostituisce in modo atomico a quello in uso.
+
+        :param names: nomi dei file (anche non ordinati o ripetuti)
+        """
+
+        base = CompactNames(names)
+        with self._lock:
+            self._base, self._added, self._removed = base, {}, set()
+            self._loaded_at = time.monotonic()
+
+    def suggest(self, text: str, limit: int = None) -> List[str]:
+        """
+        nomi file che iniziano con il testo o contengono una parola che inizia con il testo,
+        prima quelli in cui il testo è l'inizio del nome, poi in ordine alfabetico.
+        i nomi sono ordinati alfabeticamente, quindi quelli che iniziano con il testo sono un intervallo
+        contiguo (ricerca binaria sui nomi) e i restanti si scelgono tra tutte le chiavi con il prefisso
+        come gli id più bassi, cioè i primi in ordine alfabetico: l'ordinamento precede il taglio a limit.
+        i nomi aggiunti dopo la costruzione si confrontano uno a uno, quelli rimossi si scartano.
+
+        :param text: testo digitato (maiuscole e spazi esterni ignorati)
+        :param limit: numero massimo di suggerimenti (default config.SUGGEST_LIMIT)
+        :return: nomi suggeriti
+        """
+
+        start = time.perf_counter()
+        limit = limit or config.SUGGEST_LIMIT
+        prefix = text.strip().lower()
+        with self._lock:
+            base, added, removed = self._base, self._added, self._removed
+        if not prefix or base is None:
+            return []
+        first, last = base.name_range(prefix)
+        starting = [name for name in map(base.name, range(first, min(last, first + limit + len(removed))))
+                    if name not in removed]
+        starting.extend(name for name in added if name.lower().startswith(prefix))
+        starting = sorted(starting, key=str.lower)[:limit]
+        if len(starting) < limit:
+            wanted = limit - len(starting) + len(removed)
+            owners = heapq.nsmallest(wanted, {owner for owner in base.key_range(prefix)
+                                              if not first <= owner < last})
+            containing = [name for name in map(base.name, owners) if name not in removed]
+            containing.extend(name for name in added if not name.lower().startswith(prefix)
+                              and any(key.startswith(prefix) for key in filename_keys(name)))
+            starting.extend(sorted(containing, key=str.lower)[:limit - len(starting)])
+        SEARCH_STAGE_SECONDS.observe(time.perf_counter() - start, stage="suggest")
+        return starting
+
+    def refresh(self, load_names: Callable[[], List[str]], wait: bool = False) -> None:
+        """
+        aggiorna i nomi in un thread separato, uno alla volta: applica le nuove righe del journal,
+        oppure ricarica tutti i nomi se non sono ancora caricati, se il journal è stato azzerato o se
+        l'elenco è più vecchio di config.SUGGEST_REFRESH_INTERVAL.
+
+        :param load_names: funzione che restituisce tutti i nomi indicizzati e solleva un'eccezione se non
+            riesce (es. get_all_sources del backend con raise_errors=True)
+        :param wait: se true attende l'aggiornamento (uso da script e benchmark)
+        """
+
+        journal_id, journal_size = _journal_state()
+        with self._lock:
+            if self._loading:
+                return
+            now = time.monotonic()
+            full = self._base is None or now - self._loaded_at > config.SUGGEST_REFRESH_INTERVAL \
+                or journal_id != self._journal_id or journal_size < self._journal_offset
+            if full and now < self._retry_at or not full and journal_size == self._journal_offset:
+                return
+            self._loading = True
+        target, args = (self._load, (load_names,)) if full else (self._apply_journal, ())
+        thread = threading.Thread(target=target, args=args, name="filename-suggester", daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+
+    def _load(self, load_names: Callable[[], List[str]]) -> None:
+        start = time.perf_counter()
+        # le righe scritte durante il caricamento vengono riapplicate: aggiunte e rimozioni sono idempotenti
+        journal_id, journal_size = _journal_state()
+        try:
+            self.build(load_names())
+            with self._lock:
+                self._journal_id, self._journal_offset = journal_id, journal_size
+            logger_index_txt.info(f"Suggerimenti nomi file: {self._base.count} nomi, {len(self._base.key_offsets)} "
+                                  f"chiavi caricati in {time.perf_counter() - start:.2f}s.")
+        except Exception as e:
+            logger_index_txt.error(f"Errore caricamento suggerimenti nomi file: {e}")
+            with self._lock:
+                self._retry_at = time.monotonic() + RETRY_SECONDS
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def _apply_journal(self) -> None:
+        """applica le righe complete del journal successive all'ultima lettura"""
+        try:
+            with open(name_journal_path(), "rb") as file:
+                stat = os.fstat(file.fileno())
+                if (stat.st_dev, stat.st_ino) != self._journal_id:
+                    return  # journal azzerato dopo il controllo: il prossimo refresh ricarica tutto
+                file.seek(self._journal_offset)
+                data = file.read()
+            data = data[:data.rfind(b"\n") + 1]
+            base, added, removed = self._base, dict(self._added), set(self._removed)
+            for line in data.splitlines():
+                change = json.loads(line)
+                for name in change.get("removed", []):
+                    if name in added:
+                        del added[name]
+                    elif name in base:
+                        removed.add(name)
+                for name in change.get("added", []):
+                    if name in removed:
+                        removed.discard(name)
+                    elif name not in base:
+                        added[name] = None
+            if len(added) + len(removed) > COMPACT_DELTA_NAMES:
+                base = CompactNames([name for name in base if name not in removed] + list(added))
+                added, removed = {}, set()
+            with self._lock:
+                self._base, self._added, self._removed = base, added, removed
+                self._journal_offset += len(data)
+        except (OSError, ValueError) as e:
+            logger_index_txt.warning(f"Journal dei nomi file non applicato, i nomi verranno ricaricati: {e}")
+            with self._lock:
+                self._journal_id = None
+        finally:
+            with self._lock:
+                self._loading = False
+
+
+filename_suggester = FilenameSuggester()
@@ -0,0 +1,286 @@
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # windows: resta solo il lock tra i thread del processo
+    fcntl = None
+
+from app.business.backend import rebuild_index, run_indexing
+from app.business.snapshot import restore_snapshot
+from app.models.models import config
+from app.utils.logger_config import logger_index_txt
+
+JOB_KINDS = ("index", "rebuild", "restore")
+
+
+class JobProgress:
+    """
+    sostituisce la progressbar di streamlit nei job in background: registra avanzamento e messaggio
+    nello stato condiviso del job, leggibile da qualsiasi sessione.
+    """
+
+    def __init__(self, job: Dict[str, Any], lock: threading.Lock):
+        self._job = job
+        self._lock = lock
+
+    def progress(self, value: float, text: str = None) -> None:
+        with self._lock:
+            self._job["progress"] = value
+            if text:
+                self._job["message"] = text
+
+
+class IndexingJobManager:
+    """
+    esegue indicizzazione e ricostruzione in un thread separato dallo script streamlit.
+    un solo job alla volta per indice (single-flight): tra i thread del processo con un lock,
+    tra processi diversi con un lock su file in config.STATE_DIR. l'avanzamento è condiviso tra le sessioni,
+    i job possono essere annullati e la cronologia con il throughput viene salvata su file.
+    """
+
+    def __init__(self, history_size: int):
+        self.history_size = history_size
+        self._lock = threading.Lock()
+        self._active: Dict[str, Dict[str, Any]] = {}
+        self._events: Dict[str, threading.Event] = {}
+        self._history: List[Dict[str, Any]] = []
+        self._history_stamp: Optional[int] = None
+
+    @staticmethod
+    def _index_key() -> str:
+        return f"{config.SEARCH_BACKEND}_{config.INDEX_NAME}"
+
+    def _history_path(self) -> Path:
+        return Path(config.STATE_DIR) / f"jobs_{self._index_key()}.json"
+
+    def _load_history(self) -> List[Dict[str, Any]]:
+        """cronologia dei job terminati, riletta dal file solo se un processo l'ha modificata"""
+        try:
+            stamp = os.stat(self._history_path()).st_mtime_ns
+        except OSError:
+            stamp = None
+        if stamp != self._history_stamp:
+            try:
+                with open(self._history_path(), "r", encoding="utf-8") as file:
+                    self._history = json.load(file)
+            except (OSError, ValueError):
+                self._history = []
+            self._history_stamp = stamp
+        return self._history
+
+    def _append_history(self, job: Dict[str, Any]) -> None:
+        """
+        aggiunge un job alla cronologia rileggendo il file sotto un lock su file, così i processi che
+        condividono config.STATE_DIR non sovrascrivono i job registrati dagli altri.
+        """
+
+        path = self._history_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path.with_suffix(".history.lock"), "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            history = list(self._load_history())
+            history.append(job)
+            del history[:-self.history_size]
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(history, file, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+            self._history = history
+            self._history_stamp = os.stat(path).st_mtime_ns
+
+    def _acquire_process_lock(self):
+        """lock su file tra processi diversi (es. più repliche dell'app sulla stessa directory di stato)"""
+        if fcntl is None:
+            return None
+        Path(config.STATE_DIR).mkdir(parents=True, exist_ok=True)
+        lock_file = open(Path(config.STATE_DIR) / f"jobs_{self._index_key()}.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise
+        return lock_file
+
+    def _begin(self, kind: str) -> Tuple[Dict[str, Any], Optional[threading.Event], Any]:
+        """
+        registra un job come attivo sull'indice, se non ce n'è già uno in questo o in un altro processo.
+
+        :return: stato del job, evento di annullamento e lock su file; evento None se il job non è partito
+        """
+
+        key = self._index_key()
+        with self._lock:
+            active = self._active.get(key)
+            if active is not None:
+                return dict(active), None, None
+            try:
+                lock_file = self._acquire_process_lock()
+            except OSError:
+                return {"status": "running", "kind": kind, "message": "Indicizzazione in corso in un altro processo",
+                        "progress": 0.0}, None, None
+            job = {
+                "id": uuid.uuid4().hex[:12],
+                "kind": kind,
+                "index": config.INDEX_NAME,
+                "backend": config.SEARCH_BACKEND,
+                "status": "running",
+                "progress": 0.0,
+                "message": "Avvio...",
+                "started_at": datetime.now().isoformat(timespec="seconds"),
+                "finished_at": None
+            }
+            cancel_event = threading.Event()
+            self._active[key] = job
+            self._events[job["id"]] = cancel_event
+            return job, cancel_event, lock_file
+
+    def _finish(self, job: Dict[str, Any], result: Dict[str, Any], start: float, lock_file,
+                record: bool = True) -> None:
+        """rilascia il lock, aggiorna lo stato finale del job e lo aggiunge alla cronologia"""
+        if lock_file is not None:
+            lock_file.close()
+        with self._lock:
+            if result["success"]:
+                job["status"] = "completed"
+            else:
+                job["status"] = "cancelled" if result.get("cancelled") else "failed"
+                job["error"] = result.get("error")
+            job["progress"] = 1.0 if result["success"] else job["progress"]
+            job["finished_at"] = datetime.now().isoformat(timespec="seconds")
+            job["seconds"] = time.time() - start
+            for field in ("indexed_docs", "deleted_docs", "errors", "docs_per_second", "mb_per_second", "index",
+                          "summary"):
+                if field in result:
+                    job[field] = result[field]
+            if record:
+                try:
+                    self._append_history(dict(job))
+                except OSError as e:
+                    logger_index_txt.error(f"Salvataggio cronologia job fallito: {e}")
+            self._active.pop(self._index_key(), None)
+            self._events.pop(job["id"], None)
+
+    def start(self, client, kind: str = "index", incremental: bool = True) -> Tuple[Dict[str, Any], bool]:
+        """
+        avvia un job in background, a meno che non ce ne sia già uno attivo sullo stesso indice.
+
+        :param client: client del backend restituito da get_search_client()
+        :param kind: "index" (incrementale), "rebuild" o "restore" (snapshot di config.SNAPSHOT_PATH)
+        :param incremental: per "index", se false reinvia tutti i file
+        :return: stato del job (nuovo o già in corso) e true se è stato avviato ora
+        """
+
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Tipo di job non valido: {kind}")
+        job, cancel_event, lock_file = self._begin(kind)
+        if cancel_event is None:
+            return job, False
+
+        thread = threading.Thread(target=self._run, args=(job, client, incremental, cancel_event, lock_file),
+                                  name=f"indexing-job-{job['id']}", daemon=True)
+        thread.start()
+        logger_index_txt.info(f"Job di indicizzazione '{job['id']}' ({kind}) avviato.")
+        return dict(job), True
+
+    def _run(self, job: Dict[str, Any], client, incremental: bool, cancel_event: threading.Event, lock_file) -> None:
+        progress = JobProgress(job, self._lock)
+        start = time.time()
+        try:
+            if job["kind"] == "rebuild":
+                result = rebuild_index(client, progress, cancel_event=cancel_event)
+            elif job["kind"] == "restore":
+                result = self._restore(client, progress, cancel_event)
+            else:
+                result = run_indexing(client, progress, incremental, cancel_event=cancel_event)
+        except Exception as e:
+            logger_index_txt.error(f"Job di indicizzazione '{job['id']}' fallito: {e}")
+            result = {"success": False, "error": str(e)}
+        self._finish(job, result, start, lock_file)
+        logger_index_txt.info(f"Job di indicizzazione '{job['id']}' terminato: {job['status']}.")
+
+    @staticmethod
+    def _restore(client, progress: JobProgress, cancel_event: threading.Event) -> Dict[str, Any]:
+        """
+        ripristina lo snapshot di config.SNAPSHOT_PATH e poi esegue un'indicizzazione incrementale,
+        che invia solo i file modificati dopo l'export (il manifest viene ripristinato con lo snapshot).
+        """
+
+        result = restore_snapshot(client, config.SNAPSHOT_PATH, progress, cancel_event)
+        if not result["success"]:
+            return result
+        update = run_indexing(client, progress, True, cancel_event=cancel_event)
+        if not update["success"]:
+            logger_index_txt.warning(f"Aggiornamento dopo il ripristino dello snapshot fallito: {update.get('error')}")
+        return {**result, "deleted_docs": update.get("deleted_docs", 0),
+                "indexed_docs": result["indexed_docs"] + update.get("indexed_docs", 0)}
+
+    def run_exclusive(self, kind: str, task: Callable[[threading.Event], Dict[str, Any]],
+                      record: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        esegue task nel thread chiamante con lo stesso lock single-flight dei job (es. i micro-batch del watcher),
+        così non si sovrappone a un'indicizzazione o ricostruzione in corso.
+
+        :param kind: tipo mostrato nello stato del job
+        :param task: funzione che riceve l'evento di annullamento e restituisce un dict con "success"
+        :param record: se true aggiunge il job alla cronologia
+        :return: risultato di task, None se un altro job è attivo
+        """
+
+        job, cancel_event, lock_file = self._begin(kind)
+        if cancel_event is None:
+            return None
+        start = time.time()
+        result = {"success": False, "error": "Interrotto"}
+        try:
+            result = task(cancel_event)
+            return result
+        finally:
+            self._finish(job, result, start, lock_file, record)
+
+    def cancel(self) -> bool:
+        """
+        richiede l'annullamento del job attivo sull'indice. l'indicizzazione si ferma dopo l'azione corrente
+        e il manifest conserva i file già confermati, quindi il job successivo riprende da lì.
+
+        :return: true se c'era un job da annullare
+        """
+
+        with self._lock:
+            job = self._active.get(self._index_key())
+            if job is None:
+                return False
+            job["status"] = "cancelling"
+            self._events[job["id"]].set()
+            return True
+
+    def current(self) -> Optional[Dict[str, Any]]:
+        """copia dello stato del job attivo sull'indice, None se non ce ne sono"""
+        with self._lock:
+            job = self._active.get(self._index_key())
+            return dict(job) if job is not None else None
+
+    def history(self) -> List[Dict[str, Any]]:
+        """job terminati sull'indice, dal più recente"""
+        with self._lock:
+            return [dict(job) for job in reversed(self._load_history())]
+
+    def wait(self, timeout: float = None) -> Optional[Dict[str, Any]]:
+        """attende la fine del job attivo (uso da script e benchmark) e restituisce l'ultimo job terminato"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.current() is not None:
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            time.sleep(0.1)
+        history = self.history()
+        return history[0] if history else None
+
+
+job_manager = IndexingJobManager(config.JOB_HISTORY_SIZE)
@@ -0,0 +1,551 @@
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.business.operation_file import document_id, iter_passages, iter_txt_files
+from app.models.models import config, PREVIEW_CHARS
+from app.utils.logger_config import logger_index_txt
+
+MAGIC = b"FTXIDX01"
+TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+BM25_K1 = 1.2
+BM25_B = 0.75
+NAME_BOOST = 5.0
+NAME_KEYWORD_BOOST = 10.0
+NAME_INFIX_BOOST = 3.0
+FRAGMENT_SIZE = 150
+
+
+def fold(token: str) -> str:
+    """
+    normalizza un token come gli analyzer dell'indice: minuscolo e senza accenti (asciifolding).
+
+    :param token: token originale
+    :return: token normalizzato
+    """
+
+    decomposed = unicodedata.normalize("NFKD", token.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    divide il testo in token normalizzati.
+
+    :param text: testo da analizzare
+    :return: lista di token
+    """
+
+    return [fold(match.group()) for match in TOKEN_RE.finditer(text)]
+
+
+def fuzzy_distance(term: str) -> int:
+    """distanza massima ammessa come fuzziness AUTO di elasticsearch"""
+    if len(term) <= 2:
+        return 0
+    return 1 if len(term) <= 5 else 2
+
+
+def bounded_levenshtein(first: str, second: str, limit: int) -> int:
+    """
+    distanza di levenshtein con interruzione anticipata oltre limit.
+
+    :return: distanza, oppure limit + 1 se la supera
+    """
+
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    previous = list(range(len(second) + 1))
+    for i, char_first in enumerate(first, 1):
+        current = [i]
+        for j, char_second in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_first != char_second)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def local_index_path() -> str:
+    """percorso del file dell'indice locale"""
+    return config.LOCAL_INDEX_PATH or os.path.join(config.STATE_DIR, f"local_{config.INDEX_NAME}.idx")
+
+
+def build_local_index(directory_path: str, path: str, manifest: Dict[str, Dict[str, Any]] = None,
+                      cancel_event: threading.Event = None) -> Optional[Dict[str, Any]]:
+    """
+    costruisce l'indice invertito locale dei file .txt e lo salva in un unico file binario:
+    header json (documenti, vocabolario, offset) seguito da array uint32 di postings e posizioni
+    e dal testo dei passaggi in utf-8, da cui la ricerca legge anteprime e frammenti senza riaprire
+    i file originali. i file vengono letti a passaggi e il testo passa da un file temporaneo,
+    quindi la memoria dipende dal vocabolario e non dal singolo file.
+
+    :param directory_path: directory da indicizzare
+    :param path: file dell'indice da scrivere
+    :param manifest: se indicato viene riempito con size e mtime dei file indicizzati
+    :param cancel_event: se impostato interrompe la costruzione lasciando invariato l'indice esistente
+    :return: dict con documenti e termini indicizzati, None se annullata
+    """
+
+    docs: List[List[Any]] = []
+    postings: Dict[str, List[Tuple[int, array]]] = defaultdict(list)
+    doc_passage, passage_start = array("I", [0]), array("Q")
+    text_length = 0
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    text_path = f"{path}.text.tmp"
+    with open(text_path, "wb") as text_file:
+        for file_path, stat in iter_txt_files(directory_path):
+            if cancel_event is not None and cancel_event.is_set():
+                os.remove(text_path)
+                return None
+            doc_positions: Dict[str, array] = defaultdict(lambda: array("I"))
+            doc_passages = array("Q")
+            position = 0
+            try:
+                for passage in iter_passages(file_path, config.PASSAGE_MAX_BYTES):
+                    for token in tokenize(passage):
+                        doc_positions[token].append(position)
+                        position += 1
+                    encoded = passage.encode("utf-8", "surrogatepass")
+                    doc_passages.append(text_length)
+                    text_file.write(encoded)
+                    text_length += len(encoded)
+            except Exception as e:
+                # il testo già scritto resta nel file ma non è referenziato da nessun documento
+                logger_index_txt.error(f"Errore nel file {file_path}: {e}")
+                continue
+            passage_start.extend(doc_passages)
+            doc_passage.append(len(passage_start))
+            _add_document(docs, postings, manifest, file_path, stat, position, doc_positions)
+    passage_start.append(text_length)
+
+    terms = sorted(postings)
+    term_start, post_docs, post_tf, pos_start, positions = (array("I"), array("I"), array("I"), array("I"),
+                                                            array("I"))
+    for term in terms:
+        term_start.append(len(post_docs))
+        for doc_number, doc_positions in postings[term]:
+            post_docs.append(doc_number)
+            post_tf.append(len(doc_positions))
+            pos_start.append(len(positions))
+            positions.extend(doc_positions)
+    term_start.append(len(post_docs))
+    pos_start.append(len(positions))
+
+    sections, offset = {}, 0
+    blobs = [("term_start", term_start), ("post_docs", post_docs), ("post_tf", post_tf),
+             ("pos_start", pos_start), ("positions", positions), ("doc_passage", doc_passage),
+             ("passage_start", passage_start)]
+    for name, values in blobs:
+        offset += -offset % 8
+        sections[name] = [offset, len(values), values.typecode]
+        offset += len(values) * values.itemsize
+    offset += -offset % 8
+    sections["text"] = [offset, text_length, "B"]
+    total_length = sum(doc[2] for doc in docs)
+    header = json.dumps({
+        "docs": docs,
+        "terms": terms,
+        "avgdl": total_length / len(docs) if docs else 0.0,
+        "sections": sections
+    }).encode("utf-8")
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % 8)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(MAGIC)
+        file.write(struct.pack("<Q", len(header)))
+        file.write(header)
+        data_start = file.tell()
+        for name, values in blobs:
+            file.write(b"\0" * (data_start + sections[name][0] - file.tell()))
+            values.tofile(file)
+        file.write(b"\0" * (data_start + sections["text"][0] - file.tell()))
+        with open(text_path, "rb") as text_file:
+            shutil.copyfileobj(text_file, file)
+    os.remove(text_path)
+    os.replace(tmp_path, path)
+    return {"docs": len(docs), "terms": len(terms), "postings": len(post_docs)}
+
+
+def _add_document(docs: List[List[Any]], postings: Dict[str, List[Tuple[int, array]]],
+                  manifest: Optional[Dict[str, Dict[str, Any]]], file_path: str, stat: os.stat_result,
+                  length: int, doc_positions: Dict[str, array]) -> None:
+    """aggiunge un file letto per intero a documenti, postings e manifest di build_local_index()"""
+    doc_number = len(docs)
+    docs.append([file_path, os.path.basename(file_path), length])
+    if manifest is not None:
+        manifest[file_path] = {"size": stat.st_size, "mtime": stat.st_mtime}
+    for token, positions in doc_positions.items():
+        postings[token].append((doc_number, positions))
+
+
+class LocalIndex:
+    """
+    indice invertito in memoria mappata: i postings e il testo dei documenti restano nel file e vengono
+    letti on demand, in memoria vengono caricati solo documenti, vocabolario e l'indice dei nomi file.
+    gli indici scritti prima del testo nel file leggono anteprime e frammenti dai file originali.
+    quando il file viene sostituito l'istanza viene ritirata e la mappatura chiusa appena
+    terminano le ricerche che la stanno usando (vedi open_local_index()).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime
+        self._users = 0
+        self._retired = False
+        self._lock = threading.Lock()
+        with open(path, "rb") as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"File indice locale non valido: {path}")
+        header_length = struct.unpack("<Q", self._mm[len(MAGIC):len(MAGIC) + 8])[0]
+        data_start = len(MAGIC) + 8 + header_length
+        header = json.loads(self._mm[len(MAGIC) + 8:data_start])
+
+        self.docs = header["docs"]
+        self.terms = header["terms"]
+        self.avgdl = header["avgdl"] or 1.0
+        self.term_ids = {term: term_id for term_id, term in enumerate(self.terms)}
+        self._views = [memoryview(self._mm)]
+        for name, (offset, count, *typecode) in header["sections"].items():
+            typecode = typecode[0] if typecode else "I"
+            itemsize = array(typecode).itemsize
+            section = self._views[0][data_start + offset:data_start + offset + count * itemsize]
+            self._views.append(section)
+            self._views.append(section.cast(typecode))
+            setattr(self, name, self._views[-1])
+        self.has_text = "text" in header["sections"]
+
+        self.doc_ids = [document_id(doc[0]) for doc in self.docs]
+        self.doc_numbers = {doc_id: number for number, doc_id in enumerate(self.doc_ids)}
+        self.names_folded = [fold(doc[1]) for doc in self.docs]
+        self.name_docs: Dict[str, List[int]] = defaultdict(list)
+        for number, doc in enumerate(self.docs):
+            self.name_docs[doc[1]].append(number)
+        self.name_postings: Dict[str, List[int]] = defaultdict(list)
+        self.name_trigrams: Dict[str, set] = defaultdict(set)
+        for number, name in enumerate(self.names_folded):
+            for token in set(tokenize(name)):
+                self.name_postings[token].append(number)
+            for start in range(len(name) - 2):
+                self.name_trigrams[name[start:start + 3]].add(number)
+        self.name_terms = sorted(self.name_postings)
+
+    @property
+    def doc_count(self) -> int:
+        return len(self.docs)
+
+    def acquire(self) -> None:
+        """registra una ricerca in corso sull'istanza"""
+        with self._lock:
+            self._users += 1
+
+    def release(self) -> None:
+        """termina una ricerca; chiude la mappatura se l'istanza è stata ritirata e non ha altri utenti"""
+        with self._lock:
+            self._users -= 1
+            close = self._retired and self._users == 0
+        if close:
+            self.close()
+
+    def retire(self) -> None:
+        """segnala che il file è stato sostituito: la mappatura viene chiusa appena non è più in uso"""
+        with self._lock:
+            self._retired = True
+            close = self._users == 0
+        if close:
+            self.close()
+
+    def close(self) -> None:
+        """rilascia le viste sui postings e chiude la mappatura del file"""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mm.close()
+
+    def _idf(self, doc_freq: int) -> float:
+        return math.log(1 + (self.doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    @staticmethod
+    def _expand(term: str, vocabulary: List[str], fuzzy: bool) -> List[Tuple[str, float]]:
+        """termini del vocabolario entro la fuzziness AUTO (prefix_length 1), con peso decrescente"""
+        if not fuzzy or fuzzy_distance(term) == 0:
+            return [(term, 1.0)]
+        limit = fuzzy_distance(term)
+        expanded = []
+        start = bisect_left(vocabulary, term[0])
+        for candidate in vocabulary[start:]:
+            if not candidate.startswith(term[0]):
+                break
+            distance = bounded_levenshtein(term, candidate, limit)
+            if distance <= limit:
+                expanded.append((candidate, 1.0 / (1 + distance)))
+        return expanded or [(term, 1.0)]
+
+    def _term_postings(self, term: str):
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return None
+        start, end = self.term_start[term_id], self.term_start[term_id + 1]
+        return start, end
+
+    def _positions(self, posting: int) -> memoryview:
+        return self.positions[self.pos_start[posting]:self.pos_start[posting + 1]]
+
+    def _content_scores(self, query: str, fuzzy: bool) -> Tuple[Dict[int, float], Dict[int, int], List[str]]:
+        """punteggio bm25 sul contenuto; restituisce anche la prima posizione utile per l'highlight"""
+        scores: Dict[int, float] = defaultdict(float)
+        first_position: Dict[int, int] = {}
+        matched_terms = []
+        for term in tokenize(query):
+            for expanded, weight in self._expand(term, self.terms, fuzzy):
+                postings = self._term_postings(expanded)
+                if postings is None:
+                    continue
+                matched_terms.append(expanded)
+                start, end = postings
+                idf = self._idf(end - start)
+                for posting in range(start, end):
+                    doc_number, tf = self.post_docs[posting], self.post_tf[posting]
+                    length = self.docs[doc_number][2]
+                    norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / self.avgdl))
+                    scores[doc_number] += weight * idf * norm
+                    position = self.positions[self.pos_start[posting]]
+                    if position < first_position.get(doc_number, position + 1):
+                        first_position[doc_number] = position
+        return scores, first_position, matched_terms
+
+    def _phrase_scores(self, query: str, slop: int) -> Tuple[Dict[int, float], Dict[int, int], List[str]]:
+        """documenti che contengono i termini in sequenza, con una tolleranza di slop posizioni"""
+        terms = tokenize(query)
+        ranges = [self._term_postings(term) for term in terms]
+        if not terms or any(postings is None for postings in ranges):
+            return {}, {}, []
+        per_term = []
+        for start, end in ranges:
+            per_term.append({self.post_docs[posting]: posting for posting in range(start, end)})
+        candidates = set.intersection(*(set(docs) for docs in per_term))
+        scores, first_position = {}, {}
+        idf = sum(self._idf(end - start) for start, end in ranges)
+        for doc_number in candidates:
+            position_sets = [set(self._positions(postings[doc_number])) for postings in per_term]
+            matches = 0
+            for anchor in self._positions(per_term[0][doc_number]):
+                if all(any(anchor + offset + shift in position_sets[offset] for shift in range(-slop, slop + 1))
+                       for offset in range(1, len(terms))):
+                    matches += 1
+                    first_position.setdefault(doc_number, anchor)
+            if matches:
+                length = self.docs[doc_number][2]
+                scores[doc_number] = idf * matches * (BM25_K1 + 1) / (
+                    matches + BM25_K1 * (1 - BM25_B + BM25_B * length / self.avgdl))
+        return scores, first_position, terms
+
+    def _name_scores(self, query: str) -> Tuple[Dict[int, float], List[str]]:
+        """nome file: token con fuzziness, nome esatto (keyword) e sottostringa tramite trigrammi"""
+        scores: Dict[int, float] = defaultdict(float)
+        matched_terms = []
+        for term in tokenize(query):
+            for expanded, weight in self._expand(term, self.name_terms, True):
+                docs = self.name_postings.get(expanded)
+                if not docs:
+                    continue
+                matched_terms.append(expanded)
+                idf = self._idf(len(docs))
+                for doc_number in docs:
+                    scores[doc_number] += NAME_BOOST * weight * idf
+
+        folded_query = fold(query.strip())
+        for doc_number in self.name_docs.get(query.strip(), ()):
+            scores[doc_number] += NAME_KEYWORD_BOOST * self._idf(1)
+        if len(folded_query) >= 3:
+            trigram_sets = [self.name_trigrams.get(folded_query[i:i + 3], set()) for i in
+                            range(len(folded_query) - 2)]
+            candidates = set.intersection(*trigram_sets) if trigram_sets else set()
+        else:
+            candidates = range(self.doc_count) if folded_query else []
+        for doc_number in candidates:
+            if folded_query in self.names_folded[doc_number]:
+                scores[doc_number] += NAME_INFIX_BOOST
+        return scores, matched_terms
+
+    def _passages(self, doc_number: int) -> Iterator[str]:
+        """passaggi del documento dal testo salvato nell'indice, o dal file originale per gli indici precedenti"""
+        if not self.has_text:
+            yield from iter_passages(self.docs[doc_number][0], config.PASSAGE_MAX_BYTES)
+            return
+        for passage in range(self.doc_passage[doc_number], self.doc_passage[doc_number + 1]):
+            yield str(self.text[self.passage_start[passage]:self.passage_start[passage + 1]], "utf-8",
+                      "surrogatepass")
+
+    def _content_fragment(self, doc_number: int, position: int, terms: set) -> str:
+        """legge il documento a passaggi fino alla posizione indicata e costruisce il frammento con <mark>"""
+        token_number = 0
+        for passage in self._passages(doc_number):
+            spans = [match.span() for match in TOKEN_RE.finditer(passage)]
+            if position < token_number + len(spans):
+                center = spans[position - token_number][0]
+                start = max(0, center - FRAGMENT_SIZE // 2)
+                end = min(len(passage), start + FRAGMENT_SIZE)
+                return mark_terms(passage[start:end], terms)
+            token_number += len(spans)
+        return ""
+
+    def _preview(self, doc_number: int) -> str:
+        preview = ""
+        for passage in self._passages(doc_number):
+            preview += passage
+            if len(preview) >= PREVIEW_CHARS:
+                break
+        return preview[:PREVIEW_CHARS]
+
+    def _highlight(self, hit: Dict[str, Any], doc_number: int, first_position: Dict[int, int],
+                   content_terms: List[str]) -> None:
+        """anteprima e frammento del contenuto; con un indice precedente un file sparito lascia l'anteprima vuota"""
+        try:
+            hit["_source"]["anteprima"] = self._preview(doc_number)
+            if doc_number in first_position:
+                fragment = self._content_fragment(doc_number, first_position[doc_number], set(content_terms))
+                if fragment:
+                    hit["highlight"]["contenuto_file"] = [fragment]
+        except OSError as e:
+            logger_index_txt.warning(f"Testo non disponibile per {self.docs[doc_number][0]}: {e}")
+
+    def search(self, query_nome_file: str, query_contenuto: str, is_phrase_query: bool = False,
+               selected_sources: List[str] = None, page: int = 1, page_size: int = 10) -> Dict[str, Any]:
+        """
+        esegue la ricerca combinata (should) su nome file e contenuto e restituisce un dict
+        con la stessa forma di search_documents(), hit compresi.
+        """
+
+        start = time.time()
+        scores: Dict[int, float] = defaultdict(float)
+        first_position: Dict[int, int] = {}
+        content_terms, name_terms, name_scores = [], [], {}
+        if query_nome_file:
+            name_scores, name_terms = self._name_scores(query_nome_file)
+            for doc_number, score in name_scores.items():
+                scores[doc_number] += score
+        if query_contenuto:
+            if is_phrase_query:
+                content_scores, first_position, content_terms = self._phrase_scores(query_contenuto, 2)
+            else:
+                content_scores, first_position, content_terms = self._content_scores(query_contenuto, True)
+            for doc_number, score in content_scores.items():
+                scores[doc_number] += score
+
+        if selected_sources:
+            allowed = set(selected_sources)
+            scores = {doc_number: score for doc_number, score in scores.items() if self.docs[doc_number][1] in allowed}
+
+        ranked = heapq.nlargest(page * page_size, scores.items(), key=lambda item: item[1])
+        hits = []
+        for doc_number, score in ranked[(page - 1) * page_size:]:
+            path, name, _ = self.docs[doc_number]
+            hit = {
+                "_id": self.doc_ids[doc_number],
+                "_score": score,
+                "_source": {"nome_file": name, "percorso_completo": path, "id_file": self.doc_ids[doc_number],
+                            "numero_passaggio": None, "anteprima": ""},
+                "highlight": {}
+            }
+            self._highlight(hit, doc_number, first_position, content_terms)
+            if doc_number in name_scores:
+                hit["highlight"]["nome_file"] = [mark_terms(name, set(name_terms))]
+            hits.append(hit)
+
+        sources = Counter(self.docs[doc_number][1] for doc_number in scores).most_common(20)
+        aggregations = {"sources": {"buckets": [{"key": key, "doc_count": count} for key, count in sources]}}
+        return {"success": True, "hits": hits, "total_hits": len(scores), "aggregations": aggregations,
+                "time": time.time() - start}
+
+    def get_content(self, doc_ids: List[str]) -> Dict[str, str]:
+        """contenuto completo dei documenti, dal testo salvato nell'indice (o dai file per gli indici precedenti)"""
+        contents = {}
+        for doc_id in doc_ids:
+            doc_number = self.doc_numbers.get(doc_id)
+            if doc_number is None:
+                continue
+            try:
+                contents[doc_id] = "".join(self._passages(doc_number))
+            except OSError as e:
+                logger_index_txt.warning(f"Testo non disponibile per {self.docs[doc_number][0]}: {e}")
+        return contents
+
+
+def mark_terms(text: str, terms: set) -> str:
+    """
+    racchiude tra <mark></mark> i token del testo che corrispondono ai termini normalizzati.
+
+    :param text: testo originale
+    :param terms: termini normalizzati da evidenziare
+    :return: testo con highlight
+    """
+
+    return TOKEN_RE.sub(lambda match: f"<mark>{match.group()}</mark>" if fold(match.group()) in terms
+                        else match.group(), text)
+
+
+_loaded: Dict[str, LocalIndex] = {}
+_loaded_lock = threading.Lock()
+
+
+def _current_index(path: str) -> Optional[LocalIndex]:
+    if not os.path.exists(path):
+        return None
+    current = _loaded.get(path)
+    if current is None or current.mtime != os.stat(path).st_mtime:
+        previous, current = current, LocalIndex(path)
+        _loaded[path] = current
+        if previous is not None:
+            previous.retire()
+    return current
+
+
+def load_local_index(path: str = None) -> Optional[LocalIndex]:
+    """
+    restituisce l'indice locale condiviso dal processo, ricaricandolo se il file è cambiato.
+    per leggere i postings usare open_local_index(), che impedisce la chiusura della mappatura durante l'uso.
+
+    :param path: file dell'indice (default local_index_path())
+    :return: indice locale, None se il file non esiste
+    """
+
+    with _loaded_lock:
+        return _current_index(path or local_index_path())
+
+
+@contextmanager
+def open_local_index(path: str = None) -> Iterator[Optional[LocalIndex]]:
+    """
+    come load_local_index(), tenendo aperta la mappatura dell'indice fino all'uscita dal blocco with
+    anche se nel frattempo il file viene sostituito e ricaricato.
+
+    :param path: file dell'indice (default local_index_path())
+    :return: indice locale, None se il file non esiste
+    """
+
+    with _loaded_lock:
+        index = _current_index(path or local_index_path())
+        if index is not None:
+            index.acquire()
+    try:
+        yield index
+    finally:
+        if index is not None:
+            index.release()
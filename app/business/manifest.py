@@ -0,0 +1,66 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Any
+
+from app.business.dedup import dedup_store_path
+from app.models.models import config
+from app.utils.logger_config import logger_index_txt
+
+
+def manifest_path(index_name: str) -> Path:
+    """
+    restituisce il percorso del manifest associato a un indice.
+
+    :param index_name: nome dell'indice elasticsearch
+    :return: percorso del file json del manifest
+    """
+
+    return Path(config.STATE_DIR) / f"manifest_{index_name}.json"
+
+
+def load_manifest(index_name: str) -> Dict[str, Dict[str, Any]]:
+    """
+    carica il manifest dei file già indicizzati (percorso -> size, mtime, hash).
+    se il file non esiste o non è leggibile restituisce un manifest vuoto.
+
+    :param index_name: nome dell'indice elasticsearch
+    :return: dizionario percorso -> metadati del file
+    """
+
+    path = manifest_path(index_name)
+    if not path.exists():
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except Exception as e:
+        logger_index_txt.warning(f"Manifest '{path}' non leggibile, verrà ricostruito: {e}")
+        return {}
+
+
+def save_manifest(index_name: str, manifest: Dict[str, Dict[str, Any]]) -> None:
+    """
+    salva il manifest su disco in modo atomico (scrittura su file temporaneo e rename).
+
+    :param index_name: nome dell'indice elasticsearch
+    :param manifest: dizionario percorso -> metadati del file
+    """
+
+    path = manifest_path(index_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, path)
+
+
+def delete_manifest(index_name: str) -> None:
+    """
+    elimina il manifest associato a un indice e l'archivio delle impronte di deduplicazione, se presenti.
+
+    :param index_name: nome dell'indice elasticsearch
+    """
+
+    manifest_path(index_name).unlink(missing_ok=True)
+    dedup_store_path(index_name).unlink(missing_ok=True)
@@ -1,21 +1,68 @@
-def get_mapping():
+from app.models.models import config
+
+HIGHLIGHT_MODES = ("reanalyze", "offsets")
+FILENAME_MODES = ("ngram", "edge_ngram", "wildcard")
+
+
+def _filename_analysis(filename_mode: str):
+    """
+    restituisce tokenizer, analyzer e sottocampo di nome_file usati per la ricerca parziale sul nome.
+    "ngram" è il mapping originale (ngram 2-20 su tutto il nome), "edge_ngram" indicizza solo i prefissi
+    delle parole, "wildcard" usa un campo wildcard per le corrispondenze all'interno del nome.
+
+    :param filename_mode: "ngram", "edge_ngram" o "wildcard"
+    :return: tupla (tokenizer, analyzer, sottocampi)
+    """
+
+    if filename_mode == "ngram":
+        return (
+            {"ngram_tokenizer": {"type": "ngram", "min_gram": 2, "max_gram": 20, "token_chars": ["letter", "digit"]}},
+            {"ngram_analyzer": {"type": "custom", "tokenizer": "ngram_tokenizer",
+                                "filter": ["lowercase", "asciifolding"]}},
+            {"ngram": {"type": "text", "analyzer": "ngram_analyzer"}}
+        )
+    if filename_mode == "edge_ngram":
+        return (
+            {"prefix_tokenizer": {"type": "edge_ngram", "min_gram": 2, "max_gram": 20,
+                                  "token_chars": ["letter", "digit"]}},
+            {
+                "prefix_analyzer": {"type": "custom", "tokenizer": "prefix_tokenizer",
+                                    "filter": ["lowercase", "asciifolding"]},
+                "prefix_search_analyzer": {"type": "custom", "tokenizer": "standard",
+                                           "filter": ["lowercase", "asciifolding"]}
+            },
+            {"prefix": {"type": "text", "analyzer": "prefix_analyzer", "search_analyzer": "prefix_search_analyzer"}}
+        )
+    if filename_mode == "wildcard":
+        return {}, {}, {"wildcard": {"type": "wildcard"}}
+    raise ValueError(f"Modalità nome file non valida: {filename_mode}")
+
+
+def get_mapping(highlight_mode: str = None, filename_mode: str = None):
     """
     definisce la struttura (mapping) e gli analyzer per l'indice elasticsearch.
+    in modalità highlight "offsets" i campi del contenuto salvano gli offset nelle postings,
+    così l'highlighter unified non deve rianalizzare il testo a ogni query.
+    le modalità scelte sono salvate in _meta, così le ricerche usano i campi dell'indice effettivo.
+    title, summary e link contengono le intestazioni estratte all'indicizzazione (vedi extractors.py).
 
+    :param highlight_mode: "reanalyze" o "offsets" (default config.HIGHLIGHT_MODE)
+    :param filename_mode: "ngram", "edge_ngram" o "wildcard" (default config.FILENAME_MATCH_MODE)
     :return: dizionario di mapping completo
     """
 
+    highlight_mode = highlight_mode or config.HIGHLIGHT_MODE
+    if highlight_mode not in HIGHLIGHT_MODES:
+        raise ValueError(f"Modalità highlight non valida: {highlight_mode}")
+    content_options = {"index_options": "offsets"} if highlight_mode == "offsets" else {}
+
+    filename_mode = filename_mode or config.FILENAME_MATCH_MODE
+    filename_tokenizers, filename_analyzers, filename_fields = _filename_analysis(filename_mode)
+
     return {
         "settings": {
             "analysis": {
-                "tokenizer": {
-                    "ngram_tokenizer": {
-                        "type": "ngram",
-                        "min_gram": 2,
-                        "max_gram": 20,
-                        "token_chars": ["letter", "digit"]
-                    }
-                },
+                "tokenizer": filename_tokenizers,
                 "filter": {
                     "stemmer": {
                         "type": "stemmer",
@@ -38,15 +85,12 @@ def get_mapping():
                         "tokenizer": "keyword",
                         "filter": ["lowercase"]
                     },
-                    "ngram_analyzer": {
-                        "type": "custom",
-                        "tokenizer": "ngram_tokenizer",
-                        "filter": ["lowercase", "asciifolding"]
-                    }
+                    **filename_analyzers
                 },
             }
         },
         "mappings": {
+            "_meta": {"highlight_mode": highlight_mode, "filename_mode": filename_mode},
             "properties": {
                 "nome_file": {
                     "type": "text",
@@ -54,19 +98,27 @@ def get_mapping():
                     "search_analyzer": "search_analyzer",
                     "fields": {
                         "keyword": {"type": "keyword"},
-                        "ngram": {"type": "text", "analyzer": "ngram_analyzer"}
+                        **filename_fields
                     }
                 },
                 "contenuto_file": {
                     "type": "text",
                     "analyzer": "content_analyzer",
                     "search_analyzer": "search_analyzer",
+                    **content_options,
                     "fields": {
-                        "italian": {"type": "text", "analyzer": "italian"},
-                        "english": {"type": "text", "analyzer": "english"}
+                        "italian": {"type": "text", "analyzer": "italian", **content_options},
+                        "english": {"type": "text", "analyzer": "english", **content_options}
                     }
                 },
-                "percorso_completo": {"type": "keyword"}
+                "title": {"type": "text", "analyzer": "content_analyzer", **content_options},
+                "summary": {"type": "text", "analyzer": "content_analyzer", **content_options},
+                "link": {"type": "keyword", "ignore_above": 2048},
+                "duplicate_of": {"type": "keyword"},
+                "percorso_completo": {"type": "keyword"},
+                "anteprima": {"type": "text", "index": False},
+                "id_file": {"type": "keyword"},
+                "numero_passaggio": {"type": "integer"}
             }
         }
     }
@@ -1,46 +1,200 @@
+import re
+import threading
 import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from itertools import chain
 import streamlit as st
-from typing import List
-from elasticsearch import Elasticsearch, helpers
-
-from app.business.operation_file import file_data_generator
+from typing import List, Dict, Any, Iterable, Generator, Tuple, Hashable, Optional
+from elasticsearch import Elasticsearch, helpers, ConnectionError as ESConnectionError, ConnectionTimeout
+
+from app.business.client_manager import client_manager
+from app.business.dedup import load_dedup_store
+from app.business.filename_suggest import record_name_changes, reset_name_journal
+from app.business.manifest import load_manifest, save_manifest, delete_manifest, manifest_path
+from app.business.operation_file import scan_changes, changed_file_generator, deleted_file_generator, \
+    PendingChanges
 from app.models.models import config
 from app.utils.logger_config import logger_index_txt
+from app.utils.metrics import INGEST_STAGE_SECONDS, SEARCH_STAGE_SECONDS, INGEST_DOCS, INGEST_BYTES, INGEST_ERRORS, \
+    INGEST_RETRIES, SEARCH_REQUESTS, SEARCH_PHASES, record_es_timings
 from app.business.mapping import get_mapping
+from app.business.pagination import get_cursor, fetch_page, iter_all_hits, is_cursor_expired
+from app.business.query_builder import build_search_body, build_search_phases
+from app.business.search_cache import search_cache
+
+_index_meta_cache: Dict[str, Tuple[int, float, Dict[str, Any]]] = {}
+DEFAULT_INDEX_META = {"highlight_mode": "reanalyze", "filename_mode": "ngram"}
 
 
 def get_elasticsearch_client():
     """
-     stabilisce e restituisce una connessione al client elasticsearch.
+     restituisce il client elasticsearch condiviso dal client_manager, riutilizzando lo stesso
+     pool di connessioni tra le sessioni. se il cluster non è raggiungibile (o il circuit breaker
+     è aperto) mostra l'errore e restituisce None senza attendere il timeout.
 
     :return: un'istanza di elasticsearch se la connessione ha successo
     """
 
+    client = client_manager.get_client()
+    if client is None:
+        remaining = client_manager.breaker_remaining()
+        if remaining > 0:
+            st.error(f"❌ Elasticsearch non raggiungibile, nuovo tentativo tra {remaining:.0f}s. "
+                     f"{client_manager.last_error}")
+        else:
+            st.error(f"❌ Connessione fallita: {client_manager.last_error}")
+    return client
+
+
+def index_body(bulk_load: bool = False, highlight_mode: str = None, filename_mode: str = None) -> Dict[str, Any]:
+    """
+    costruisce settings e mappings per la creazione di un indice.
+    in modalità bulk_load disattiva refresh e repliche per velocizzare il caricamento iniziale.
+    index.max_ngram_diff viene alzato solo per il sottocampo ngram 2-20 del nome file.
+
+    :param bulk_load: se true usa refresh_interval -1 e zero repliche
+    :param highlight_mode: modalità di highlight passata a get_mapping()
+    :param filename_mode: modalità di ricerca sul nome file passata a get_mapping()
+    :return: body per indices.create
+    """
+
+    mapping = get_mapping(highlight_mode, filename_mode)
+    settings = {"analysis": mapping.get("settings", {}).get("analysis", {})}
+    if mapping["mappings"]["_meta"]["filename_mode"] == "ngram":
+        settings["index.max_ngram_diff"] = 18
+    if bulk_load:
+        settings["index.number_of_replicas"] = 0
+        settings["index.refresh_interval"] = "-1"
+    return {"settings": settings, "mappings": mapping["mappings"]}
+
+
+def get_index_meta(es: Elasticsearch) -> Dict[str, Any]:
+    """
+    legge le modalità (highlight, nome file) salvate nel _meta dell'indice attivo, con una cache
+    invalidata dalla generazione di search_cache e da config.INDEX_META_TTL.
+    gli indici creati prima di _meta usano le modalità originali ("reanalyze", "ngram").
+
+    :param es: client elasticsearch
+    :return: dict con highlight_mode e filename_mode
+    """
+
+    cached = _cached_index_meta()
+    if cached is not None:
+        return cached
     try:
-        client = Elasticsearch(
-            config.ELASTICSEARCH_HOST,
-            verify_certs=False,
-            request_timeout=30,
-        )
-        try:
-            if not client.ping():
-                info = client.info()
-                if not info:
-                    raise ConnectionError("Ping fallito")
-        except Exception:
-            info = client.info()
-            if not info:
-                raise ConnectionError("Connessione fallita")
-        return client
+        return _index_meta_from_mappings(es.indices.get_mapping(index=config.INDEX_NAME))
     except Exception as e:
-        st.error(f"❌ Connessione fallita: {e}")
-        return None
+        logger_index_txt.warning(f"Impossibile leggere _meta dell'indice '{config.INDEX_NAME}': {e}")
+        return dict(DEFAULT_INDEX_META)
+
+
+def _cached_index_meta() -> Optional[Dict[str, Any]]:
+    """_meta in cache se ancora valido per la generazione corrente di search_cache, altrimenti None"""
+    cached = _index_meta_cache.get("meta")
+    if cached is not None and cached[0] == search_cache.generation and cached[1] > time.monotonic():
+        return cached[2]
+    return None
+
+
+def _index_meta_from_mappings(mappings: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    estrae le modalità dal _meta di una risposta get_mapping e le salva nella cache di get_index_meta().
+
+    :param mappings: risposta di indices.get_mapping (sincrona o asincrona)
+    :return: dict con highlight_mode e filename_mode
+    """
+
+    meta = dict(DEFAULT_INDEX_META)
+    meta.update(next(iter(mappings.values()), {}).get("mappings", {}).get("_meta", {}))
+    _index_meta_cache["meta"] = (search_cache.generation, time.monotonic() + config.INDEX_META_TTL, meta)
+    return meta
+
+
+def add_missing_fields(es: Elasticsearch) -> None:
+    """
+    aggiunge all'indice esistente i campi del mapping che non contiene ancora.
+    i campi già presenti non vengono toccati (es. un indice creato con un'altra modalità di highlight
+    resta valido finché non viene ricostruito con rebuild_index()).
+
+    :param es: client elasticsearch
+    """
+
+    properties = get_mapping()["mappings"]["properties"]
+    mappings = es.indices.get_mapping(index=config.INDEX_NAME)
+    existing = next(iter(mappings.values()), {}).get("mappings", {}).get("properties", {})
+    missing = {name: field for name, field in properties.items() if name not in existing}
+    if missing:
+        es.indices.put_mapping(index=config.INDEX_NAME, properties=missing)
+        logger_index_txt.info(f"Campi aggiunti all'indice '{config.INDEX_NAME}': {', '.join(missing)}")
+
+
+def versioned_index_name() -> str:
+    """
+    genera il nome di una nuova generazione dell'indice, es. INDEX_NAME-20250101120000.
+
+    :return: nome dell'indice versionato
+    """
+
+    return f"{config.INDEX_NAME}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+
+
+def list_index_generations(es: Elasticsearch) -> List[str]:
+    """
+    elenca le generazioni versionate dell'indice, dalla più vecchia alla più recente.
+
+    :param es: client elasticsearch
+    :return: lista dei nomi degli indici versionati
+    """
+
+    pattern = re.compile(rf"^{re.escape(config.INDEX_NAME)}-\d{{14}}$")
+    indices = es.indices.get(index=f"{config.INDEX_NAME}-*", allow_no_indices=True)
+    return sorted(name for name in indices if pattern.match(name))
+
+
+def current_index(es: Elasticsearch) -> str:
+    """
+    risolve l'indice concreto puntato dall'alias config.INDEX_NAME.
+    per gli indici creati prima degli alias restituisce config.INDEX_NAME stesso.
+
+    :param es: client elasticsearch
+    :return: nome dell'indice concreto
+    """
+
+    if es.indices.exists_alias(name=config.INDEX_NAME):
+        return sorted(es.indices.get_alias(name=config.INDEX_NAME))[-1]
+    return config.INDEX_NAME
+
 
+def swap_alias(es: Elasticsearch, new_index: str) -> None:
+    """
+    sposta in modo atomico l'alias config.INDEX_NAME sul nuovo indice.
+    se config.INDEX_NAME è ancora un indice concreto (versione precedente agli alias) viene rimosso
+    nella stessa operazione, così le ricerche non vedono mai un indice mancante.
+
+    :param es: client elasticsearch
+    :param new_index: indice su cui spostare l'alias
+    """
+
+    actions = [{"add": {"index": new_index, "alias": config.INDEX_NAME, "is_write_index": True}}]
+    if es.indices.exists_alias(name=config.INDEX_NAME):
+        for old_index in es.indices.get_alias(name=config.INDEX_NAME):
+            if old_index != new_index:
+                actions.insert(0, {"remove": {"index": old_index, "alias": config.INDEX_NAME}})
+    elif es.indices.exists(index=config.INDEX_NAME):
+        logger_index_txt.warning(f"Indice concreto '{config.INDEX_NAME}' sostituito dall'alias.")
+        actions.append({"remove_index": {"index": config.INDEX_NAME}})
+    es.indices.update_aliases(actions=actions)
+    if actions[-1].get("remove_index"):
+        delete_manifest(config.INDEX_NAME)
+    reset_name_journal()
+    logger_index_txt.info(f"Alias '{config.INDEX_NAME}' spostato su '{new_index}'.")
 
 
 def create_index(es: Elasticsearch) -> bool:
     """
-    creazione dell'indice su elasticsearch se non esiste già
+    creazione dell'indice su elasticsearch se non esiste già.
+    l'indice viene creato come prima generazione versionata, raggiungibile tramite l'alias config.INDEX_NAME.
 
     :param es: l'istanza del client elasticsearch.
     :return: true se l'indice è stato creato, false se esisteva già.
@@ -48,54 +202,442 @@ def create_index(es: Elasticsearch) -> bool:
 
     try:
         if not es.indices.exists(index=config.INDEX_NAME):
-            es.indices.create(
-                index=config.INDEX_NAME,
-                body={
-                    "settings": {
-                        "index.max_ngram_diff": 18,
-                        "analysis": get_mapping().get("settings", {}).get("analysis", {})
-                    },
-                    "mappings": get_mapping()["mappings"]
-                }
-            )
-            logger_index_txt.info(f"Indice '{config.INDEX_NAME}' creato con max_ngram_diff=18.")
+            new_index = versioned_index_name()
+            body = index_body()
+            body["aliases"] = {config.INDEX_NAME: {"is_write_index": True}}
+            es.indices.create(index=new_index, body=body)
+            logger_index_txt.info(f"Indice '{new_index}' creato con alias '{config.INDEX_NAME}'.")
             return True
         else:
+            add_missing_fields(es)
             logger_index_txt.info(f"Indice '{config.INDEX_NAME}' già esistente.")
             return False
     except Exception as e:
         logger_index_txt.error(f"Errore creazione indice: {e}")
         raise
 
-def run_indexing(es: Elasticsearch, progress_bar=None):
+
+def purge_legacy_documents(es: Elasticsearch, index_name: str) -> int:
+    """
+    elimina i documenti scritti prima del manifest (id casuali, senza id_file) da un indice esistente
+    che non ha ancora un manifest: l'indicizzazione li reinvierebbe con l'id stabile lasciando le copie
+    vecchie, quindi ogni file comparirebbe due volte e il collapse su id_file non le raggrupperebbe.
+
+    :param es: client elasticsearch
+    :param index_name: indice concreto da controllare
+    :return: numero di documenti eliminati
+    """
+
+    if manifest_path(index_name).exists():
+        return 0
+    res = es.delete_by_query(index=index_name, query={"bool": {"must_not": {"exists": {"field": "id_file"}}}},
+                             conflicts="proceed", refresh=True)
+    deleted = res.get("deleted", 0)
+    if deleted:
+        logger_index_txt.warning(f"Eliminati {deleted} documenti senza id_file da '{index_name}' (indice senza "
+                                 f"manifest): i file vengono reinviati con id stabile.")
+    return deleted
+
+
+def delete_old_generations(es: Elasticsearch, keep: int = None) -> List[str]:
+    """
+    elimina le generazioni più vecchie dell'indice, mantenendo quella attiva e le keep precedenti per il rollback.
+
+    :param es: client elasticsearch
+    :param keep: numero di generazioni precedenti da conservare (default config.INDEX_GENERATIONS_TO_KEEP)
+    :return: lista degli indici eliminati
+    """
+
+    keep = config.INDEX_GENERATIONS_TO_KEEP if keep is None else keep
+    active = current_index(es)
+    old_generations = [name for name in list_index_generations(es) if name != active]
+    to_delete = old_generations[:max(len(old_generations) - keep, 0)]
+    for name in to_delete:
+        es.indices.delete(index=name)
+        delete_manifest(name)
+        logger_index_txt.info(f"Generazione '{name}' eliminata.")
+    return to_delete
+
+def _estimate_action_bytes(action: Dict[str, Any]) -> int:
+    """
+    stima la dimensione serializzata di un'azione bulk senza serializzarla.
+
+    :param action: azione bulk
+    :return: numero di byte approssimato
+    """
+
+    source = action.get("_source") or {}
+    return sum(len(value) for value in source.values() if isinstance(value, str)) + 100
+
+
+def bulk_batches(actions: Iterable[Dict[str, Any]], max_docs: int, max_bytes: int) \
+        -> Generator[Tuple[List[Dict[str, Any]], int], None, None]:
+    """
+    raggruppa le azioni in batch chiusi al raggiungimento del numero massimo di documenti
+    o della dimensione massima in byte, quale dei due arriva prima.
+
+    :param actions: azioni bulk
+    :param max_docs: numero massimo di documenti per batch
+    :param max_bytes: dimensione massima stimata per batch
+    :return: coppie (batch, byte stimati)
+    """
+
+    batch, batch_bytes = [], 0
+    for action in actions:
+        size = _estimate_action_bytes(action)
+        if batch and (len(batch) >= max_docs or batch_bytes + size > max_bytes):
+            yield batch, batch_bytes
+            batch, batch_bytes = [], 0
+        batch.append(action)
+        batch_bytes += size
+    if batch:
+        yield batch, batch_bytes
+
+
+def send_bulk_batch(es: Elasticsearch, batch: List[Dict[str, Any]], max_retries: int) \
+        -> List[Tuple[bool, Dict[str, Any]]]:
+    """
+    invia un batch con una singola richiesta bulk. i documenti rifiutati con 429 vengono
+    ritentati da streaming_bulk, mentre timeout ed errori di connessione ritentano l'intero batch
+    con backoff esponenziale (gli _id stabili rendono il reinvio idempotente).
+
+    :param es: client elasticsearch
+    :param batch: azioni bulk del batch
+    :param max_retries: numero massimo di tentativi aggiuntivi
+    :return: lista di coppie (ok, item) come restituite da streaming_bulk
+    """
+
+    client = es.options(request_timeout=60)
+    for attempt in range(max_retries + 1):
+        try:
+            with INGEST_STAGE_SECONDS.time(stage="bulk"):
+                return list(helpers.streaming_bulk(
+                    client,
+                    batch,
+                    chunk_size=len(batch),
+                    max_chunk_bytes=config.BULK_MAX_BYTES * 2,
+                    raise_on_error=False,
+                    raise_on_exception=False,
+                    max_retries=max_retries,
+                    initial_backoff=1,
+                    max_backoff=30
+                ))
+        except (ConnectionTimeout, ESConnectionError) as e:
+            if attempt == max_retries:
+                raise
+            INGEST_RETRIES.inc()
+            logger_index_txt.warning(f"Batch bulk fallito (tentativo {attempt + 1}/{max_retries}): {e}")
+            time.sleep(min(30, 2 ** attempt))
+
+
+def parallel_bulk_index(es: Elasticsearch, actions: Iterable[Dict[str, Any]], stats: Dict[str, Any],
+                        senders: int = None, max_docs: int = None, max_bytes: int = None,
+                        max_retries: int = None) -> Generator[Tuple[bool, Dict[str, Any]], None, None]:
+    """
+    invia le azioni con n thread bulk concorrenti. i batch in volo sono limitati a senders * 2,
+    così lettura e invio procedono in parallelo senza accumulare documenti in memoria.
+
+    :param es: client elasticsearch
+    :param actions: azioni bulk
+    :param stats: dizionario aggiornato con documenti, byte, batch inviati
+    :param senders: numero di thread di invio (default config.INGEST_SENDER_THREADS)
+    :param max_docs: documenti massimi per batch (default config.BULK_MAX_DOCS)
+    :param max_bytes: byte massimi per batch (default config.BULK_MAX_BYTES)
+    :param max_retries: tentativi per batch (default config.BULK_MAX_RETRIES)
+    :return: coppie (ok, item) per ogni azione, nell'ordine di completamento dei batch
+    """
+
+    senders = senders or config.INGEST_SENDER_THREADS
+    max_docs = max_docs or config.BULK_MAX_DOCS
+    max_bytes = max_bytes or config.BULK_MAX_BYTES
+    max_retries = config.BULK_MAX_RETRIES if max_retries is None else max_retries
+
+    def collect(futures):
+        for future in futures:
+            results, batch_bytes = future.result()
+            stats["docs"] = stats.get("docs", 0) + len(results)
+            stats["bytes"] = stats.get("bytes", 0) + batch_bytes
+            stats["batches"] = stats.get("batches", 0) + 1
+            INGEST_DOCS.inc(len(results))
+            INGEST_BYTES.inc(batch_bytes)
+            yield from results
+
+    def send(batch, batch_bytes):
+        return send_bulk_batch(es, batch, max_retries), batch_bytes
+
+    with ThreadPoolExecutor(max_workers=senders, thread_name_prefix="bulk") as executor:
+        in_flight = set()
+        for batch, batch_bytes in bulk_batches(actions, max_docs, max_bytes):
+            if len(in_flight) >= senders * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                yield from collect(done)
+            in_flight.add(executor.submit(send, batch, batch_bytes))
+        yield from collect(as_completed(in_flight))
+
+def _index_changes(es: Elasticsearch, index_name: str, manifest: Dict[str, Dict[str, Any]], progress_bar=None,
+                   cancel_event: threading.Event = None) -> Dict[str, Any]:
+    """
+    confronta la directory con il manifest e invia all'indice indicato i file nuovi o modificati
+    e le cancellazioni dei file spariti. il manifest viene aggiornato solo per i file confermati dal bulk
+    e salvato ogni config.INDEX_CHECKPOINT_DOCS azioni, così un'indicizzazione interrotta o annullata
+    riprende dall'ultimo batch confermato.
+
+    :param es: client elasticsearch
+    :param index_name: indice su cui scrivere
+    :param manifest: manifest dell'indice (vuoto per reinviare tutti i file)
+    :param progress_bar: oggetto progressbar di streamlit
+    :param cancel_event: se impostato interrompe l'invio dopo l'azione corrente
+    :return: dict con documenti indicizzati, eliminati, errori, annullamento e statistiche di throughput
+    """
+
+    with INGEST_STAGE_SECONDS.time(stage="scan"):
+        changed, deleted = scan_changes(config.DIRECTORY_PATH, manifest)
+    logger_index_txt.info(f"File da aggiornare: {len(changed)}, da eliminare: {len(deleted)}.")
+    return index_file_changes(es, index_name, manifest, changed, deleted, progress_bar, cancel_event)
+
+
+class IndexingTally:
+    """
+    contabilità di un invio di modifiche all'indice, comune a index_file_changes() sincrono e asincrono:
+    prepara le azioni bulk (con la deduplicazione), registra l'esito di ogni azione aggiornando il manifest
+    e salva un checkpoint ogni config.INDEX_CHECKPOINT_DOCS azioni.
+    non è thread-safe: le azioni vanno consumate sullo stesso thread che chiama record() e finish().
+    """
+
+    def __init__(self, index_name: str, manifest: Dict[str, Dict[str, Any]], changed: List[Tuple[str, int, float]],
+                 deleted: List[str]):
+        self.index_name = index_name
+        self.manifest = manifest
+        self.dedup = load_dedup_store(index_name) if config.DEDUP_ENABLED else None
+        if self.dedup is not None:
+            changed = self.dedup.prepare(changed, deleted, manifest)
+        self.total = len(changed) + len(deleted)
+        self.changed_paths, self.deleted_paths = [path for path, _, _ in changed], deleted
+        self.pending = PendingChanges()
+        self.stats: Dict[str, Any] = {}
+        self.indexed_docs, self.deleted_docs, self.processed = 0, 0, 0
+        self.errors: List[Dict[str, Any]] = []
+        actions = chain(changed_file_generator(changed, manifest, self.pending, dedup=self.dedup),
+                        deleted_file_generator(deleted, manifest, self.pending))
+        self.actions = (dict(action, _index=index_name) for action in actions)
+
+    def record(self, ok: bool, item: Dict[str, Any]) -> None:
+        """registra l'esito di un'azione bulk (una cancellazione già assente conta come riuscita)"""
+        op_type, result = next(iter(item.items()))
+        self.processed += 1
+        if op_type == "delete":
+            ok = ok or result.get("status") == 404
+            self.deleted_docs += ok
+        elif ok:
+            self.indexed_docs += 1
+        if not ok:
+            self.errors.append(item)
+            INGEST_ERRORS.inc()
+        self.pending.confirm(result["_id"], ok, self.manifest)
+        if self.processed % config.INDEX_CHECKPOINT_DOCS == 0:
+            save_manifest(self.index_name, self.manifest)
+            if self.dedup is not None:
+                self.dedup.save()
+
+    def show_progress(self, progress_bar) -> None:
+        if progress_bar is not None and self.total:
+            progress_bar.progress(min(self.pending.completed / self.total, 1.0),
+                                  text=f"File elaborati: {self.pending.completed}/{self.total}")
+
+    def finish(self, cancelled: bool, progress_bar=None) -> Dict[str, Any]:
+        """
+        salva l'archivio dedup, registra i nomi file aggiunti e rimossi per i suggerimenti e restituisce
+        il riepilogo dell'invio.
+
+        :param cancelled: true se l'invio è stato annullato
+        :param progress_bar: oggetto progressbar di streamlit
+        :return: dict con documenti indicizzati, eliminati, errori, annullamento e statistiche di throughput
+        """
+
+        if self.dedup is not None:
+            self.dedup.save()
+        record_name_changes(self.manifest, self.changed_paths, self.deleted_paths)
+        if cancelled:
+            logger_index_txt.warning(f"Indicizzazione annullata dopo {self.pending.completed}/{self.total} file.")
+        if self.errors:
+            logger_index_txt.error(f"Errori bulk indexing: {self.errors[:5]}")
+        if progress_bar is not None:
+            progress_bar.progress(1.0, text=f"File elaborati: {self.pending.completed}/{self.total}")
+        return {"indexed_docs": self.indexed_docs, "deleted_docs": self.deleted_docs, "errors": len(self.errors),
+                "cancelled": cancelled, "stats": self.stats}
+
+
+def index_file_changes(es: Elasticsearch, index_name: str, manifest: Dict[str, Dict[str, Any]],
+                       changed: List[Tuple[str, int, float]], deleted: List[str], progress_bar=None,
+                       cancel_event: threading.Event = None) -> Dict[str, Any]:
+    """
+    invia all'indice i file nuovi o modificati e le cancellazioni indicati, senza scansionare la directory
+    (usato da _index_changes() dopo scan_changes() e dal watcher con le modifiche già note).
+
+    :param es: client elasticsearch
+    :param index_name: indice su cui scrivere
+    :param manifest: manifest dell'indice, aggiornato per i file confermati dal bulk
+    :param changed: file nuovi o modificati (percorso, size, mtime)
+    :param deleted: percorsi presenti nel manifest da eliminare
+    :param progress_bar: oggetto progressbar di streamlit
+    :param cancel_event: se impostato interrompe l'invio dopo l'azione corrente
+    :return: dict con documenti indicizzati, eliminati, errori, annullamento e statistiche di throughput
+    """
+
+    tally = IndexingTally(index_name, manifest, changed, deleted)
+    cancelled = False
+    bulk = parallel_bulk_index(es, tally.actions, tally.stats)
+    for ok, item in bulk:
+        tally.record(ok, item)
+        if tally.processed % 200 == 0:
+            tally.show_progress(progress_bar)
+        if cancel_event is not None and cancel_event.is_set():
+            cancelled = True
+            break
+    bulk.close()
+    return tally.finish(cancelled, progress_bar)
+
+
+def _indexing_summary(result: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+    """
+    completa il riepilogo di un'indicizzazione con tempo totale e throughput (doc/s, MB/s).
+    il messaggio per l'utente è restituito in "summary" e mostrato da main.py, perché l'indicizzazione
+    gira in un thread senza contesto streamlit.
+
+    :param result: dict restituito da _index_changes()
+    :param start_time: istante di inizio dell'indicizzazione
+    :return: dict
+    """
+
+    stats = result.pop("stats")
+    total_time = time.time() - start_time
+    docs_per_second = stats.get("docs", 0) / total_time if total_time else 0
+    mb_per_second = stats.get("bytes", 0) / (1024 * 1024) / total_time if total_time else 0
+    logger_index_txt.info(f"Indicizzazione: {stats.get('batches', 0)} batch, "
+                          f"{docs_per_second:.1f} doc/s, {mb_per_second:.2f} MB/s.")
+    if result.get("cancelled"):
+        return {"success": False, "error": "Indicizzazione annullata", **result, "time": total_time,
+                "docs_per_second": docs_per_second, "mb_per_second": mb_per_second}
+    summary = f"Indicizzazione completata in {total_time:.2f}s. Documenti: {result['indexed_docs']}, " \
+              f"eliminati: {result['deleted_docs']}"
+    return {"success": True, **result, "summary": summary, "time": total_time,
+            "docs_per_second": docs_per_second, "mb_per_second": mb_per_second}
+
+
+def run_indexing(es: Elasticsearch, progress_bar=None, incremental: bool = True, cancel_event: threading.Event = None):
     """
     avvia il processo di indicizzazione, creazione dell'indice tramite create_index().
-    poi utilizza helpers.bulk per indicizzare i documenti generati da file_data_generator().
-    infine aggiorna l'indice e restituisce un riepilogo dell'operazione.
+    in modalità incrementale confronta la directory con il manifest dell'ultima esecuzione e
+    invia tramite parallel_bulk_index() solo i file nuovi o modificati, più le cancellazioni
+    dei file spariti. ogni documento ha un _id stabile derivato da percorso_completo; su un indice
+    creato prima del manifest i documenti con id casuale vengono prima eliminati (purge_legacy_documents()).
+    infine aggiorna l'indice, salva il manifest e restituisce un riepilogo dell'operazione.
 
     :param es: client elasticsearch
     :param progress_bar: oggetto progressbar di streamlit
+    :param incremental: se false ignora il manifest e reinvia tutti i file
+    :param cancel_event: se impostato interrompe l'indicizzazione, conservando il manifest dei file confermati
     :return: dict
     """
     start_time = time.time()
+    manifest, target = {}, None
     try:
         index_created = create_index(es)
-        gen = file_data_generator(config.DIRECTORY_PATH)
-
-        success, errors = helpers.bulk(
-            es,
-            gen,
-            chunk_size=200,
-            request_timeout=60
-        )
-        if errors:
-            logger_index_txt.error(f"Errori bulk indexing: {errors[:5]}")
-        es.indices.refresh(index=config.INDEX_NAME)
-        total_time = time.time() - start_time
-        st.success(f"Indicizzazione completata in {total_time:.2f}s. Documenti: {success}")
-        return {"success": True, "index_created": index_created, "indexed_docs": success, "errors": len(errors), "time": total_time}
+        target = current_index(es)
+        if not index_created:
+            purge_legacy_documents(es, target)
+        if incremental and not index_created:
+            manifest = load_manifest(target)
+
+        result = _index_changes(es, target, manifest, progress_bar, cancel_event)
+        with INGEST_STAGE_SECONDS.time(stage="refresh"):
+            es.indices.refresh(index=target)
+        save_manifest(target, manifest)
+        search_cache.invalidate()
+        return {"index_created": index_created, **_indexing_summary(result, start_time)}
     except Exception as e:
         logger_index_txt.error(f"Errore indicizzazione: {e}")
+        if manifest and target:
+            save_manifest(target, manifest)
+        search_cache.invalidate()
+        return {"success": False, "error": str(e)}
+
+
+def rebuild_index(es: Elasticsearch, progress_bar=None, cancel_event: threading.Event = None):
+    """
+    ricostruisce l'indice da zero senza interrompere le ricerche: crea una nuova generazione versionata
+    con refresh disattivato e zero repliche, la carica con tutti i file, ripristina i settings,
+    esegue il force merge e infine sposta l'alias in modo atomico. le generazioni precedenti
+    vengono conservate (config.INDEX_GENERATIONS_TO_KEEP) per il rollback.
+    se annullata, la generazione parziale viene eliminata e l'alias resta invariato.
+
+    :param es: client elasticsearch
+    :param progress_bar: oggetto progressbar di streamlit
+    :param cancel_event: se impostato interrompe la ricostruzione
+    :return: dict
+    """
+    start_time = time.time()
+    new_index = versioned_index_name()
+    try:
+        es.indices.create(index=new_index, body=index_body(bulk_load=True))
+        logger_index_txt.info(f"Ricostruzione nella nuova generazione '{new_index}'.")
+
+        manifest = {}
+        result = _index_changes(es, new_index, manifest, progress_bar, cancel_event)
+        if result["cancelled"]:
+            _discard_generation(es, new_index)
+            return {"index_created": False, **_indexing_summary(result, start_time)}
+
+        es.indices.put_settings(index=new_index, settings={
+            "index.number_of_replicas": config.INDEX_NUMBER_OF_REPLICAS,
+            "index.refresh_interval": None
+        })
+        with INGEST_STAGE_SECONDS.time(stage="refresh"):
+            es.indices.refresh(index=new_index)
+        es.options(request_timeout=3600).indices.forcemerge(index=new_index, max_num_segments=1)
+        es.cluster.health(index=new_index, wait_for_status="yellow", timeout="60s")
+
+        save_manifest(new_index, manifest)
+        swap_alias(es, new_index)
+        search_cache.invalidate()
+        removed = delete_old_generations(es)
+        return {"index_created": True, "index": new_index, "removed_generations": removed,
+                **_indexing_summary(result, start_time)}
+    except Exception as e:
+        logger_index_txt.error(f"Errore ricostruzione indice: {e}")
+        _discard_generation(es, new_index)
+        return {"success": False, "error": str(e)}
+
+
+def _discard_generation(es: Elasticsearch, new_index: str) -> None:
+    """elimina una generazione non ancora attiva (ricostruzione fallita o annullata) e il suo manifest"""
+    try:
+        if es.indices.exists(index=new_index) and current_index(es) != new_index:
+            es.indices.delete(index=new_index)
+            delete_manifest(new_index)
+    except Exception as cleanup_error:
+        logger_index_txt.error(f"Errore pulizia generazione '{new_index}': {cleanup_error}")
+
+
+def rollback_index(es: Elasticsearch):
+    """
+    riporta l'alias sulla generazione precedente a quella attiva.
+
+    :param es: client elasticsearch
+    :return: dict con la generazione ripristinata
+    """
+
+    try:
+        generations = list_index_generations(es)
+        active = current_index(es)
+        previous = [name for name in generations if name < active]
+        if not previous:
+            return {"success": False, "error": "Nessuna generazione precedente disponibile"}
+        swap_alias(es, previous[-1])
+        search_cache.invalidate()
+        return {"success": True, "index": previous[-1]}
+    except Exception as e:
+        logger_index_txt.error(f"Errore rollback indice: {e}")
         return {"success": False, "error": str(e)}
 
 def check_index_exists(es: Elasticsearch) -> (bool, int):
@@ -116,12 +658,147 @@ def check_index_exists(es: Elasticsearch) -> (bool, int):
         return False, 0
 
 
+def collapsed_page_body(base_body: Dict[str, Any], page: int, page_size: int) -> Dict[str, Any]:
+    """
+    body di una pagina from/size con i passaggi raggruppati per id_file (collapse),
+    le fonti più frequenti e il numero di file distinti.
+
+    :param base_body: query e highlight costruiti da build_search_body()
+    :param page: numero di pagina
+    :param page_size: risultati per pagina
+    :return: body per es.search
+    """
+
+    return {
+        **base_body,
+        "collapse": {"field": "id_file"},
+        "aggs": {
+            "sources": {"terms": {"field": "nome_file.keyword", "size": 20}},
+            "files": {"cardinality": {"field": "id_file"}}
+        },
+        "from": (page - 1) * page_size,
+        "size": page_size
+    }
+
+
+def collapsed_page_result(res) -> Tuple[List[Dict[str, Any]], int, Dict[str, Any]]:
+    """
+    estrae da una risposta di collapsed_page_body() risultati, numero di file distinti e aggregazioni.
+
+    :param res: risposta di es.search
+    :return: risultati della pagina, numero totale di file, aggregazioni
+    """
+
+    aggregations = res.get("aggregations", {})
+    return res["hits"]["hits"], aggregations.get("files", {}).get("value", res["hits"]["total"]["value"]), \
+        aggregations
+
+
+def _fetch_results(es: Elasticsearch, base_body: Dict[str, Any], page: int, page_size: int,
+                   cursor_cache: Dict[Hashable, Dict[str, Any]], cursor_key: Hashable) \
+        -> Tuple[List[Dict[str, Any]], int, Dict[str, Any]]:
+    """
+    esegue una fase della ricerca: point in time + search_after se c'è cursor_cache, altrimenti from/size.
+
+    :return: risultati della pagina, numero totale di file, aggregazioni
+    """
+
+    if cursor_cache is None:
+        start_request = time.perf_counter()
+        res = es.search(index=config.INDEX_NAME, body=collapsed_page_body(base_body, page, page_size))
+        record_es_timings(res, time.perf_counter() - start_request)
+        return collapsed_page_result(res)
+    try:
+        cursor = get_cursor(es, cursor_cache, cursor_key)
+        return fetch_page(es, cursor, base_body, page, page_size)
+    except Exception as e:
+        if not is_cursor_expired(e):
+            raise
+        cursor = get_cursor(es, cursor_cache, cursor_key, reset=True)
+        return fetch_page(es, cursor, base_body, page, page_size)
+
+
+def _empty_search_result() -> Dict[str, Any]:
+    return {"success": True, "hits": [], "total_hits": 0, "aggregations": {}, "time": 0}
+
+
+def _search_phases(query_nome_file: str, query_contenuto: str, is_phrase_query: bool,
+                   selected_sources: Optional[List[str]], meta: Dict[str, Any], cache_key: Tuple) \
+        -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    fasi da eseguire per una ricerca con le modalità dell'indice: se per la stessa query è già nota
+    la fase scelta (pagine successive) solo quella, altrimenti tutte quelle di build_search_phases().
+
+    :param meta: modalità restituite da get_index_meta()
+    :param cache_key: chiave della ricerca in search_cache
+    :return: lista di (fase, body)
+    """
+
+    phases = build_search_phases(query_nome_file, query_contenuto, is_phrase_query, selected_sources,
+                                 highlight_mode=meta["highlight_mode"], filename_mode=meta["filename_mode"])
+    known_phase = search_cache.get_phase(cache_key[:4]) if phases else None
+    if known_phase is not None:
+        phases = [(phase, body) for phase, body in phases if phase == known_phase] or phases
+    return phases
+
+
+def _search_result(query_nome_file: str, query_contenuto: str, phase: str, hits: List[Dict[str, Any]],
+                   total_hits: int, aggregations: Dict[str, Any], start_search: float, cache_key: Tuple,
+                   cache_generation: int) -> Dict[str, Any]:
+    """
+    compone il risultato di una ricerca riuscita, ne registra le metriche e lo salva in search_cache
+    insieme alla fase scelta.
+
+    :return: dict con hits, total_hits, aggregations, time e phase
+    """
+
+    search_cache.put_phase(cache_key[:4], phase, cache_generation)
+    end_search = time.time()
+    logger_index_txt.info(
+        f"Trovati {total_hits} risultati per nome='{query_nome_file}', contenuto='{query_contenuto}' "
+        f"in {end_search - start_search:.4f}s (fase {phase}).")
+    result = {"success": True, "hits": hits, "total_hits": total_hits, "aggregations": aggregations,
+              "time": end_search - start_search, "phase": phase}
+    SEARCH_STAGE_SECONDS.observe(end_search - start_search, stage="total")
+    SEARCH_REQUESTS.inc(backend="elasticsearch", outcome="success")
+    SEARCH_PHASES.inc(phase=phase)
+    search_cache.put(cache_key, result, cache_generation)
+    return result
+
+
+def _search_error(e: Exception) -> Dict[str, Any]:
+    """
+    gestisce un errore di ricerca: metriche, segnalazione dei problemi di connessione a client_manager
+    e risultato vuoto se l'indice non esiste ancora.
+
+    :param e: eccezione sollevata dalla ricerca
+    :return: dict del risultato
+    """
+
+    logger_index_txt.error(f"Errore ricerca: {e}")
+    SEARCH_REQUESTS.inc(backend="elasticsearch", outcome="error")
+    if isinstance(e, (ESConnectionError, ConnectionTimeout)):
+        client_manager.record_failure(e)
+    if "index_not_found_exception" in str(e):
+        logger_index_txt.warning(f"Tentativo di ricerca sull'indice non esistente: {config.INDEX_NAME}")
+        return _empty_search_result()
+    return {"success": False, "error": str(e)}
+
+
 def search_documents(es: Elasticsearch, query_nome_file: str, query_contenuto: str, is_phrase_query: bool = False,
-                     selected_sources: List[str] = None, page: int = 1, page_size: int = 10):
+                     selected_sources: List[str] = None, page: int = 1, page_size: int = 10,
+                     cursor_cache: Dict[Hashable, Dict[str, Any]] = None):
     """
-    costruisce una query bool elasticsearch per combinare le ricerche su nome file e contenuto.
-    utilizza dei controlli 'should' per dare punteggi più alti a documenti che corrispondono a entrambi i criteri.
-    per la ricerca nel contenuto, supporta ricerche standard e phrase query.
+    esegue la ricerca costruita da build_search_body() su nome file e contenuto.
+    i risultati sono serviti da search_cache finché l'indice non viene aggiornato.
+    i passaggi dei file grandi sono raggruppati per id_file: ogni risultato è un file,
+    rappresentato dal suo passaggio migliore, e total_hits conta i file distinti.
+    senza cursor_cache pagina con from/size e collapse; con cursor_cache (es. lo stato della sessione)
+    usa point in time + search_after, così anche le pagine lontane non richiedono di raccogliere
+    from + size risultati su ogni shard e non sono limitate da index.max_result_window.
+    con config.SEARCH_ADAPTIVE esegue prima la fase esatta e passa a fuzziness/ngram solo se trova
+    meno di config.SEARCH_ADAPTIVE_MIN_HITS file (vedi build_search_phases()); la fase scelta è memorizzata
+    per le pagine successive della stessa query e restituita in "phase".
 
     :param es: client elasticsearch
     :param query_nome_file: termine di ricerca nel nome
@@ -130,99 +807,110 @@ def search_documents(es: Elasticsearch, query_nome_file: str, query_contenuto: s
     :param selected_sources:  filtra risultati per nome file
     :param page:  numero di pagina per paginazion
     :param page_size:  risultati per pagina
+    :param cursor_cache: dizionario dei cursori point in time della sessione
     :return:
     """
 
-    bool_clauses = []
-    highlight_fields = {}
+    start_lookup = time.time()
+    cache_key = search_cache.make_key(query_nome_file, query_contenuto, is_phrase_query, selected_sources,
+                                      page, page_size) + (cursor_cache is not None,)
+    cache_generation = search_cache.generation
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        return {**cached, "time": time.time() - start_lookup, "cached": True}
 
-    if query_nome_file:
-        bool_clauses.append({
-            "multi_match": {
-                "query": query_nome_file,
-                "fields": ["nome_file^5", "nome_file.keyword^10", "nome_file.ngram^3"],
-                "type": "best_fields",
-                "fuzziness": "AUTO"
-            }
-        })
-        highlight_fields["nome_file"] = {"pre_tags": ["<mark>"], "post_tags": ["</mark>"]}
-
-    if query_contenuto:
-        query_type = "phrase" if is_phrase_query else "best_fields"
-
-        query_params = {
-            "query": query_contenuto,
-            "fields": ["contenuto_file^2", "contenuto_file.italian^3", "contenuto_file.english^3"],
-            "type": query_type,
-            "slop": 2 if is_phrase_query else 0
-        }
-
-        if not is_phrase_query:
-            query_params["fuzziness"] = "AUTO"
-            query_params["prefix_length"] = 1
-
-        bool_clauses.append({"multi_match": query_params})
-
-        highlight_fields["contenuto_file"] = {"pre_tags": ["<mark>"], "post_tags": ["</mark>"], "fragment_size": 150,
-                                              "number_of_fragments": 3}
-        highlight_fields["contenuto_file.italian"] = {"pre_tags": ["<mark>"], "post_tags": ["</mark>"],
-                                                      "fragment_size": 150, "number_of_fragments": 3}
-        highlight_fields["contenuto_file.english"] = {"pre_tags": ["<mark>"], "post_tags": ["</mark>"],
-                                                      "fragment_size": 150, "number_of_fragments": 3}
-
-    if not bool_clauses:
-        return {"success": True, "hits": [], "total_hits": 0, "aggregations": {}, "time": 0}
-
-    main_query = {"bool": {"should": bool_clauses, "minimum_should_match": 1}}
-
-    if selected_sources:
-        main_query = {"bool": {"must": [main_query], "filter": {"terms": {"nome_file.keyword": selected_sources}}}}
-
-    es_query = {
-        "query": main_query,
-        "highlight": {
-            "fields": highlight_fields,
-            "order": "score",
-            "number_of_fragments": 1,
-            "max_analyzed_offset": 1000000
-        },
-        "aggs": {"sources": {"terms": {"field": "nome_file.keyword", "size": 20}}},
-        "from": (page - 1) * page_size,
-        "size": page_size
-    }
+    with SEARCH_STAGE_SECONDS.time(stage="build_query"):
+        meta = get_index_meta(es)
+        phases = _search_phases(query_nome_file, query_contenuto, is_phrase_query, selected_sources, meta, cache_key)
+    if not phases:
+        return _empty_search_result()
 
     try:
         start_search = time.time()
-        res = es.search(index=config.INDEX_NAME, body=es_query)
-        end_search = time.time()
-        hits = res["hits"]["hits"]
-        total_hits = res["hits"]["total"]["value"]
-        aggregations = res.get("aggregations", {})
-        logger_index_txt.info(
-            f"Trovati {total_hits} risultati per nome='{query_nome_file}', contenuto='{query_contenuto}' in {end_search - start_search:.4f}s.")
-        return {"success": True, "hits": hits, "total_hits": total_hits, "aggregations": aggregations,
-                "time": end_search - start_search}
+        for phase, base_body in phases:
+            hits, total_hits, aggregations = _fetch_results(es, base_body, page, page_size, cursor_cache,
+                                                            cache_key[:4] + (page_size, phase))
+            if total_hits >= config.SEARCH_ADAPTIVE_MIN_HITS:
+                break
+        return _search_result(query_nome_file, query_contenuto, phase, hits, total_hits, aggregations,
+                              start_search, cache_key, cache_generation)
     except Exception as e:
-        logger_index_txt.error(f"Errore ricerca: {e}")
-        if "index_not_found_exception" in str(e):
-            logger_index_txt.warning(f"Tentativo di ricerca sull'indice non esistente: {config.INDEX_NAME}")
-            return {"success": True, "hits": [], "total_hits": 0, "aggregations": {}, "time": 0}
-        return {"success": False, "error": str(e)}
+        return _search_error(e)
+
+
+def export_documents(es: Elasticsearch, query_nome_file: str, query_contenuto: str, is_phrase_query: bool = False,
+                     selected_sources: List[str] = None, batch_size: int = 1000,
+                     source_includes: List[str] = None) -> Generator[Dict[str, Any], None, None]:
+    """
+    esporta in streaming tutti i documenti (passaggi compresi) che soddisfano la ricerca,
+    con point in time + search_after e memoria costante.
+
+    :param es: client elasticsearch
+    :param query_nome_file: termine di ricerca nel nome
+    :param query_contenuto: termine di ricerca nel contenuto
+    :param is_phrase_query: se true, cerca frase esatta nel contenuto
+    :param selected_sources: filtra risultati per nome file
+    :param batch_size: documenti per richiesta
+    :param source_includes: campi di _source da esportare (default tutti)
+    :return: hit elasticsearch
+    """
+
+    meta = get_index_meta(es)
+    base_body = build_search_body(query_nome_file, query_contenuto, is_phrase_query, selected_sources,
+                                  highlight_mode=meta["highlight_mode"], filename_mode=meta["filename_mode"])
+    if base_body is None:
+        return
+    base_body.pop("highlight")
+    base_body.pop("_source")
+    yield from iter_all_hits(es, base_body, batch_size, source_includes)
+
+
+def get_documents_content(es: Elasticsearch, doc_ids: List[str]) -> Dict[str, str]:
+    """
+    recupera il contenuto completo dei documenti indicati, con richieste mget a blocchi
+    di config.MGET_BATCH_SIZE id. usato solo quando l'utente apre il contenuto di un risultato.
+
+    :param es: client elasticsearch
+    :param doc_ids: id dei documenti
+    :return: dizionario id -> contenuto_file
+    """
+
+    contents = {}
+    try:
+        for start in range(0, len(doc_ids), config.MGET_BATCH_SIZE):
+            res = es.mget(index=config.INDEX_NAME, ids=doc_ids[start:start + config.MGET_BATCH_SIZE],
+                          source_includes=["contenuto_file"])
+            for doc in res["docs"]:
+                if doc.get("found"):
+                    contents[doc["_id"]] = doc["_source"].get("contenuto_file", "")
+    except Exception as e:
+        logger_index_txt.error(f"Errore recupero contenuto documenti: {e}")
+    return contents
 
 
-def get_all_sources(es: Elasticsearch) -> List[str]:
+def get_all_sources(es: Elasticsearch, raise_errors: bool = False) -> List[str]:
     """
-    recupera l'elenco di tutti i nomi file indicizzati
+    recupera l'elenco di tutti i nomi file indicizzati, a pagine di config.SUGGEST_PAGE_SIZE
+    con un'aggregazione composite (senza limite sul numero di nomi).
 
     :param es: client elasticsearch.
+    :param raise_errors: se true propaga gli errori invece di restituire una lista vuota (es. filename_suggester)
     :return:  una lista di stringhe con i nomi dei file.
     """
 
-    es_query = {"size": 0, "aggs": {"all_sources": {"terms": {"field": "nome_file.keyword", "size": 500}}}}
+    composite = {"size": config.SUGGEST_PAGE_SIZE, "sources": [{"name": {"terms": {"field": "nome_file.keyword"}}}]}
+    es_query = {"size": 0, "aggs": {"all_sources": {"composite": composite}}}
+    names = []
     try:
-        res = es.search(index=config.INDEX_NAME, body=es_query)
-        buckets = res['aggregations']['all_sources']['buckets']
-        return sorted([bucket['key'] for bucket in buckets])
+        while True:
+            res = es.search(index=config.INDEX_NAME, body=es_query)
+            aggregation = res['aggregations']['all_sources']
+            names.extend(bucket['key']['name'] for bucket in aggregation['buckets'])
+            if len(aggregation['buckets']) < config.SUGGEST_PAGE_SIZE or 'after_key' not in aggregation:
+                return sorted(names)
+            composite["after"] = aggregation['after_key']
     except Exception as e:
+        if raise_errors:
+            raise
         logger_index_txt.error(f"Errore recupero fonti: {e}")
-        return []
\ No newline at end of file
+        return []
@@ -0,0 +1,375 @@
+"""
+variante asyncio di operation_elasticsearch basata su AsyncElasticsearch: le richieste indipendenti
+(controllo dell'indice e ricerca, blocchi mget, stream bulk) sono inviate in parallelo sullo stesso client.
+le funzioni async si usano da un servizio asyncio; AsyncElasticsearchFacade le esegue su un event loop
+dedicato per il codice sincrono (main.py).
+
+richiede il trasporto http asincrono: uv sync --extra async
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+
+from elasticsearch import AsyncElasticsearch, NotFoundError, ConnectionError as ESConnectionError, ConnectionTimeout
+from elasticsearch.helpers import async_streaming_bulk
+
+from app.business.manifest import load_manifest, save_manifest
+from app.business.operation_elasticsearch import DEFAULT_INDEX_META, IndexingTally, _cached_index_meta, \
+    _empty_search_result, _index_meta_from_mappings, _indexing_summary, _search_error, _search_phases, \
+    _search_result, bulk_batches, collapsed_page_body, collapsed_page_result, create_index, current_index, \
+    purge_legacy_documents
+from app.business.operation_file import scan_changes
+from app.business.search_cache import search_cache
+from app.models.models import config
+from app.utils.logger_config import logger_index_txt
+from app.utils.metrics import INGEST_STAGE_SECONDS, SEARCH_STAGE_SECONDS, INGEST_DOCS, INGEST_BYTES, INGEST_RETRIES, \
+    record_es_timings
+
+_BATCHES_DONE = object()
+
+
+def build_async_client() -> AsyncElasticsearch:
+    """client asincrono con le stesse opzioni di connessione del client sincrono di client_manager"""
+    return AsyncElasticsearch(
+        config.ELASTICSEARCH_HOST,
+        verify_certs=False,
+        request_timeout=30,
+        connections_per_node=config.ES_CONNECTIONS_PER_NODE,
+        max_retries=config.ES_MAX_RETRIES,
+        retry_on_timeout=True,
+    )
+
+
+async def get_index_meta(es: AsyncElasticsearch) -> Dict[str, Any]:
+    """come operation_elasticsearch.get_index_meta(), condividendone la cache"""
+    cached = _cached_index_meta()
+    if cached is not None:
+        return cached
+    try:
+        return _index_meta_from_mappings(await es.indices.get_mapping(index=config.INDEX_NAME))
+    except Exception as e:
+        logger_index_txt.warning(f"Impossibile leggere _meta dell'indice '{config.INDEX_NAME}': {e}")
+        return dict(DEFAULT_INDEX_META)
+
+
+async def check_index_exists(es: AsyncElasticsearch) -> Tuple[bool, int]:
+    """
+    controlla se l'indice esiste e quanti documenti contiene, con una sola richiesta count
+    (un indice mancante risponde 404).
+
+    :param es: client elasticsearch asincrono
+    :return: dove il primo elemento indica se l'indice esiste e il secondo è il numero di documenti
+    """
+
+    try:
+        count_response = await es.count(index=config.INDEX_NAME)
+        return True, count_response.get("count", 0)
+    except NotFoundError:
+        return False, 0
+    except Exception as e:
+        logger_index_txt.error(f"Errore nel controllare l'indice {config.INDEX_NAME}: {e}")
+        return False, 0
+
+
+async def search_documents(es: AsyncElasticsearch, query_nome_file: str, query_contenuto: str,
+                           is_phrase_query: bool = False, selected_sources: List[str] = None, page: int = 1,
+                           page_size: int = 10) -> Dict[str, Any]:
+    """
+    come operation_elasticsearch.search_documents() senza cursor_cache: pagina con from/size e collapse
+    (i point in time restano legati al client sincrono), con le stesse fasi della ricerca adattiva.
+    fasi, risultato ed errori passano per gli stessi helper della versione sincrona, search_cache compresa.
+
+    :param es: client elasticsearch asincrono
+    :param query_nome_file: termine di ricerca nel nome
+    :param query_contenuto: termine di ricerca nel contenuto
+    :param is_phrase_query: se true, cerca frase esatta nel contenuto
+    :param selected_sources: filtra risultati per nome file
+    :param page: numero di pagina
+    :param page_size: risultati per pagina
+    :return: dict con la stessa forma di operation_elasticsearch.search_documents()
+    """
+
+    start_lookup = time.time()
+    cache_key = search_cache.make_key(query_nome_file, query_contenuto, is_phrase_query, selected_sources,
+                                      page, page_size) + (False,)
+    cache_generation = search_cache.generation
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        return {**cached, "time": time.time() - start_lookup, "cached": True}
+
+    with SEARCH_STAGE_SECONDS.time(stage="build_query"):
+        meta = await get_index_meta(es)
+        phases = _search_phases(query_nome_file, query_contenuto, is_phrase_query, selected_sources, meta, cache_key)
+    if not phases:
+        return _empty_search_result()
+
+    try:
+        start_search = time.time()
+        for phase, base_body in phases:
+            start_request = time.perf_counter()
+            res = await es.search(index=config.INDEX_NAME, body=collapsed_page_body(base_body, page, page_size))
+            record_es_timings(res, time.perf_counter() - start_request)
+            hits, total_hits, aggregations = collapsed_page_result(res)
+            if total_hits >= config.SEARCH_ADAPTIVE_MIN_HITS:
+                break
+        return _search_result(query_nome_file, query_contenuto, phase, hits, total_hits, aggregations,
+                              start_search, cache_key, cache_generation)
+    except Exception as e:
+        return _search_error(e)
+
+
+async def search_with_index_check(es: AsyncElasticsearch, *args, **kwargs) -> Tuple[bool, int, Dict[str, Any]]:
+    """
+    esegue in parallelo check_index_exists() e search_documents(), invece di una richiesta dopo l'altra.
+
+    :return: esistenza dell'indice, numero di documenti e risultato della ricerca
+    """
+
+    (exists, doc_count), result = await asyncio.gather(check_index_exists(es), search_documents(es, *args, **kwargs))
+    return exists, doc_count, result
+
+
+async def get_documents_content(es: AsyncElasticsearch, doc_ids: List[str]) -> Dict[str, str]:
+    """
+    come operation_elasticsearch.get_documents_content(), con i blocchi mget inviati in parallelo.
+
+    :param es: client elasticsearch asincrono
+    :param doc_ids: id dei documenti
+    :return: dizionario id -> contenuto_file
+    """
+
+    contents = {}
+    try:
+        responses = await asyncio.gather(*(
+            es.mget(index=config.INDEX_NAME, ids=doc_ids[start:start + config.MGET_BATCH_SIZE],
+                    source_includes=["contenuto_file"])
+            for start in range(0, len(doc_ids), config.MGET_BATCH_SIZE)))
+        for res in responses:
+            for doc in res["docs"]:
+                if doc.get("found"):
+                    contents[doc["_id"]] = doc["_source"].get("contenuto_file", "")
+    except Exception as e:
+        logger_index_txt.error(f"Errore recupero contenuto documenti: {e}")
+    return contents
+
+
+async def send_bulk_batch(es: AsyncElasticsearch, batch: List[Dict[str, Any]], max_retries: int) \
+        -> List[Tuple[bool, Dict[str, Any]]]:
+    """come operation_elasticsearch.send_bulk_batch(), con async_streaming_bulk"""
+    client = es.options(request_timeout=60)
+    for attempt in range(max_retries + 1):
+        try:
+            with INGEST_STAGE_SECONDS.time(stage="bulk"):
+                return [item async for item in async_streaming_bulk(
+                    client,
+                    batch,
+                    chunk_size=len(batch),
+                    max_chunk_bytes=config.BULK_MAX_BYTES * 2,
+                    raise_on_error=False,
+                    raise_on_exception=False,
+                    max_retries=max_retries,
+                    initial_backoff=1,
+                    max_backoff=30
+                )]
+        except (ConnectionTimeout, ESConnectionError) as e:
+            if attempt == max_retries:
+                raise
+            INGEST_RETRIES.inc()
+            logger_index_txt.warning(f"Batch bulk fallito (tentativo {attempt + 1}/{max_retries}): {e}")
+            await asyncio.sleep(min(30, 2 ** attempt))
+
+
+async def index_file_changes(es: AsyncElasticsearch, index_name: str, manifest: Dict[str, Dict[str, Any]],
+                             changed: List[Tuple[str, int, float]], deleted: List[str], progress_bar=None,
+                             cancel_event: threading.Event = None) -> Dict[str, Any]:
+    """
+    come operation_elasticsearch.index_file_changes(): la lettura dei file resta in un thread mentre
+    config.INGEST_SENDER_THREADS stream bulk inviano i batch in parallelo sull'event loop, con al massimo
+    due batch in coda per stream. lettura dei file e conferme del bulk modificano lo stesso IndexingTally
+    (manifest, PendingChanges, archivio dedup), quindi girano entrambe sull'unico thread di bookkeeping,
+    come nel ciclo sincrono; il generatore dei batch viene chiuso sullo stesso thread anche in caso di annullamento.
+
+    :return: dict con documenti indicizzati, eliminati, errori, annullamento e statistiche di throughput
+    """
+
+    tally = IndexingTally(index_name, manifest, changed, deleted)
+    batches = bulk_batches(tally.actions, config.BULK_MAX_DOCS, config.BULK_MAX_BYTES)
+    senders = config.INGEST_SENDER_THREADS
+    queue: asyncio.Queue = asyncio.Queue(maxsize=senders * 2)
+    results: asyncio.Queue = asyncio.Queue()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    stats = tally.stats
+
+    def confirm(items: List[Tuple[bool, Dict[str, Any]]]) -> None:
+        for ok, item in items:
+            tally.record(ok, item)
+        tally.show_progress(progress_bar)
+
+    async def produce(bookkeeping: ThreadPoolExecutor):
+        try:
+            while not stop.is_set():
+                batch = await loop.run_in_executor(bookkeeping, next, batches, _BATCHES_DONE)
+                if batch is _BATCHES_DONE:
+                    break
+                await queue.put(batch)
+        finally:
+            for _ in range(senders):
+                await queue.put(_BATCHES_DONE)
+
+    async def send():
+        try:
+            while (entry := await queue.get()) is not _BATCHES_DONE:
+                if stop.is_set():
+                    continue
+                batch, batch_bytes = entry
+                items = await send_bulk_batch(es, batch, config.BULK_MAX_RETRIES)
+                stats["docs"] = stats.get("docs", 0) + len(items)
+                stats["bytes"] = stats.get("bytes", 0) + batch_bytes
+                stats["batches"] = stats.get("batches", 0) + 1
+                INGEST_DOCS.inc(len(items))
+                INGEST_BYTES.inc(batch_bytes)
+                await results.put(items)
+        except Exception:
+            stop.set()
+            raise
+        finally:
+            await results.put(_BATCHES_DONE)
+
+    cancelled, finished = False, 0
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-bookkeeping") as bookkeeping:
+        tasks = [asyncio.create_task(produce(bookkeeping))] + [asyncio.create_task(send()) for _ in range(senders)]
+        try:
+            while finished < senders:
+                items = await results.get()
+                if items is _BATCHES_DONE:
+                    finished += 1
+                    continue
+                await loop.run_in_executor(bookkeeping, confirm, items)
+                if cancel_event is not None and cancel_event.is_set() and not stop.is_set():
+                    cancelled = True
+                    stop.set()
+            await asyncio.gather(*tasks)
+        finally:
+            stop.set()
+            for task in tasks:
+                task.cancel()
+            # accodata dopo un eventuale next() ancora in corso: il generatore non è mai chiuso mentre gira
+            await loop.run_in_executor(bookkeeping, batches.close)
+        return await loop.run_in_executor(bookkeeping, tally.finish, cancelled, progress_bar)
+
+
+async def run_indexing(es: AsyncElasticsearch, sync_es, progress_bar=None, incremental: bool = True,
+                       cancel_event: threading.Event = None) -> Dict[str, Any]:
+    """
+    come operation_elasticsearch.run_indexing() con l'invio bulk asincrono. creazione dell'indice e
+    risoluzione dell'alias restano sul client sincrono, una sola volta per indicizzazione.
+
+    :param es: client elasticsearch asincrono
+    :param sync_es: client elasticsearch sincrono
+    :param progress_bar: oggetto progressbar di streamlit
+    :param incremental: se false ignora il manifest e reinvia tutti i file
+    :param cancel_event: se impostato interrompe l'indicizzazione, conservando il manifest dei file confermati
+    :return: dict
+    """
+
+    start_time = time.time()
+    manifest, target = {}, None
+    try:
+        index_created = await asyncio.to_thread(create_index, sync_es)
+        target = await asyncio.to_thread(current_index, sync_es)
+        if not index_created:
+            await asyncio.to_thread(purge_legacy_documents, sync_es, target)
+        if incremental and not index_created:
+            manifest = load_manifest(target)
+        with INGEST_STAGE_SECONDS.time(stage="scan"):
+            changed, deleted = await asyncio.to_thread(scan_changes, config.DIRECTORY_PATH, manifest)
+        logger_index_txt.info(f"File da aggiornare: {len(changed)}, da eliminare: {len(deleted)}.")
+
+        result = await index_file_changes(es, target, manifest, changed, deleted, progress_bar, cancel_event)
+        with INGEST_STAGE_SECONDS.time(stage="refresh"):
+            await es.indices.refresh(index=target)
+        save_manifest(target, manifest)
+        search_cache.invalidate()
+        return {"index_created": index_created, **_indexing_summary(result, start_time)}
+    except Exception as e:
+        logger_index_txt.error(f"Errore indicizzazione: {e}")
+        if manifest and target:
+            save_manifest(target, manifest)
+        search_cache.invalidate()
+        return {"success": False, "error": str(e)}
+
+
+class AsyncElasticsearchFacade:
+    """
+    facciata sincrona sulle funzioni async: un event loop in un thread daemon con un unico client
+    AsyncElasticsearch, condiviso da tutte le sessioni streamlit. ogni chiamata attende il risultato,
+    ma le richieste interne (e quelle di sessioni diverse) restano concorrenti sullo stesso loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[AsyncElasticsearch] = None
+        self.last_error = ""
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._client = build_async_client()
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="es-async-loop", daemon=True).start()
+            return self._loop
+
+    def available(self) -> bool:
+        """
+        true se il client asincrono è utilizzabile; senza il trasporto aiohttp registra l'errore
+        una sola volta e restituisce false, così il chiamante può usare il client sincrono.
+        """
+
+        if self._loop is not None:
+            return True
+        try:
+            self._ensure_loop()
+            return True
+        except ValueError as e:
+            if not self.last_error:
+                logger_index_txt.warning(f"Client elasticsearch asincrono non disponibile: {e}")
+            self.last_error = str(e)
+            return False
+
+    def submit(self, coroutine: Awaitable) -> Future:
+        """pianifica una coroutine sul loop della facciata senza attenderla"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop())
+
+    def run(self, function, *args, **kwargs):
+        """
+        esegue function(client, *args, **kwargs) sul loop della facciata e ne attende il risultato.
+
+        :param function: una delle funzioni async di questo modulo
+        :return: risultato della funzione
+        """
+
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(function(self._client, *args, **kwargs), loop).result()
+
+    def check_index_exists(self) -> Tuple[bool, int]:
+        return self.run(check_index_exists)
+
+    def search_documents(self, *args, **kwargs) -> Dict[str, Any]:
+        return self.run(search_documents, *args, **kwargs)
+
+    def search_with_index_check(self, *args, **kwargs) -> Tuple[bool, int, Dict[str, Any]]:
+        return self.run(search_with_index_check, *args, **kwargs)
+
+    def get_documents_content(self, doc_ids: List[str]) -> Dict[str, str]:
+        return self.run(get_documents_content, doc_ids)
+
+    def run_indexing(self, sync_es, progress_bar=None, incremental: bool = True,
+                     cancel_event: threading.Event = None) -> Dict[str, Any]:
+        return self.run(run_indexing, sync_es, progress_bar, incremental, cancel_event)
+
+
+async_facade = AsyncElasticsearchFacade()
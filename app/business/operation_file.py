@@ -1,31 +1,390 @@
 import os
-import glob
-from typing import Generator, Dict, Any
+import codecs
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count, islice
+from typing import Generator, Dict, Any, List, Tuple, Optional
+from app.business.dedup import DedupStore, content_fingerprint
+from app.business.extractors import extract_fields
 from app.models.models import config, FileDocument
 from app.utils.logger_config import logger_index_txt
+from app.utils.metrics import INGEST_STAGE_SECONDS
 
+READ_BUFFER_SIZE = 64 * 1024
+
+
+def document_id(file_path: str) -> str:
+    """
+    calcola un id stabile per il documento a partire dal percorso completo del file,
+    così una nuova indicizzazione aggiorna il documento invece di duplicarlo.
+
+    :param file_path: percorso completo del file
+    :return: id esadecimale del documento
+    """
+
+    return hashlib.sha1(file_path.encode("utf-8")).hexdigest()
+
+
+def file_doc_ids(file_path: str, passages: int) -> List[str]:
+    """
+    restituisce gli id dei documenti indicizzati per un file: un solo documento per i file piccoli,
+    un documento per passaggio per i file divisi.
+
+    :param file_path: percorso completo del file
+    :param passages: numero di passaggi registrato nel manifest (0 se il file non è stato diviso)
+    :return: lista degli id
+    """
+
+    parent_id = document_id(file_path)
+    if not passages:
+        return [parent_id]
+    return [f"{parent_id}-{number}" for number in range(passages)]
+
+
+def iter_txt_files(directory_path: str) -> Generator[Tuple[str, os.stat_result], None, None]:
+    """
+    scansiona in modo lazy l'albero della directory con os.scandir e restituisce i file .txt
+    insieme al loro stat, senza costruire l'elenco completo in memoria.
+
+    :param directory_path: percorso della directory da scansionare.
+    :return: coppie (percorso, stat)
+    """
+
+    stack = [directory_path]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.endswith(".txt") and entry.is_file():
+                            yield entry.path, entry.stat()
+                    except OSError as e:
+                        logger_index_txt.error(f"Errore nel file {entry.path}: {e}")
+        except OSError as e:
+            logger_index_txt.error(f"Errore nella directory {current}: {e}")
+
+
+def build_document(file_path: str, content: str, parent_id: str, number: Optional[int] = None) -> FileDocument:
+    """
+    crea il documento di un file o di un passaggio. i campi strutturati (es. title, summary, link)
+    sono estratti da extract_fields() solo dal file intero o dal primo passaggio, dove si trovano le intestazioni.
+
+    :param file_path: percorso completo del file
+    :param content: testo del file o del passaggio
+    :param parent_id: id del file
+    :param number: numero del passaggio, None per i file non divisi
+    :return: documento validato
+    """
+
+    fields = extract_fields(content) if not number else {}
+    return FileDocument(
+        nome_file=os.path.basename(file_path),
+        contenuto_file=content,
+        percorso_completo=file_path,
+        id_file=parent_id,
+        numero_passaggio=number,
+        **fields
+    )
+
+
+def duplicate_source(source: Dict[str, Any], canonical_path: str) -> Dict[str, Any]:
+    """
+    riduce il documento di un file duplicato a un riferimento al documento canonico: senza contenuto
+    né sommario e con l'id_file del canonico, così le ricerche raggruppano le copie in un solo risultato.
+
+    :param source: documento completo del file
+    :param canonical_path: percorso del file canonico
+    :return: documento di riferimento
+    """
+
+    return {**source, "contenuto_file": "", "anteprima": "", "summary": None,
+            "id_file": document_id(canonical_path), "duplicate_of": canonical_path}
+
+
+def iter_passages(file_path: str, max_chars: int) -> Generator[str, None, None]:
+    """
+    legge un file grande a blocchi di dimensione fissa e lo divide in passaggi di al massimo max_chars
+    caratteri, tagliando preferibilmente su un a capo o uno spazio. la memoria usata non dipende
+    dalla dimensione del file.
+
+    :param file_path: percorso completo del file
+    :param max_chars: lunghezza massima di un passaggio
+    :return: testo dei passaggi
+    """
+
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    text = ""
+    with open(file_path, 'rb') as file:
+        while True:
+            block = file.read(READ_BUFFER_SIZE)
+            text += decoder.decode(block, final=not block)
+            while len(text) >= max_chars:
+                cut = text.rfind("\n", max_chars // 2, max_chars)
+                if cut == -1:
+                    cut = text.rfind(" ", max_chars // 2, max_chars)
+                cut = max_chars if cut == -1 else cut + 1
+                yield text[:cut]
+                text = text[cut:]
+            if not block:
+                break
+    if text:
+        yield text
+
+
+def file_sources(file_path: str, size: int) -> Generator[Tuple[str, Dict[str, Any]], None, None]:
+    """
+    costruisce i documenti di un file: un unico documento se il file è più piccolo di
+    config.PASSAGE_MAX_BYTES, altrimenti un documento per passaggio che punta al file padre tramite id_file.
+
+    :param file_path: percorso completo del file
+    :param size: dimensione del file in byte
+    :return: coppie (id documento, sorgente)
+    """
+
+    parent_id = document_id(file_path)
+    if size <= config.PASSAGE_MAX_BYTES:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            content = file.read()
+        yield parent_id, build_document(file_path, content, parent_id).model_dump()
+        return
+
+    passages = iter_passages(file_path, config.PASSAGE_MAX_BYTES)
+    for number in count():
+        with INGEST_STAGE_SECONDS.time(stage="read"):
+            passage = next(passages, None)
+        if passage is None:
+            return
+        with INGEST_STAGE_SECONDS.time(stage="validate"):
+            doc = build_document(file_path, passage, parent_id, number)
+        with INGEST_STAGE_SECONDS.time(stage="serialize"):
+            source = doc.model_dump()
+        yield f"{parent_id}-{number}", source
 
 
 def file_data_generator(directory_path: str) -> Generator[Dict[str, Any], None, None]:
     """
-    genera documenti da indicizzare partendo dai file .txt in una directory
+    genera documenti da indicizzare partendo dai file .txt in una directory e nelle sue sottodirectory
     per ogni file, legge il contenuto, estrae il nome e il percorso completo.
-    crea un oggetto filedocument e lo restituisce come dizionario
+    crea un oggetto filedocument (o uno per passaggio se il file è grande) e lo restituisce come dizionario
 
     :param directory_path: percorso della directory da scansionare.
     :return:
     """
 
-    for file_path in glob.glob(os.path.join(directory_path, "*.txt")):
+    for file_path, stat in iter_txt_files(directory_path):
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-            file_name = os.path.basename(file_path)
-            doc = FileDocument(
-                nome_file=file_name,
-                contenuto_file=content,
-                percorso_completo=file_path
-            )
-            yield {"_index": config.INDEX_NAME, "_source": doc.model_dump()}
+            for doc_id, source in file_sources(file_path, stat.st_size):
+                yield {"_index": config.INDEX_NAME, "_id": doc_id, "_source": source}
         except Exception as e:
-            logger_index_txt.error(f"Errore nel file {file_path}: {e}")
\ No newline at end of file
+            logger_index_txt.error(f"Errore nel file {file_path}: {e}")
+
+
+def scan_changes(directory_path: str, manifest: Dict[str, Dict[str, Any]]) \
+        -> Tuple[List[Tuple[str, int, float]], List[str]]:
+    """
+    confronta i file .txt della directory con il manifest usando solo size e mtime (nessuna lettura).
+
+    :param directory_path: percorso della directory da scansionare.
+    :param manifest: manifest dell'ultima indicizzazione
+    :return: lista dei file nuovi o modificati (percorso, size, mtime) e lista dei percorsi eliminati
+    """
+
+    changed = []
+    seen = set()
+    for file_path, stat in iter_txt_files(directory_path):
+        seen.add(file_path)
+        entry = manifest.get(file_path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+            changed.append((file_path, stat.st_size, stat.st_mtime))
+    deleted = [file_path for file_path in manifest if file_path not in seen]
+    return changed, deleted
+
+
+class PendingChanges:
+    """
+    tiene traccia delle azioni bulk inviate per ogni file, così il manifest viene aggiornato
+    solo quando tutte le azioni del file (documento, passaggi, cancellazioni) hanno avuto successo.
+    """
+
+    def __init__(self):
+        self.paths: Dict[str, str] = {}
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.completed = 0
+
+    def track(self, file_path: str, doc_id: str) -> None:
+        """registra un'azione bulk generata per il file"""
+        self.paths[doc_id] = file_path
+        state = self.files.setdefault(file_path, {"entry": None, "remaining": 0, "failed": False, "sealed": False})
+        state["remaining"] += 1
+
+    def seal(self, file_path: str, entry: Optional[Dict[str, Any]], manifest: Dict[str, Dict[str, Any]]) -> None:
+        """segnala che tutte le azioni del file sono state generate; entry None indica un file eliminato"""
+        state = self.files.setdefault(file_path, {"entry": None, "remaining": 0, "failed": False, "sealed": False})
+        state["entry"] = entry
+        state["sealed"] = True
+        self._complete(file_path, manifest)
+
+    def confirm(self, doc_id: str, ok: bool, manifest: Dict[str, Dict[str, Any]]) -> None:
+        """registra l'esito di un'azione bulk e aggiorna il manifest se il file è completo"""
+        file_path = self.paths.pop(doc_id, None)
+        if file_path is None:
+            return
+        state = self.files[file_path]
+        state["remaining"] -= 1
+        state["failed"] = state["failed"] or not ok
+        self._complete(file_path, manifest)
+
+    def _complete(self, file_path: str, manifest: Dict[str, Dict[str, Any]]) -> None:
+        state = self.files[file_path]
+        if not state["sealed"] or state["remaining"]:
+            return
+        del self.files[file_path]
+        self.completed += 1
+        if state["failed"]:
+            return
+        if state["entry"] is None:
+            manifest.pop(file_path, None)
+        else:
+            manifest[file_path] = state["entry"]
+
+
+def read_changed_file(file_path: str, size: int, mtime: float, previous_hash: str = None) \
+        -> Tuple[Dict[str, Any], bool, Optional[Dict[str, Any]]]:
+    """
+    legge un file nuovo o modificato e ne calcola l'hash a blocchi.
+    i file piccoli vengono anche trasformati in documento; per i file grandi viene calcolato solo l'hash
+    e i passaggi verranno letti in streaming da file_sources().
+
+    :param file_path: percorso completo del file
+    :param size: dimensione del file in byte
+    :param mtime: data di ultima modifica del file
+    :param previous_hash: hash registrato nel manifest, se presente
+    :return: voce del manifest, true se il contenuto è cambiato, sorgente del documento per i file piccoli
+    """
+
+    digest = hashlib.sha256()
+    with INGEST_STAGE_SECONDS.time(stage="read"):
+        if size <= config.PASSAGE_MAX_BYTES:
+            with open(file_path, 'rb') as file:
+                raw = file.read()
+            digest.update(raw)
+        else:
+            raw = None
+            with open(file_path, 'rb') as file:
+                for block in iter(lambda: file.read(READ_BUFFER_SIZE), b""):
+                    digest.update(block)
+    content_hash = digest.hexdigest()
+    entry = {"size": size, "mtime": mtime, "hash": content_hash, "passages": 0}
+    if previous_hash == content_hash:
+        return entry, False, None
+    if raw is None:
+        return entry, True, None
+
+    parent_id = document_id(file_path)
+    with INGEST_STAGE_SECONDS.time(stage="validate"):
+        doc = build_document(file_path, raw.decode('utf-8'), parent_id)
+    with INGEST_STAGE_SECONDS.time(stage="serialize"):
+        source = doc.model_dump()
+    return entry, True, source
+
+
+def changed_file_generator(changed: List[Tuple[str, int, float]], manifest: Dict[str, Dict[str, Any]],
+                           pending: PendingChanges, workers: int = None,
+                           dedup: Optional[DedupStore] = None) -> Generator[Dict[str, Any], None, None]:
+    """
+    legge solo i file nuovi o modificati con un pool di thread e genera le azioni di indicizzazione con id stabile.
+    le letture in corso sono limitate a una finestra di workers * 4 file, così la memoria resta limitata;
+    i file grandi vengono divisi in passaggi letti in streaming.
+    se l'hash del contenuto non è cambiato aggiorna il manifest senza reinviare il documento.
+    gli id non più prodotti dal file (es. passaggi in eccesso) vengono cancellati.
+    con dedup i file non divisi che duplicano (in modo esatto o quasi) un file già indicizzato
+    vengono inviati come riferimento al canonico, vedi duplicate_source().
+
+    :param changed: file nuovi o modificati restituiti da scan_changes()
+    :param manifest: manifest dell'ultima indicizzazione
+    :param pending: azioni in attesa di conferma dal bulk
+    :param workers: numero di thread di lettura (default config.INGEST_READER_THREADS)
+    :param dedup: archivio delle impronte dell'indice, None per indicizzare tutte le copie
+    :return:
+    """
+
+    workers = workers or config.INGEST_READER_THREADS
+    remaining = iter(changed)
+    window = deque()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reader") as executor:
+        def read(file_path, size, mtime, previous_hash):
+            entry, content_changed, source = read_changed_file(file_path, size, mtime, previous_hash)
+            fingerprint = None
+            if dedup is not None and source is not None:
+                fingerprint = content_fingerprint(source["contenuto_file"])
+            return entry, content_changed, source, fingerprint
+
+        def submit(item):
+            file_path, size, mtime = item
+            previous = manifest.get(file_path)
+            future = executor.submit(read, file_path, size, mtime, previous["hash"] if previous else None)
+            window.append((file_path, size, future))
+
+        for item in islice(remaining, workers * 4):
+            submit(item)
+
+        while window:
+            file_path, size, future = window.popleft()
+            item = next(remaining, None)
+            if item is not None:
+                submit(item)
+            try:
+                entry, content_changed, source, fingerprint = future.result()
+                if not content_changed:
+                    manifest[file_path] = entry
+                    continue
+                if fingerprint is not None:
+                    canonical_path = dedup.register(file_path, fingerprint)
+                    if canonical_path is not None:
+                        source = duplicate_source(source, canonical_path)
+
+                if source is not None:
+                    sources = iter([(document_id(file_path), source)])
+                else:
+                    sources = file_sources(file_path, size)
+                new_ids = set()
+                for doc_id, doc_source in sources:
+                    new_ids.add(doc_id)
+                    pending.track(file_path, doc_id)
+                    yield {"_index": config.INDEX_NAME, "_id": doc_id, "_source": doc_source}
+                if source is None:
+                    entry["passages"] = len(new_ids)
+
+                previous = manifest.get(file_path)
+                if previous is not None:
+                    for doc_id in file_doc_ids(file_path, previous.get("passages", 0)):
+                        if doc_id not in new_ids:
+                            pending.track(file_path, doc_id)
+                            yield {"_op_type": "delete", "_index": config.INDEX_NAME, "_id": doc_id}
+                pending.seal(file_path, entry, manifest)
+            except Exception as e:
+                logger_index_txt.error(f"Errore nel file {file_path}: {e}")
+
+
+def deleted_file_generator(deleted: List[str], manifest: Dict[str, Dict[str, Any]], pending: PendingChanges) \
+        -> Generator[Dict[str, Any], None, None]:
+    """
+    genera le azioni di cancellazione per i file non più presenti nella directory,
+    compresi tutti i passaggi dei file che erano stati divisi.
+
+    :param deleted: percorsi eliminati restituiti da scan_changes()
+    :param manifest: manifest dell'ultima indicizzazione
+    :param pending: azioni in attesa di conferma dal bulk
+    :return:
+    """
+
+    for file_path in deleted:
+        for doc_id in file_doc_ids(file_path, manifest[file_path].get("passages", 0)):
+            pending.track(file_path, doc_id)
+            yield {"_op_type": "delete", "_index": config.INDEX_NAME, "_id": doc_id}
+        pending.seal(file_path, None, manifest)
@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Hashable, List
+
+from app.business.filename_suggest import record_name_changes, reset_name_journal
+from app.business.local_index import build_local_index, load_local_index, local_index_path, open_local_index
+from app.business.manifest import load_manifest, save_manifest
+from app.business.operation_file import scan_changes
+from app.business.search_cache import search_cache
+from app.models.models import config
+from app.utils.logger_config import logger_index_txt
+from app.utils.metrics import INGEST_STAGE_SECONDS, INGEST_DOCS, SEARCH_STAGE_SECONDS, SEARCH_REQUESTS
+
+LOCAL_MANIFEST_NAME = f"local_{config.INDEX_NAME}"
+
+
+def get_local_client() -> str:
+    """
+    "client" del backend locale: il percorso del file dell'indice, usato al posto del client elasticsearch.
+
+    :return: percorso del file dell'indice locale
+    """
+
+    return local_index_path()
+
+
+def run_indexing(index_path: str, progress_bar=None, incremental: bool = True, cancel_event: threading.Event = None):
+    """
+    costruisce l'indice invertito locale dei file .txt. in modalità incrementale confronta la directory
+    con il manifest e, se nessun file è cambiato, mantiene l'indice esistente; altrimenti lo
+    ricostruisce per intero (su corpora della dimensione di directory_file_txt richiede pochi secondi).
+
+    :param index_path: percorso del file dell'indice locale
+    :param progress_bar: oggetto progressbar di streamlit
+    :param incremental: se false ricostruisce comunque l'indice
+    :param cancel_event: se impostato interrompe la costruzione, l'indice precedente resta in uso
+    :return: dict con la stessa forma di operation_elasticsearch.run_indexing()
+    """
+
+    start_time = time.time()
+    try:
+        index_created = not os.path.exists(index_path)
+        manifest = load_manifest(LOCAL_MANIFEST_NAME) if incremental and not index_created else {}
+        with INGEST_STAGE_SECONDS.time(stage="scan"):
+            changed, deleted = scan_changes(config.DIRECTORY_PATH, manifest)
+        if manifest and not changed and not deleted:
+            return {"success": True, "index_created": False, "indexed_docs": 0, "deleted_docs": 0, "errors": 0,
+                    "summary": "Indice locale già aggiornato.", "time": time.time() - start_time}
+
+        manifest = {}
+        if progress_bar is not None:
+            progress_bar.progress(0.0, text="Costruzione indice locale...")
+        with INGEST_STAGE_SECONDS.time(stage="build_local"):
+            result = build_local_index(config.DIRECTORY_PATH, index_path, manifest, cancel_event)
+        if result is None:
+            return {"success": False, "cancelled": True, "error": "Indicizzazione annullata",
+                    "time": time.time() - start_time}
+        INGEST_DOCS.inc(result["docs"])
+        save_manifest(LOCAL_MANIFEST_NAME, manifest)
+        if incremental and not index_created:
+            record_name_changes(manifest, [path for path, _, _ in changed], deleted)
+        else:
+            reset_name_journal()
+        search_cache.invalidate()
+        if progress_bar is not None:
+            progress_bar.progress(1.0, text=f"File elaborati: {result['docs']}")
+
+        total_time = time.time() - start_time
+        logger_index_txt.info(f"Indice locale: {result['docs']} documenti, {result['terms']} termini "
+                              f"in {total_time:.2f}s.")
+        return {"success": True, "index_created": index_created, "indexed_docs": result["docs"],
+                "deleted_docs": len(deleted), "errors": 0, "time": total_time,
+                "summary": f"Indicizzazione locale completata in {total_time:.2f}s. Documenti: {result['docs']}, "
+                           f"eliminati: {len(deleted)}"}
+    except Exception as e:
+        logger_index_txt.error(f"Errore indicizzazione locale: {e}")
+        return {"success": False, "error": str(e)}
+
+
+def rebuild_index(index_path: str, progress_bar=None, cancel_event: threading.Event = None):
+    """
+    ricostruisce da zero l'indice locale; il file viene sostituito in modo atomico,
+    quindi le ricerche in corso continuano sull'indice precedente.
+
+    :param index_path: percorso del file dell'indice locale
+    :param progress_bar: oggetto progressbar di streamlit
+    :param cancel_event: se impostato interrompe la ricostruzione
+    :return: dict
+    """
+
+    result = run_indexing(index_path, progress_bar, incremental=False, cancel_event=cancel_event)
+    if result["success"]:
+        result["index"] = os.path.basename(index_path)
+    return result
+
+
+def rollback_index(index_path: str):
+    """il backend locale conserva una sola generazione: il rollback non è disponibile"""
+    return {"success": False, "error": "Rollback non disponibile con il backend locale"}
+
+
+def check_index_exists(index_path: str) -> (bool, int):
+    """
+    controlla se l'indice locale esiste e quanti documenti contiene.
+
+    :param index_path: percorso del file dell'indice locale
+    :return: dove il primo elemento indica se l'indice esiste e il secondo è il numero di documenti
+    """
+
+    try:
+        index = load_local_index(index_path)
+        if index is None:
+            return False, 0
+        return True, index.doc_count
+    except Exception as e:
+        logger_index_txt.error(f"Errore nel controllare l'indice locale {index_path}: {e}")
+        return False, 0
+
+
+def search_documents(index_path: str, query_nome_file: str, query_contenuto: str, is_phrase_query: bool = False,
+                     selected_sources: List[str] = None, page: int = 1, page_size: int = 10,
+                     cursor_cache: Dict[Hashable, Dict[str, Any]] = None):
+    """
+    esegue la ricerca sull'indice locale: bm25 sul contenuto (fuzziness AUTO, oppure frase con slop 2),
+    nome file per token, nome esatto e sottostringa. cursor_cache è accettato per compatibilità
+    con il backend elasticsearch e non viene usato.
+
+    :return: dict con la stessa forma di operation_elasticsearch.search_documents()
+    """
+
+    if not query_nome_file and not query_contenuto:
+        return {"success": True, "hits": [], "total_hits": 0, "aggregations": {}, "time": 0}
+    try:
+        with open_local_index(index_path) as index:
+            if index is None:
+                logger_index_txt.warning(f"Tentativo di ricerca sull'indice locale non esistente: {index_path}")
+                return {"success": True, "hits": [], "total_hits": 0, "aggregations": {}, "time": 0}
+            result = index.search(query_nome_file, query_contenuto, is_phrase_query, selected_sources, page,
+                                  page_size)
+        SEARCH_STAGE_SECONDS.observe(result["time"], stage="total")
+        SEARCH_REQUESTS.inc(backend="local", outcome="success")
+        return result
+    except Exception as e:
+        logger_index_txt.error(f"Errore ricerca locale: {e}")
+        SEARCH_REQUESTS.inc(backend="local", outcome="error")
+        return {"success": False, "error": str(e)}
+
+
+def get_documents_content(index_path: str, doc_ids: List[str]) -> Dict[str, str]:
+    """
+    recupera il contenuto completo dei documenti indicati leggendo i file originali.
+
+    :param index_path: percorso del file dell'indice locale
+    :param doc_ids: id dei documenti
+    :return: dizionario id -> contenuto_file
+    """
+
+    try:
+        index = load_local_index(index_path)
+        return index.get_content(doc_ids) if index is not None else {}
+    except Exception as e:
+        logger_index_txt.error(f"Errore recupero contenuto documenti: {e}")
+        return {}
+
+
+def get_all_sources(index_path: str, raise_errors: bool = False) -> List[str]:
+    """
+    recupera l'elenco di tutti i nomi file indicizzati nell'indice locale
+
+    :param index_path: percorso del file dell'indice locale
+    :param raise_errors: se true propaga gli errori invece di restituire una lista vuota
+    :return: una lista di stringhe con i nomi dei file.
+    """
+
+    try:
+        index = load_local_index(index_path)
+        return sorted({doc[1] for doc in index.docs}) if index is not None else []
+    except Exception as e:
+        if raise_errors:
+            raise
+        logger_index_txt.error(f"Errore recupero fonti: {e}")
+        return []
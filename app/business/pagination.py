@@ -0,0 +1,207 @@
+import time
+from typing import Any, Dict, Generator, Hashable, List, Optional, Tuple
+
+from elasticsearch import Elasticsearch, NotFoundError
+
+from app.business.search_cache import search_cache
+from app.models.models import config
+from app.utils.logger_config import logger_index_txt
+from app.utils.metrics import record_es_timings
+
+PIT_SORT = [{"_score": "desc"}, {"_shard_doc": "asc"}]
+
+
+def _open_cursor(es: Elasticsearch) -> Dict[str, Any]:
+    """
+    apre un point in time sull'indice e restituisce un cursore vuoto.
+
+    :param es: client elasticsearch
+    :return: stato del cursore
+    """
+
+    res = es.open_point_in_time(index=config.INDEX_NAME, keep_alive=config.PIT_KEEP_ALIVE)
+    return {
+        "pit_id": res["id"],
+        "generation": search_cache.generation,
+        "expires_at": time.monotonic() + config.PIT_CURSOR_TTL,
+        "after": {1: None},
+        "first_page": {},
+        "last_page": None,
+        "total": None,
+        "aggregations": {}
+    }
+
+
+def close_cursor(es: Elasticsearch, cursor: Dict[str, Any]) -> None:
+    """
+    chiude il point in time di un cursore (errori ignorati, il pit scade comunque da solo).
+
+    :param es: client elasticsearch
+    :param cursor: stato del cursore
+    """
+
+    try:
+        es.close_point_in_time(id=cursor["pit_id"])
+    except Exception as e:
+        logger_index_txt.debug(f"Chiusura point in time fallita: {e}")
+
+
+def get_cursor(es: Elasticsearch, cursor_cache: Dict[Hashable, Dict[str, Any]], key: Hashable,
+               reset: bool = False) -> Dict[str, Any]:
+    """
+    restituisce il cursore di una query dalla cache della sessione, aprendone uno nuovo se manca,
+    se è scaduto o se l'indice è stato aggiornato. la cache conserva al massimo
+    config.PIT_CURSORS_PER_SESSION query, chiudendo i point in time più vecchi.
+
+    :param es: client elasticsearch
+    :param cursor_cache: dizionario dei cursori della sessione (es. st.session_state)
+    :param key: chiave della query
+    :param reset: se true riapre comunque il cursore
+    :return: stato del cursore
+    """
+
+    cursor = cursor_cache.pop(key, None)
+    if cursor is not None and (reset or cursor["generation"] != search_cache.generation
+                               or cursor["expires_at"] < time.monotonic()):
+        close_cursor(es, cursor)
+        cursor = None
+    if cursor is None:
+        cursor = _open_cursor(es)
+    cursor_cache[key] = cursor
+
+    while len(cursor_cache) > config.PIT_CURSORS_PER_SESSION:
+        oldest_key = next(iter(cursor_cache))
+        close_cursor(es, cursor_cache.pop(oldest_key))
+    return cursor
+
+
+def _pit_search(es: Elasticsearch, cursor: Dict[str, Any], body: Dict[str, Any]) -> Dict[str, Any]:
+    body = {**body, "pit": {"id": cursor["pit_id"], "keep_alive": config.PIT_KEEP_ALIVE}, "sort": PIT_SORT}
+    start = time.perf_counter()
+    res = es.search(body=body)
+    record_es_timings(res, time.perf_counter() - start)
+    cursor["pit_id"] = res.get("pit_id", cursor["pit_id"])
+    cursor["expires_at"] = time.monotonic() + config.PIT_CURSOR_TTL
+    return res
+
+
+def _fill_page(es: Elasticsearch, cursor: Dict[str, Any], base_body: Dict[str, Any], page: int, page_size: int,
+               full: bool) -> List[Dict[str, Any]]:
+    """
+    legge con search_after i passaggi a partire dal cursore della pagina e li raggruppa per file,
+    fino a riempire page_size risultati. ogni file appartiene alla prima pagina in cui compare,
+    così i passaggi successivi dello stesso file non vengono ripetuti nelle pagine seguenti.
+
+    :param full: se false scarica solo id_file (avanzamento veloce verso pagine lontane)
+    :return: risultati della pagina, uno per file
+    """
+
+    body = dict(base_body)
+    if not full:
+        body.pop("highlight", None)
+        body["_source"] = ["id_file"]
+    batch_size = page_size * 2
+    body["size"] = batch_size
+    if cursor["total"] is None:
+        body["track_total_hits"] = True
+        body["aggs"] = {
+            "sources": {"terms": {"field": "nome_file.keyword", "size": 20}},
+            "files": {"cardinality": {"field": "id_file"}}
+        }
+    else:
+        body["track_total_hits"] = False
+
+    groups, on_page = [], set()
+    after = cursor["after"][page]
+    while len(groups) < page_size:
+        if after is not None:
+            body["search_after"] = after
+        res = _pit_search(es, cursor, body)
+        if cursor["total"] is None:
+            cursor["aggregations"] = res.get("aggregations", {})
+            cursor["total"] = cursor["aggregations"].get("files", {}).get("value", res["hits"]["total"]["value"])
+            body.pop("aggs")
+            body["track_total_hits"] = False
+        hits = res["hits"]["hits"]
+        consumed = 0
+        for hit in hits:
+            consumed += 1
+            after = hit["sort"]
+            file_id = hit["_source"].get("id_file", hit["_id"])
+            if cursor["first_page"].setdefault(file_id, page) == page and file_id not in on_page:
+                on_page.add(file_id)
+                groups.append(hit)
+                if len(groups) == page_size:
+                    break
+        if len(hits) < batch_size:
+            if consumed == len(hits):
+                cursor["last_page"] = page
+            break
+    cursor["after"][page + 1] = after
+    return groups
+
+
+def fetch_page(es: Elasticsearch, cursor: Dict[str, Any], base_body: Dict[str, Any], page: int,
+               page_size: int) -> Tuple[List[Dict[str, Any]], int, Dict[str, Any]]:
+    """
+    restituisce una pagina usando point in time + search_after. se la pagina non è ancora nel cursore
+    avanza dall'ultima pagina nota, un passo leggero per pagina, senza mai usare from/size.
+
+    :param es: client elasticsearch
+    :param cursor: stato del cursore restituito da get_cursor()
+    :param base_body: query e highlight costruiti da build_search_body()
+    :param page: numero di pagina
+    :param page_size: risultati per pagina
+    :return: risultati della pagina, numero totale di file, aggregazioni
+    """
+
+    start = max(known for known in cursor["after"] if known <= page)
+    for step in range(start, page):
+        if cursor["last_page"] is not None and step > cursor["last_page"]:
+            break
+        _fill_page(es, cursor, base_body, step, page_size, full=False)
+    if cursor["last_page"] is not None and page > cursor["last_page"]:
+        return [], cursor["total"] or 0, cursor["aggregations"]
+    hits = _fill_page(es, cursor, base_body, page, page_size, full=True)
+    return hits, cursor["total"], cursor["aggregations"]
+
+
+def iter_all_hits(es: Elasticsearch, base_body: Dict[str, Any], batch_size: int = 1000,
+                  source_includes: Optional[List[str]] = None) -> Generator[Dict[str, Any], None, None]:
+    """
+    itera tutti i documenti che soddisfano la query con point in time + search_after,
+    a memoria costante indipendentemente dal numero di risultati. il point in time viene chiuso alla fine.
+
+    :param es: client elasticsearch
+    :param base_body: query (ed eventualmente highlight) costruiti da build_search_body()
+    :param batch_size: documenti per richiesta
+    :param source_includes: campi di _source da restituire (default tutti)
+    :return: hit elasticsearch
+    """
+
+    cursor = _open_cursor(es)
+    body = {**base_body, "size": batch_size, "track_total_hits": False}
+    if source_includes is not None:
+        body["_source"] = source_includes
+    try:
+        while True:
+            res = _pit_search(es, cursor, body)
+            hits = res["hits"]["hits"]
+            yield from hits
+            if len(hits) < batch_size:
+                return
+            body["search_after"] = hits[-1]["sort"]
+    finally:
+        close_cursor(es, cursor)
+
+
+def is_cursor_expired(error: Exception) -> bool:
+    """
+    riconosce l'errore restituito quando il point in time è scaduto.
+
+    :param error: eccezione sollevata dalla ricerca
+    :return: true se il cursore va riaperto
+    """
+
+    return isinstance(error, NotFoundError) or "search_context_missing_exception" in str(error) \
+        or "No search context found" in str(error)
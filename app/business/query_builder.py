@@ -0,0 +1,160 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.models.models import config
+
+HIGHLIGHT_TAGS = {"pre_tags": ["<mark>"], "post_tags": ["</mark>"]}
+SEARCH_SOURCE_FIELDS = ["nome_file", "percorso_completo", "id_file", "numero_passaggio", "anteprima", "title", "link",
+                        "duplicate_of"]
+CONTENT_FIELDS = ["contenuto_file^2", "contenuto_file.italian^3", "contenuto_file.english^3"]
+HEADER_FIELDS = ["title^3", "summary^2"]
+
+
+def _escape_wildcard(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("*", "\\*").replace("?", "\\?")
+
+
+def build_filename_clause(query_nome_file: str, filename_mode: str = None, expand: bool = True) -> Dict[str, Any]:
+    """
+    costruisce la clausola di ricerca sul nome file in base al sottocampo dell'indice:
+    "ngram" usa il multi_match originale con nome_file.ngram, "edge_ngram" aggiunge una match
+    sui prefissi delle parole, "wildcard" aggiunge una wildcard *termine* per ogni parola.
+    senza expand cerca solo parole intere e nome esatto (più i prefissi, già indicizzati, in "edge_ngram"),
+    senza fuzziness, ngram e wildcard.
+
+    :param query_nome_file: termine di ricerca nel nome
+    :param filename_mode: "ngram", "edge_ngram" o "wildcard" (default config.FILENAME_MATCH_MODE)
+    :param expand: se false esclude le espansioni costose (fase esatta della ricerca adattiva)
+    :return: clausola di query
+    """
+
+    filename_mode = filename_mode or config.FILENAME_MATCH_MODE
+    fields = ["nome_file^5", "nome_file.keyword^10"]
+    if filename_mode == "ngram" and expand:
+        fields.append("nome_file.ngram^3")
+    fuzzy_clause = {
+        "multi_match": {
+            "query": query_nome_file,
+            "fields": fields,
+            "type": "best_fields"
+        }
+    }
+    if expand:
+        fuzzy_clause["multi_match"]["fuzziness"] = "AUTO"
+    if filename_mode == "ngram" or (filename_mode == "wildcard" and not expand):
+        return fuzzy_clause
+
+    if filename_mode == "edge_ngram":
+        partial_clauses = [{"match": {"nome_file.prefix": {"query": query_nome_file, "boost": 3}}}]
+    else:
+        partial_clauses = [
+            {"wildcard": {"nome_file.wildcard": {"value": f"*{_escape_wildcard(term)}*",
+                                                 "case_insensitive": True, "boost": 3}}}
+            for term in query_nome_file.split()
+        ]
+    return {"bool": {"should": [fuzzy_clause, *partial_clauses], "minimum_should_match": 1}}
+
+
+def build_search_body(query_nome_file: str, query_contenuto: str, is_phrase_query: bool = False,
+                      selected_sources: List[str] = None, highlight_mode: str = None,
+                      filename_mode: str = None, expand: bool = True,
+                      header_fields: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    costruisce una query bool elasticsearch per combinare le ricerche su nome file e contenuto.
+    utilizza dei controlli 'should' per dare punteggi più alti a documenti che corrispondono a entrambi i criteri.
+    per la ricerca nel contenuto, supporta ricerche standard e phrase query.
+    _source è limitato ai campi piccoli (SEARCH_SOURCE_FIELDS): il contenuto completo non viene mai
+    trasferito con i risultati e si recupera su richiesta con get_documents_content().
+    in modalità highlight "offsets" il contenuto viene evidenziato una sola volta su contenuto_file,
+    unendo le corrispondenze dei sottocampi con matched_fields e leggendo gli offset dalle postings.
+
+    :param query_nome_file: termine di ricerca nel nome
+    :param query_contenuto: termine di ricerca nel contenuto
+    :param is_phrase_query: se true, cerca frase esatta nel contenuto
+    :param selected_sources: filtra risultati per nome file
+    :param highlight_mode: "reanalyze" o "offsets" (default config.HIGHLIGHT_MODE)
+    :param filename_mode: modalità di ricerca sul nome file, vedi build_filename_clause()
+    :param expand: se false la ricerca non usa fuzziness, ngram e wildcard (solo termini esatti o stemmati)
+    :param header_fields: se true cerca ed evidenzia il contenuto solo in title e summary (campi piccoli
+        estratti all'indicizzazione) invece che nel testo completo
+    :return: body con query, highlight e _source, None se non ci sono termini di ricerca
+    """
+
+    bool_clauses = []
+    highlight_fields = {}
+
+    if query_nome_file:
+        bool_clauses.append(build_filename_clause(query_nome_file, filename_mode, expand))
+        highlight_fields["nome_file"] = {**HIGHLIGHT_TAGS}
+
+    if query_contenuto:
+        query_type = "phrase" if is_phrase_query else "best_fields"
+
+        query_params = {
+            "query": query_contenuto,
+            "fields": HEADER_FIELDS if header_fields else CONTENT_FIELDS,
+            "type": query_type,
+            "slop": 2 if is_phrase_query else 0
+        }
+
+        if not is_phrase_query and expand:
+            query_params["fuzziness"] = "AUTO"
+            query_params["prefix_length"] = 1
+
+        bool_clauses.append({"multi_match": query_params})
+
+        content_fields = ("contenuto_file", "contenuto_file.italian", "contenuto_file.english")
+        if header_fields:
+            for field in ("title", "summary"):
+                highlight_fields[field] = {**HIGHLIGHT_TAGS, "fragment_size": 150, "number_of_fragments": 3}
+        elif (highlight_mode or config.HIGHLIGHT_MODE) == "offsets":
+            highlight_fields["contenuto_file"] = {**HIGHLIGHT_TAGS, "fragment_size": 150, "number_of_fragments": 3,
+                                                  "type": "unified", "matched_fields": list(content_fields)}
+        else:
+            for field in content_fields:
+                highlight_fields[field] = {**HIGHLIGHT_TAGS, "fragment_size": 150, "number_of_fragments": 3}
+
+    if not bool_clauses:
+        return None
+
+    main_query = {"bool": {"should": bool_clauses, "minimum_should_match": 1}}
+
+    if selected_sources:
+        main_query = {"bool": {"must": [main_query], "filter": {"terms": {"nome_file.keyword": selected_sources}}}}
+
+    return {
+        "query": main_query,
+        "_source": {"includes": SEARCH_SOURCE_FIELDS},
+        "highlight": {
+            "fields": highlight_fields,
+            "order": "score",
+            "number_of_fragments": 1,
+            "max_analyzed_offset": 1000000
+        }
+    }
+
+
+def build_search_phases(query_nome_file: str, query_contenuto: str, is_phrase_query: bool = False,
+                        selected_sources: List[str] = None, highlight_mode: str = None,
+                        filename_mode: str = None, adaptive: bool = None) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    fasi di esecuzione di una ricerca. in modalità adattiva, se c'è un termine sul contenuto, la prima fase
+    ("fields") lo cerca solo nei campi piccoli title e summary; la fase "exact" usa solo termini esatti
+    o stemmati sul testo completo, l'ultima ("expanded") aggiunge fuzziness, ngram e wildcard. ogni fase
+    viene eseguita solo se la precedente trova meno di config.SEARCH_ADAPTIVE_MIN_HITS file.
+    se exact ed expanded coincidono (es. phrase query sul solo contenuto) resta la sola fase "exact".
+
+    :param adaptive: se false una sola fase "expanded" (default config.SEARCH_ADAPTIVE)
+    :return: coppie (fase, body) da eseguire in ordine, lista vuota se non ci sono termini di ricerca
+    """
+
+    args = (query_nome_file, query_contenuto, is_phrase_query, selected_sources, highlight_mode, filename_mode)
+    expanded = build_search_body(*args)
+    if expanded is None:
+        return []
+    if not (config.SEARCH_ADAPTIVE if adaptive is None else adaptive):
+        return [("expanded", expanded)]
+    exact = build_search_body(*args, expand=False)
+    phases = [("exact", exact)] if exact == expanded else [("exact", exact), ("expanded", expanded)]
+    if query_contenuto:
+        phases.insert(0, ("fields", build_search_body(*args, expand=False, header_fields=True)))
+    return phases
@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from app.models.models import config
+from app.utils.logger_config import logger_index_txt
+
+
+class QueryCache:
+    """
+    cache dei risultati di ricerca condivisa tra le sessioni del processo, con eviction LRU e scadenza TTL.
+    ogni indicizzazione incrementa la generazione e svuota la cache, così non vengono mai serviti
+    risultati precedenti all'ultimo aggiornamento dell'indice. l'invalidazione viene segnalata anche
+    agli altri processi (es. il watcher avviato da riga di comando) con un file in config.STATE_DIR,
+    il cui mtime viene controllato a ogni lettura della generazione o della cache.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._generation = 0
+        self._stamp = self._read_stamp()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._phases: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(query_nome_file: str, query_contenuto: str, is_phrase_query: bool,
+                 selected_sources: Optional[List[str]], page: int, page_size: int) -> Tuple:
+        """
+        normalizza i parametri di ricerca in una chiave (spazi superflui rimossi, fonti ordinate).
+
+        :return: tupla usata come chiave della cache
+        """
+
+        return (
+            " ".join((query_nome_file or "").split()),
+            " ".join((query_contenuto or "").split()),
+            bool(is_phrase_query),
+            tuple(sorted(selected_sources or [])),
+            page,
+            page_size
+        )
+
+    @staticmethod
+    def stamp_path() -> Path:
+        """file che segnala tra processi l'ultima invalidazione dell'indice"""
+        return Path(config.STATE_DIR) / f"cache_{config.SEARCH_BACKEND}_{config.INDEX_NAME}.stamp"
+
+    def _read_stamp(self) -> Optional[int]:
+        try:
+            return os.stat(self.stamp_path()).st_mtime_ns
+        except OSError:
+            return None
+
+    def _sync(self) -> None:
+        """con il lock acquisito: se un altro processo ha invalidato l'indice svuota la cache"""
+        stamp = self._read_stamp()
+        if stamp != self._stamp:
+            self._generation += 1
+            self._entries.clear()
+            self._phases.clear()
+            self._stamp = stamp
+
+    @property
+    def generation(self) -> int:
+        """generazione corrente dell'indice, incrementata dalle invalidazioni di qualsiasi processo"""
+        with self._lock:
+            self._sync()
+            return self._generation
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """restituisce il risultato in cache se presente e non scaduto"""
+        with self._lock:
+            self._sync()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Dict[str, Any], generation: int) -> None:
+        """salva un risultato, a meno che l'indice non sia stato aggiornato durante la ricerca"""
+        with self._lock:
+            self._sync()
+            if generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_phase(self, key: Hashable) -> Optional[str]:
+        """
+        fase della ricerca adattiva scelta per una query nella generazione corrente. le fasi sono tenute
+        fuori dalle voci LRU, quindi non occupano posti dei risultati e non contano nelle statistiche.
+        """
+
+        with self._lock:
+            self._sync()
+            return self._phases.get(key)
+
+    def put_phase(self, key: Hashable, phase: str, generation: int) -> None:
+        """memorizza la fase scelta per una query, a meno che l'indice non sia stato aggiornato nel frattempo"""
+        with self._lock:
+            self._sync()
+            if generation != self._generation:
+                return
+            self._phases[key] = phase
+            self._phases.move_to_end(key)
+            while len(self._phases) > self.max_size:
+                self._phases.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """incrementa la generazione dell'indice, svuota la cache e lo segnala agli altri processi"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._phases.clear()
+            try:
+                path = self.stamp_path()
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.touch()
+                now = time.time_ns()
+                os.utime(path, ns=(now, now))
+                self._stamp = self._read_stamp()
+            except OSError as e:
+                logger_index_txt.warning(f"Impossibile segnalare l'invalidazione della cache: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        """contatori di hit, miss, eviction e dimensione corrente"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "size": len(self._entries), "generation": self._generation}
+
+
+search_cache = QueryCache(config.SEARCH_CACHE_SIZE, config.SEARCH_CACHE_TTL)
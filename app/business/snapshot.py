@@ -0,0 +1,379 @@
+"""
+snapshot portabili dell'indice: export in una directory con mapping, settings di analisi e documenti
+in blocchi ndjson compressi (gzip), più uno snapshot.json con numero di documenti e sha256 di ogni blocco.
+il restore carica i blocchi in una nuova generazione con bulk paralleli e sposta l'alias,
+senza rileggere e rianalizzare i file di config.DIRECTORY_PATH. funziona offline da un file locale.
+
+uso: python -m app.business.snapshot export|restore|verify <directory>
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Generator, List, Tuple
+
+from elasticsearch import Elasticsearch
+
+from app.business.dedup import DedupStore, load_dedup_store
+from app.business.manifest import load_manifest, save_manifest
+from app.business.operation_elasticsearch import check_index_exists, current_index, delete_old_generations, \
+    parallel_bulk_index, swap_alias, versioned_index_name, _discard_generation
+from app.business.pagination import iter_all_hits
+from app.business.search_cache import search_cache
+from app.models.models import config
+from app.utils.logger_config import logger_index_txt
+from app.utils.metrics import INGEST_ERRORS, INGEST_STAGE_SECONDS
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_FILE = "snapshot.json"
+
+
+def _write_blob(path: Path, data: bytes) -> Dict[str, Any]:
+    """comprime e scrive un blocco, restituendo nome, dimensione e sha256 del file compresso"""
+    compressed = gzip.compress(data, compresslevel=6, mtime=0)
+    with open(path, "wb") as file:
+        file.write(compressed)
+    return {"file": path.name, "bytes": len(compressed), "sha256": hashlib.sha256(compressed).hexdigest()}
+
+
+def _read_blob(directory: Path, entry: Dict[str, Any]) -> bytes:
+    """legge un blocco verificando lo sha256 registrato in snapshot.json e lo decomprime"""
+    with open(directory / entry["file"], "rb") as file:
+        compressed = file.read()
+    if hashlib.sha256(compressed).hexdigest() != entry["sha256"]:
+        raise ValueError(f"Checksum non valido per '{entry['file']}': snapshot corrotto o incompleto")
+    return gzip.decompress(compressed)
+
+
+def _index_definition(es: Elasticsearch, index_name: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    legge settings di analisi e mappings dell'indice concreto, come restituiti da elasticsearch
+    (comprese le modalità salvate in _meta e i campi aggiunti da add_missing_fields()).
+
+    :param es: client elasticsearch
+    :param index_name: indice concreto
+    :return: settings per indices.create e mappings
+    """
+
+    definition = es.indices.get(index=index_name)[index_name]
+    index_settings = definition["settings"]["index"]
+    settings = {"analysis": index_settings.get("analysis", {})}
+    if "max_ngram_diff" in index_settings:
+        settings["index.max_ngram_diff"] = int(index_settings["max_ngram_diff"])
+    return settings, definition["mappings"]
+
+
+def export_snapshot(es: Elasticsearch, path: str, chunk_docs: int = None, workers: int = None,
+                    progress_bar=None) -> Dict[str, Any]:
+    """
+    esporta l'indice attivo in una directory di snapshot. i documenti vengono letti con point in time
+    + search_after (vista coerente anche con scritture in corso) e compressi in parallelo a blocchi di
+    chunk_docs. insieme ai documenti vengono salvati il manifest dei file e l'archivio delle impronte,
+    così dopo il restore l'indicizzazione incrementale non reinvia i file invariati.
+    la directory viene scritta accanto alla destinazione e rinominata solo a export completato.
+
+    :param es: client elasticsearch
+    :param path: directory dello snapshot (sostituita se contiene già uno snapshot)
+    :param chunk_docs: documenti per blocco (default config.SNAPSHOT_CHUNK_DOCS)
+    :param workers: thread di compressione (default config.SNAPSHOT_WORKERS)
+    :param progress_bar: oggetto progressbar di streamlit
+    :return: dict con documenti, blocchi, byte e tempo
+    """
+
+    chunk_docs = chunk_docs or config.SNAPSHOT_CHUNK_DOCS
+    workers = workers or config.SNAPSHOT_WORKERS
+    target = Path(path)
+    if target.exists() and not (target / SNAPSHOT_FILE).exists():
+        return {"success": False, "error": f"'{target}' esiste e non contiene uno snapshot"}
+    tmp_dir = target.with_name(f"{target.name}.tmp-{os.getpid()}")
+    start_time = time.time()
+    try:
+        source_index = current_index(es)
+        exists, expected = check_index_exists(es)
+        if not exists:
+            return {"success": False, "error": f"L'indice '{config.INDEX_NAME}' non esiste"}
+        settings, mappings = _index_definition(es, source_index)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+
+        chunks, in_flight, lines, docs = [], deque(), [], 0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="snapshot") as executor:
+            def collect():
+                future, count = in_flight.popleft()
+                chunks.append({**future.result(), "docs": count})
+
+            def flush():
+                if len(in_flight) >= workers * 2:
+                    collect()
+                name = f"docs-{len(chunks) + len(in_flight):05d}.ndjson.gz"
+                in_flight.append((executor.submit(_write_blob, tmp_dir / name, "".join(lines).encode("utf-8")),
+                                  len(lines)))
+                lines.clear()
+
+            with INGEST_STAGE_SECONDS.time(stage="snapshot_export"):
+                for hit in iter_all_hits(es, {"query": {"match_all": {}}}, batch_size=min(chunk_docs, 10000)):
+                    lines.append(json.dumps({"_id": hit["_id"], "_source": hit["_source"]},
+                                            ensure_ascii=False) + "\n")
+                    docs += 1
+                    if len(lines) == chunk_docs:
+                        flush()
+                        if progress_bar is not None and expected:
+                            progress_bar.progress(min(docs / expected, 1.0),
+                                                  text=f"Documenti esportati: {docs}/{expected}")
+                if lines:
+                    flush()
+                while in_flight:
+                    collect()
+
+        state = {"manifest": _write_blob(tmp_dir / "state-manifest.json.gz",
+                                         json.dumps(load_manifest(source_index)).encode("utf-8"))}
+        dedup = load_dedup_store(source_index)
+        if dedup.entries:
+            state["dedup"] = _write_blob(tmp_dir / "state-dedup.json.gz", json.dumps(dedup.entries).encode("utf-8"))
+        snapshot = {
+            "format": SNAPSHOT_FORMAT,
+            "index": config.INDEX_NAME,
+            "source_index": source_index,
+            "directory_path": config.DIRECTORY_PATH,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "docs": docs,
+            "settings": settings,
+            "mappings": mappings,
+            "chunks": chunks,
+            "state": state
+        }
+        with open(tmp_dir / SNAPSHOT_FILE, "w", encoding="utf-8") as file:
+            json.dump(snapshot, file, ensure_ascii=False, indent=2)
+        if target.exists():
+            shutil.rmtree(target)
+        os.replace(tmp_dir, target)
+    except Exception as e:
+        logger_index_txt.error(f"Errore export snapshot: {e}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return {"success": False, "error": str(e)}
+
+    total_time = time.time() - start_time
+    total_bytes = sum(chunk["bytes"] for chunk in chunks)
+    logger_index_txt.info(f"Snapshot di '{source_index}' esportato in '{target}': {docs} documenti, "
+                          f"{len(chunks)} blocchi, {total_bytes / (1024 * 1024):.2f} MB in {total_time:.2f}s.")
+    if docs != expected:
+        logger_index_txt.warning(f"Documenti esportati ({docs}) diversi dal conteggio dell'indice ({expected}): "
+                                 f"l'indice è stato modificato durante l'export.")
+    return {"success": True, "path": str(target), "index": source_index, "docs": docs, "chunks": len(chunks),
+            "bytes": total_bytes, "time": total_time}
+
+
+def load_snapshot(path: str) -> Dict[str, Any]:
+    """
+    legge lo snapshot.json di una directory di snapshot e ne controlla il formato.
+
+    :param path: directory dello snapshot
+    :return: descrizione dello snapshot
+    """
+
+    with open(Path(path) / SNAPSHOT_FILE, "r", encoding="utf-8") as file:
+        snapshot = json.load(file)
+    if snapshot.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"Formato snapshot non supportato: {snapshot.get('format')}")
+    return snapshot
+
+
+def snapshot_available() -> bool:
+    """true se config.SNAPSHOT_PATH indica uno snapshot da usare al posto dell'indicizzazione iniziale"""
+    return bool(config.SNAPSHOT_PATH) and config.SEARCH_BACKEND == "elasticsearch" \
+        and (Path(config.SNAPSHOT_PATH) / SNAPSHOT_FILE).exists()
+
+
+def verify_snapshot(path: str) -> Dict[str, Any]:
+    """
+    verifica checksum e numero di documenti di tutti i blocchi, senza contattare elasticsearch.
+
+    :param path: directory dello snapshot
+    :return: dict con esito, documenti contati ed eventuale errore
+    """
+
+    try:
+        snapshot = load_snapshot(path)
+        docs = 0
+        for chunk in snapshot["chunks"]:
+            count = _read_blob(Path(path), chunk).count(b"\n")
+            if count != chunk["docs"]:
+                raise ValueError(f"'{chunk['file']}' contiene {count} documenti invece di {chunk['docs']}")
+            docs += count
+        for entry in snapshot["state"].values():
+            _read_blob(Path(path), entry)
+        if docs != snapshot["docs"]:
+            raise ValueError(f"Lo snapshot contiene {docs} documenti invece di {snapshot['docs']}")
+        return {"success": True, "docs": docs, "chunks": len(snapshot["chunks"])}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def _read_chunk(directory: Path, chunk: Dict[str, Any], index_name: str) -> List[Dict[str, Any]]:
+    """legge un blocco e lo trasforma in azioni bulk per l'indice indicato"""
+    lines = _read_blob(directory, chunk).decode("utf-8").splitlines()
+    if len(lines) != chunk["docs"]:
+        raise ValueError(f"'{chunk['file']}' contiene {len(lines)} documenti invece di {chunk['docs']}")
+    actions = []
+    for line in lines:
+        doc = json.loads(line)
+        actions.append({"_index": index_name, "_id": doc["_id"], "_source": doc["_source"]})
+    return actions
+
+
+def snapshot_actions(path: str, snapshot: Dict[str, Any], index_name: str, workers: int = None) \
+        -> Generator[Dict[str, Any], None, None]:
+    """
+    azioni bulk dei documenti dello snapshot. lettura, verifica e decompressione dei blocchi avvengono
+    in parallelo, con al massimo workers * 2 blocchi in memoria.
+
+    :param path: directory dello snapshot
+    :param snapshot: descrizione restituita da load_snapshot()
+    :param index_name: indice di destinazione
+    :param workers: thread di lettura (default config.SNAPSHOT_WORKERS)
+    :return: azioni bulk
+    """
+
+    workers = workers or config.SNAPSHOT_WORKERS
+    chunks = iter(snapshot["chunks"])
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="snapshot") as executor:
+        in_flight = deque(executor.submit(_read_chunk, Path(path), chunk, index_name)
+                          for chunk in islice(chunks, workers * 2))
+        while in_flight:
+            actions = in_flight.popleft().result()
+            for chunk in islice(chunks, 1):
+                in_flight.append(executor.submit(_read_chunk, Path(path), chunk, index_name))
+            yield from actions
+
+
+def restore_snapshot(es: Elasticsearch, path: str, progress_bar=None,
+                     cancel_event: threading.Event = None) -> Dict[str, Any]:
+    """
+    ripristina uno snapshot in una nuova generazione dell'indice (refresh disattivato e zero repliche
+    durante il caricamento) con parallel_bulk_index(), poi sposta l'alias in modo atomico.
+    l'alias viene spostato solo se il conteggio della nuova generazione corrisponde allo snapshot;
+    dopo lo spostamento il conteggio viene ricontrollato con check_index_exists().
+    manifest dei file e impronte vengono ripristinati per la nuova generazione, così la successiva
+    indicizzazione incrementale invia solo i file cambiati dopo l'export.
+
+    :param es: client elasticsearch
+    :param path: directory dello snapshot
+    :param progress_bar: oggetto progressbar di streamlit
+    :param cancel_event: se impostato interrompe il ripristino, l'alias resta invariato
+    :return: dict con documenti ripristinati, generazione creata e throughput
+    """
+
+    start_time = time.time()
+    new_index = versioned_index_name()
+    try:
+        snapshot = load_snapshot(path)
+        if snapshot["directory_path"] != config.DIRECTORY_PATH:
+            logger_index_txt.warning(f"Snapshot creato per '{snapshot['directory_path']}', directory attuale "
+                                     f"'{config.DIRECTORY_PATH}': i percorsi dei documenti non corrisponderanno.")
+        settings = {**snapshot["settings"], "index.number_of_replicas": 0, "index.refresh_interval": "-1"}
+        es.indices.create(index=new_index, body={"settings": settings, "mappings": snapshot["mappings"]})
+        logger_index_txt.info(f"Ripristino dello snapshot '{path}' nella generazione '{new_index}'.")
+
+        total, restored, errors, cancelled, stats = snapshot["docs"], 0, [], False, {}
+        bulk = parallel_bulk_index(es, snapshot_actions(path, snapshot, new_index), stats)
+        with INGEST_STAGE_SECONDS.time(stage="snapshot_restore"):
+            for ok, item in bulk:
+                if ok:
+                    restored += 1
+                else:
+                    errors.append(item)
+                    INGEST_ERRORS.inc()
+                if progress_bar is not None and total and (restored + len(errors)) % 1000 == 0:
+                    progress_bar.progress(min((restored + len(errors)) / total, 1.0),
+                                          text=f"Documenti ripristinati: {restored}/{total}")
+                if cancel_event is not None and cancel_event.is_set():
+                    cancelled = True
+                    break
+        bulk.close()
+        if cancelled or errors:
+            _discard_generation(es, new_index)
+            if errors:
+                logger_index_txt.error(f"Errori bulk ripristino: {errors[:5]}")
+            return {"success": False, "cancelled": cancelled, "indexed_docs": restored, "errors": len(errors),
+                    "error": "Ripristino annullato" if cancelled else f"{len(errors)} documenti non ripristinati"}
+
+        es.indices.put_settings(index=new_index, settings={
+            "index.number_of_replicas": config.INDEX_NUMBER_OF_REPLICAS,
+            "index.refresh_interval": None
+        })
+        es.indices.refresh(index=new_index)
+        restored_count = es.count(index=new_index)["count"]
+        if restored_count != total:
+            _discard_generation(es, new_index)
+            return {"success": False, "indexed_docs": restored,
+                    "error": f"La generazione ripristinata contiene {restored_count} documenti invece di {total}"}
+        es.cluster.health(index=new_index, wait_for_status="yellow", timeout="60s")
+
+        directory = Path(path)
+        save_manifest(new_index, json.loads(_read_blob(directory, snapshot["state"]["manifest"])))
+        if "dedup" in snapshot["state"]:
+            DedupStore(new_index, json.loads(_read_blob(directory, snapshot["state"]["dedup"]))).save()
+        swap_alias(es, new_index)
+        search_cache.invalidate()
+        removed = delete_old_generations(es)
+    except Exception as e:
+        logger_index_txt.error(f"Errore ripristino snapshot: {e}")
+        _discard_generation(es, new_index)
+        return {"success": False, "error": str(e)}
+
+    exists, doc_count = check_index_exists(es)
+    total_time = time.time() - start_time
+    docs_per_second = restored / total_time if total_time else 0
+    mb_per_second = stats.get("bytes", 0) / (1024 * 1024) / total_time if total_time else 0
+    logger_index_txt.info(f"Snapshot ripristinato in '{new_index}': {restored} documenti in {total_time:.2f}s "
+                          f"({docs_per_second:.1f} doc/s).")
+    result = {"success": exists and doc_count == total, "index": new_index, "removed_generations": removed,
+              "indexed_docs": restored, "doc_count": doc_count, "errors": 0, "time": total_time,
+              "docs_per_second": docs_per_second, "mb_per_second": mb_per_second}
+    if not result["success"]:
+        result["error"] = f"L'indice '{config.INDEX_NAME}' contiene {doc_count} documenti invece di {total}"
+    return result
+
+
+def main():
+    from app.business.indexing_jobs import job_manager
+    from app.business.operation_elasticsearch import get_elasticsearch_client
+
+    parser = argparse.ArgumentParser(description="Export e ripristino di snapshot dell'indice")
+    parser.add_argument("command", choices=("export", "restore", "verify"))
+    parser.add_argument("path", help="directory dello snapshot")
+    parser.add_argument("--chunk-docs", type=int, default=config.SNAPSHOT_CHUNK_DOCS,
+                        help="documenti per blocco (export)")
+    args = parser.parse_args()
+
+    if args.command == "verify":
+        result = verify_snapshot(args.path)
+    else:
+        es = get_elasticsearch_client()
+        if es is None:
+            raise SystemExit("Elasticsearch non raggiungibile")
+
+        def task(cancel_event):
+            if args.command == "export":
+                return export_snapshot(es, args.path, args.chunk_docs)
+            return restore_snapshot(es, args.path, cancel_event=cancel_event)
+
+        result = job_manager.run_exclusive(args.command, task, record=args.command == "restore")
+        if result is None:
+            raise SystemExit("Un'indicizzazione è già in corso sull'indice")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if not result["success"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+watcher della directory dei file .txt: segue creazioni, modifiche, cancellazioni e rinomine sotto
+config.DIRECTORY_PATH e le invia all'indice in micro-batch, senza riscansionare tutta la directory.
+
+uso: python -m app.business.watcher
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.business.indexing_jobs import job_manager
+from app.business.manifest import load_manifest, manifest_path, save_manifest
+from app.business.operation_file import iter_txt_files, scan_changes
+from app.business.search_cache import search_cache
+from app.models.models import config
+from app.utils.logger_config import logger_index_txt
+
+WATCH_MODES = ("auto", "inotify", "polling")
+WATCH_REFRESH_POLICIES = ("auto", "flush")
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+# evento normalizzato: ("changed" | "deleted" | "rescan", percorso)
+Event = Tuple[str, str]
+
+
+class InotifyEvents:
+    """sorgente di eventi basata su inotify (linux), con una watch per ogni sottodirectory"""
+
+    def __init__(self, root: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 fallita")
+        self._paths: Dict[int, str] = {}
+        self.add_tree(root)
+
+    def add_tree(self, directory: str) -> List[Event]:
+        """
+        aggiunge le watch a una directory e alle sue sottodirectory.
+
+        :return: eventi per i file .txt già presenti (creati prima che la watch fosse attiva)
+        """
+
+        events = []
+        for current, _, files in os.walk(directory):
+            wd = self._add_watch(self._fd, os.fsencode(current), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch fallita su {current}")
+            self._paths[wd] = current
+            events.extend(("changed", os.path.join(current, name)) for name in files if name.endswith(".txt"))
+        return events
+
+    def read(self, timeout: float) -> List[Event]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode("utf-8", "surrogateescape")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                events.append(("rescan", ""))
+                continue
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+            directory = self._paths.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        events.extend(self.add_tree(path))
+                    except OSError as e:
+                        logger_index_txt.warning(f"Watch non aggiunta su {path}: {e}")
+                        events.append(("rescan", ""))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    events.append(("deleted", path + os.sep))
+            elif name.endswith(".txt"):
+                events.append(("deleted" if mask & (IN_DELETE | IN_MOVED_FROM) else "changed", path))
+        return events
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingEvents:
+    """
+    sorgente di eventi a polling, per sistemi senza inotify: confronta a intervalli size e mtime
+    dei file (solo stat, nessuna lettura) con la scansione precedente.
+    """
+
+    def __init__(self, root: str, interval: float):
+        self.root = root
+        self.interval = interval
+        self._snapshot = {path: (stat.st_size, stat.st_mtime) for path, stat in iter_txt_files(root)}
+        self._next_scan = time.monotonic() + interval
+
+    def read(self, timeout: float) -> List[Event]:
+        wait = self._next_scan - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(wait, 0))
+        self._next_scan = time.monotonic() + self.interval
+        snapshot = {path: (stat.st_size, stat.st_mtime) for path, stat in iter_txt_files(self.root)}
+        events = [("changed", path) for path, state in snapshot.items() if self._snapshot.get(path) != state]
+        events.extend(("deleted", path) for path in self._snapshot if path not in snapshot)
+        self._snapshot = snapshot
+        return events
+
+    def close(self) -> None:
+        pass
+
+
+class DirectoryWatcher:
+    """
+    raccoglie gli eventi, li accorpa per percorso e invia i file "stabili" (nessun evento da
+    config.WATCH_DEBOUNCE secondi, oppure in attesa da più di config.WATCH_MAX_DELAY) in micro-batch
+    di al massimo config.WATCH_BATCH_MAX_FILES file. i batch usano lo stesso lock dei job di indicizzazione.
+    con il backend locale l'indice è un unico file che va riscritto per intero, quindi le modifiche
+    vengono accorpate in un solo aggiornamento ogni config.WATCH_LOCAL_INTERVAL secondi.
+    """
+
+    def __init__(self, client, root: str = None, mode: str = None):
+        self.client = client
+        self.root = root or config.DIRECTORY_PATH
+        self.mode = mode or config.WATCH_MODE
+        if self.mode not in WATCH_MODES:
+            raise ValueError(f"Modalità watcher non valida: {self.mode}")
+        if config.WATCH_REFRESH not in WATCH_REFRESH_POLICIES:
+            raise ValueError(f"Politica di refresh non valida: {config.WATCH_REFRESH}")
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.stats = {"flushes": 0, "indexed_docs": 0, "deleted_docs": 0, "errors": 0}
+        self._rescan = True
+        self._manifest: Optional[Dict[str, Dict[str, Any]]] = None
+        self._manifest_key: Optional[Tuple[str, float]] = None
+        self._last_refresh = 0.0
+        self._last_flush = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._source = None
+
+    def _open_source(self):
+        if self.mode in ("auto", "inotify"):
+            try:
+                source = InotifyEvents(self.root)
+                logger_index_txt.info(f"Watcher inotify attivo su {self.root}.")
+                return source
+            except (OSError, AttributeError) as e:
+                if self.mode == "inotify":
+                    raise
+                logger_index_txt.warning(f"inotify non disponibile ({e}), uso il polling.")
+        logger_index_txt.info(f"Watcher a polling attivo su {self.root} (ogni {config.WATCH_POLL_INTERVAL}s).")
+        return PollingEvents(self.root, config.WATCH_POLL_INTERVAL)
+
+    def _collect(self, events: List[Event]) -> None:
+        now = time.monotonic()
+        for kind, path in events:
+            if kind == "rescan":
+                self._rescan = True
+                continue
+            state = self.pending.setdefault(path, {"first": now})
+            state["kind"] = kind
+            state["last"] = now
+
+    def _ready(self) -> List[str]:
+        """
+        percorsi stabili da inviare, dal più vecchio, al massimo config.WATCH_BATCH_MAX_FILES.
+        con il backend locale tutti i percorsi stabili, al più una volta ogni config.WATCH_LOCAL_INTERVAL secondi.
+        """
+
+        now = time.monotonic()
+        local = config.SEARCH_BACKEND == "local"
+        if local and now - self._last_flush < config.WATCH_LOCAL_INTERVAL:
+            return []
+        ready = [path for path, state in self.pending.items()
+                 if now - state["last"] >= config.WATCH_DEBOUNCE or now - state["first"] >= config.WATCH_MAX_DELAY]
+        ready.sort(key=lambda path: self.pending[path]["first"])
+        return ready if local else ready[:config.WATCH_BATCH_MAX_FILES]
+
+    def _load_manifest(self, index_name: str) -> Dict[str, Dict[str, Any]]:
+        """manifest tenuto in memoria tra i batch, ricaricato se un job lo ha riscritto nel frattempo"""
+        path = manifest_path(index_name)
+        key = (index_name, path.stat().st_mtime if path.exists() else 0.0)
+        if self._manifest is None or key != self._manifest_key:
+            self._manifest = load_manifest(index_name)
+            self._manifest_key = key
+        return self._manifest
+
+    def _changes(self, paths: List[str], manifest: Dict[str, Dict[str, Any]]) \
+            -> Tuple[List[Tuple[str, int, float]], List[str]]:
+        changed, deleted = [], []
+        for path in paths:
+            if self.pending[path]["kind"] == "deleted" and path.endswith(os.sep):
+                deleted.extend(known for known in manifest if known.startswith(path))
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                if path in manifest:
+                    deleted.append(path)
+                continue
+            entry = manifest.get(path)
+            if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+                changed.append((path, stat.st_size, stat.st_mtime))
+        return changed, sorted(set(deleted))
+
+    def _flush_elasticsearch(self, paths: List[str], cancel_event: threading.Event) -> Dict[str, Any]:
+        from app.business.operation_elasticsearch import create_index, current_index, index_file_changes, \
+            purge_legacy_documents
+
+        es = self.client
+        index_created = create_index(es)
+        target = current_index(es)
+        if not index_created and purge_legacy_documents(es, target):
+            self._rescan = True
+        manifest = self._load_manifest(target)
+        if self._rescan:
+            changed, deleted = scan_changes(self.root, manifest)
+        else:
+            changed, deleted = self._changes(paths, manifest)
+        result = index_file_changes(es, target, manifest, changed, deleted, cancel_event=cancel_event)
+        if config.WATCH_REFRESH == "flush" and time.monotonic() - self._last_refresh >= config.WATCH_REFRESH_MIN_INTERVAL:
+            es.indices.refresh(index=target)
+            self._last_refresh = time.monotonic()
+        save_manifest(target, manifest)
+        self._manifest_key = (target, manifest_path(target).stat().st_mtime)
+        return {"success": not result["cancelled"], **result}
+
+    def _flush_local(self, paths: List[str], cancel_event: threading.Event) -> Dict[str, Any]:
+        # il formato a file unico non si aggiorna per documento: run_indexing riscansiona la directory e
+        # ricostruisce l'indice una volta per tutti i percorsi accorpati da _ready()
+        from app.business.operation_local import run_indexing
+
+        return run_indexing(self.client, cancel_event=cancel_event)
+
+    def flush(self, paths: List[str]) -> bool:
+        """
+        invia un micro-batch. se è attivo un altro job di indicizzazione i percorsi restano in attesa.
+
+        :param paths: percorsi pronti restituiti da _ready()
+        :return: true se il batch è stato inviato
+        """
+
+        flush = self._flush_local if config.SEARCH_BACKEND == "local" else self._flush_elasticsearch
+        try:
+            result = job_manager.run_exclusive("watch", lambda cancel_event: flush(paths, cancel_event))
+        except Exception as e:
+            logger_index_txt.error(f"Micro-batch del watcher fallito: {e}")
+            return False
+        if result is None or not result["success"]:
+            return False
+        for path in paths:
+            self.pending.pop(path, None)
+        self._rescan = False
+        self._last_flush = time.monotonic()
+        search_cache.invalidate()
+        self.stats["flushes"] += 1
+        for field in ("indexed_docs", "deleted_docs", "errors"):
+            self.stats[field] += result.get(field, 0)
+        if result.get("indexed_docs") or result.get("deleted_docs"):
+            logger_index_txt.info(f"Watcher: {result.get('indexed_docs', 0)} documenti indicizzati, "
+                                  f"{result.get('deleted_docs', 0)} eliminati.")
+        return True
+
+    def run(self) -> None:
+        """ciclo del watcher: legge gli eventi e invia i batch pronti finché non viene fermato"""
+        self._source = self._open_source()
+        try:
+            while not self._stop.is_set():
+                self._collect(self._source.read(timeout=min(config.WATCH_DEBOUNCE, 0.5)))
+                ready = self._ready()
+                if (ready or self._rescan) and not self.flush(ready):
+                    self._stop.wait(config.WATCH_DEBOUNCE)
+        finally:
+            self._source.close()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.run, name="directory-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+_watcher_lock = threading.Lock()
+_watcher: Optional[DirectoryWatcher] = None
+
+
+def start_watcher(client) -> DirectoryWatcher:
+    """
+    avvia, una sola volta per processo, il watcher della directory in un thread daemon.
+
+    :param client: client del backend restituito da get_search_client()
+    :return: watcher attivo
+    """
+
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = DirectoryWatcher(client)
+            _watcher.start()
+        return _watcher
+
+
+def main():
+    from app.business.backend import get_search_client
+
+    client = get_search_client()
+    if not client:
+        raise SystemExit(f"Backend '{config.SEARCH_BACKEND}' non disponibile")
+    watcher = DirectoryWatcher(client)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        logger_index_txt.info(f"Watcher fermato: {watcher.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,14 +6,24 @@ PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
 sys.path.append(PROJECT_ROOT)
 
 import streamlit as st
-from app.business.operation_elasticsearch import run_indexing, search_documents, check_index_exists, \
-    get_elasticsearch_client
+from app.business.backend import search_with_index_check, get_search_client, rollback_index, \
+    get_documents_content, get_all_sources
+from app.business.filename_suggest import filename_suggester
+from app.business.indexing_jobs import job_manager
+from app.business.search_cache import search_cache
+from app.business.snapshot import snapshot_available
+from app.business.watcher import start_watcher
 from app.models.models import config
+from app.utils.metrics import SEARCH_STAGE_SECONDS, start_metrics_exporter
 
 if 'page' not in st.session_state:
     st.session_state.page = 1
 if 'page_size' not in st.session_state:
     st.session_state.page_size = 10
+if 'search_cursors' not in st.session_state:
+    st.session_state.search_cursors = {}
+if 'full_content_ids' not in st.session_state:
+    st.session_state.full_content_ids = set()
 
 
 def reset_page_callback():
@@ -26,41 +36,130 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# dopo set_page_config: get_search_client() può mostrare st.error se il backend non è raggiungibile
+start_metrics_exporter()
+if config.WATCH_ENABLED:
+    watcher_client = get_search_client()
+    if watcher_client:
+        start_watcher(watcher_client)
+
 st.title("Ricerca File con Elasticsearch")
 
 st.sidebar.title("Amministrazione")
 
+def start_job(kind: str):
+    """
+    avvia in background un job di indicizzazione o ricostruzione tramite job_manager;
+    se un job è già in corso sullo stesso indice (anche da un'altra sessione) non ne avvia un secondo.
+
+    :param kind: "index" o "rebuild"
+    """
+
+    es_client = get_search_client()
+    if not es_client:
+        st.error("Impossibile connettersi a Elasticsearch. Controlla la configurazione.")
+        st.stop()
+    job, started = job_manager.start(es_client, kind)
+    if started:
+        st.sidebar.success("Job avviato in background: le ricerche restano disponibili.")
+    else:
+        st.sidebar.info(f"Un'indicizzazione è già in corso: {job['message']}")
+
+
 if st.sidebar.button("Avvia/Aggiorna Indicizzazione", type="primary"):
-    with st.spinner("Indicizzazione in corso..."):
-        es_client = get_elasticsearch_client()
-        if not es_client:
-            st.error("Impossibile connettersi a Elasticsearch. Controlla la configurazione.")
-            st.stop()
-
-        progress_bar = st.progress(0, text="Indicizzazione documenti...")
-        result = run_indexing(es_client, progress_bar)
-
-        if result["success"]:
-            if result["index_created"]:
-                st.success(f"Indice '{config.INDEX_NAME}' creato.")
-            else:
-                st.info(f"Indice '{config.INDEX_NAME}' già esistente. Documenti aggiornati/aggiunti.")
+    start_job("index")
+
+if st.sidebar.button("Ricostruisci Indice"):
+    start_job("rebuild")
+
+if st.sidebar.button("Ripristina Generazione Precedente"):
+    es_client = get_search_client()
+    if not es_client:
+        st.error("Impossibile connettersi a Elasticsearch. Controlla la configurazione.")
+        st.stop()
+
+    result = rollback_index(es_client)
+    if result["success"]:
+        st.success(f"Alias '{config.INDEX_NAME}' riportato su '{result['index']}'.")
+    else:
+        st.error(f"Errore durante il ripristino: {result['error']}")
+
 
-            if result["errors"] > 0:
-                st.warning(f"Si sono verificati {result['errors']} errori.")
+
+@st.fragment(run_every=2)
+def job_status():
+    """
+    stato del job di indicizzazione, aggiornato ogni 2 secondi senza rieseguire l'intero script.
+    """
+
+    job = job_manager.current()
+    if job is not None:
+        label = {"rebuild": "Ricostruzione", "restore": "Ripristino snapshot", "export": "Export snapshot",
+                 "watch": "Aggiornamento dal watcher"}.get(job["kind"], "Indicizzazione")
+        st.progress(min(job["progress"], 1.0), text=f"{label}: {job['message']}")
+        if job["kind"] == "watch":
+            # i micro-batch del watcher sono brevi e riprenderebbero al ciclo successivo: niente annullamento
+            return
+        if job["status"] == "cancelling":
+            st.caption("Annullamento in corso...")
+        elif st.button("Annulla", key="cancel_job"):
+            job_manager.cancel()
+        return
+
+    history = job_manager.history()
+    if history:
+        last = history[0]
+        if last["status"] == "completed" and last.get("summary"):
+            st.caption(f"Ultimo job ({last['finished_at']}): {last['summary']}")
+        elif last["status"] == "completed":
+            st.caption(f"Ultimo job ({last['finished_at']}): {last.get('indexed_docs', 0)} documenti, "
+                       f"eliminati: {last.get('deleted_docs', 0)}, errori: {last.get('errors', 0)}.")
         else:
-            st.error(f"Errore durante l'indicizzazione: {result['error']}")
+            st.caption(f"Ultimo job ({last['finished_at']}): {last['status']} - {last.get('error', '')}")
+
+
+with st.sidebar:
+    job_status()
+
+with st.sidebar.expander("Cronologia indicizzazioni"):
+    for job in job_manager.history():
+        st.caption(f"{job['started_at']} · {job['kind']} · {job['status']} · {job.get('seconds', 0):.1f}s · "
+                   f"{job.get('indexed_docs', 0)} doc · {job.get('docs_per_second', 0):.1f} doc/s · "
+                   f"{job.get('mb_per_second', 0):.2f} MB/s")
 
 st.sidebar.divider()
 
+with st.sidebar.expander("Statistiche cache ricerche"):
+    cache_stats = search_cache.stats()
+    st.caption(f"Hit: {cache_stats['hits']} · Miss: {cache_stats['misses']} · "
+               f"Eviction: {cache_stats['evictions']} · Voci: {cache_stats['size']}")
+
 st.header("🔍 Cerca Documenti")
 st.info("Puoi cercare per nome file, per contenuto, o per entrambi contemporaneamente.")
 
 query_nome = st.text_input(
     "Cerca per Nome File:",
     placeholder="es. ilfatto_omicidio",
+    key="query_nome",
     on_change=reset_page_callback
 )
+
+
+def select_filename_callback(name: str):
+    st.session_state.query_nome = name
+    reset_page_callback()
+
+
+suggest_client = get_search_client() if query_nome else None
+if suggest_client:
+    filename_suggester.refresh(lambda: get_all_sources(suggest_client, raise_errors=True))
+    suggestions = [name for name in filename_suggester.suggest(query_nome) if name != query_nome]
+    if suggestions:
+        st.caption("Nomi file suggeriti:")
+        suggestion_cols = st.columns(min(len(suggestions), 4))
+        for position, name in enumerate(suggestions):
+            suggestion_cols[position % len(suggestion_cols)].button(
+                name, key=f"suggest_{position}", on_click=select_filename_callback, args=(name,))
 query_contenuto = st.text_input(
     "Cerca per Contenuto:",
     placeholder="developer",
@@ -84,7 +183,8 @@ with col2:
 def get_highlight(hit):
     """
     estrae e formatta il testo da ricerca, controlla se la chiave 'highlight' esiste nel dizionario hit.
-    e cerca in diversi campi di highlight ('contenuto_file.italian', 'contenuto_file.english', 'contenuto_file', 'nome_file')
+    e cerca in diversi campi di highlight ('summary', 'title', 'contenuto_file.italian', 'contenuto_file.english',
+    'contenuto_file', 'nome_file')
 
     :param hit: risultato restituito da elasticsearch.
     :return:
@@ -92,6 +192,9 @@ def get_highlight(hit):
 
     if 'highlight' not in hit:
         return ""
+    for field in ('summary', 'title'):
+        if field in hit['highlight']:
+            return "...".join(hit['highlight'][field])
     if 'contenuto_file.italian' in hit['highlight']:
         return "...".join(hit['highlight']['contenuto_file.italian'])
     if 'contenuto_file.english' in hit['highlight']:
@@ -104,21 +207,30 @@ def get_highlight(hit):
 
 
 if query_nome or query_contenuto:
-    es_client = get_elasticsearch_client()
+    es_client = get_search_client()
     if not es_client:
         st.error("Impossibile connettersi a Elasticsearch. Controlla la configurazione.")
         st.stop()
 
     try:
-        exists, doc_count = check_index_exists(es_client)
+        exists, doc_count, result = search_with_index_check(
+            es_client,
+            query_nome_file=query_nome,
+            query_contenuto=query_contenuto,
+            is_phrase_query=is_phrase_query,
+            page=st.session_state.page,
+            page_size=st.session_state.page_size,
+            cursor_cache=st.session_state.search_cursors
+        )
         if not exists:
-            st.info(f"L'indice '{config.INDEX_NAME}' non esiste. Avvio dell'indicizzazione automatica...")
-            with st.spinner("Creazione indice in corso... (potrebbe richiedere tempo)"):
-                result = run_indexing(es_client)
-                if not result["success"]:
-                    st.error(f"Indicizzazione automatica fallita: {result['error']}")
-                    st.stop()
-            st.success("Indicizzazione completata. Esecuzione della ricerca...")
+            if snapshot_available():
+                job, started = job_manager.start(es_client, "restore")
+                st.info(f"L'indice '{config.INDEX_NAME}' non esiste: ripristino dello snapshot "
+                        f"'{config.SNAPSHOT_PATH}' in background.")
+            else:
+                job, started = job_manager.start(es_client, "index")
+                st.info(f"L'indice '{config.INDEX_NAME}' non esiste: indicizzazione automatica in background. "
+                        f"I risultati compariranno man mano che i documenti vengono indicizzati.")
         elif doc_count == 0:
             st.warning(f"L'indice '{config.INDEX_NAME}' esiste ma è vuoto. Avvia l'indicizzazione dalla sidebar.")
 
@@ -126,37 +238,47 @@ if query_nome or query_contenuto:
         st.error(f"Errore durante il controllo/creazione dell'indice: {e}")
         st.stop()
 
-    result = search_documents(
-        es_client,
-        query_nome_file=query_nome,
-        query_contenuto=query_contenuto,
-        is_phrase_query=is_phrase_query,
-        page=st.session_state.page,
-        page_size=st.session_state.page_size
-    )
-
     if result["success"]:
-        st.success(f"Trovati **{result['total_hits']}** risultati in {result['time']:.4f} secondi.")
+        phase_notes = {"fields": " (titolo e sommario)", "exact": " (corrispondenze esatte)",
+                       "expanded": " (ricerca estesa con fuzziness)"}
+        phase_note = phase_notes.get(result.get("phase"), "") if config.SEARCH_ADAPTIVE else ""
+        st.success(f"Trovati **{result['total_hits']}** risultati in {result['time']:.4f} secondi{phase_note}.")
 
         if not result["hits"]:
             st.warning("Nessun documento trovato.")
         else:
-            for i, hit in enumerate(result["hits"]):
-                score = hit['_score']
-                source = hit['_source']
-                highlight_snippet = get_highlight(hit)
-
-                with st.container(border=True):
-                    st.markdown(
-                        f"**{(st.session_state.page - 1) * st.session_state.page_size + i + 1}. {source['nome_file']}** (Score: `{score:.2f}`)")
-                    st.caption(f"Percorso: `{source['percorso_completo']}`")
-
-                    if highlight_snippet:
-                        st.markdown(f"**Corrispondenza:** {highlight_snippet}", unsafe_allow_html=True)
-
-                    with st.expander("Mostra anteprima contenuto"):
-                        snippet = source.get('contenuto_file', '')[:500]
-                        st.code(snippet + "..." if len(snippet) >= 500 else snippet, language=None)
+            with SEARCH_STAGE_SECONDS.time(stage="render"):
+                requested_ids = [hit['_id'] for hit in result["hits"] if hit['_id'] in st.session_state.full_content_ids]
+                full_contents = get_documents_content(es_client, requested_ids) if requested_ids else {}
+
+                for i, hit in enumerate(result["hits"]):
+                    score = hit['_score']
+                    source = hit['_source']
+                    highlight_snippet = get_highlight(hit)
+
+                    with st.container(border=True):
+                        st.markdown(
+                            f"**{(st.session_state.page - 1) * st.session_state.page_size + i + 1}. {source['nome_file']}** (Score: `{score:.2f}`)")
+                        st.caption(f"Percorso: `{source['percorso_completo']}`")
+                        if source.get('duplicate_of'):
+                            st.caption(f"Duplicato di: `{source['duplicate_of']}`")
+                        if source.get('link'):
+                            st.caption(f"[{source.get('title') or source['link']}]({source['link']})")
+                        if source.get('numero_passaggio') is not None:
+                            st.caption(f"Passaggio più rilevante: {source['numero_passaggio'] + 1}")
+
+                        if highlight_snippet:
+                            st.markdown(f"**Corrispondenza:** {highlight_snippet}", unsafe_allow_html=True)
+
+                        with st.expander("Mostra anteprima contenuto"):
+                            if hit['_id'] in full_contents:
+                                st.code(full_contents[hit['_id']], language=None)
+                            else:
+                                snippet = source.get('anteprima', source.get('contenuto_file', '')[:500])
+                                st.code(snippet + "..." if len(snippet) >= 500 else snippet, language=None)
+                                if len(snippet) >= 500 and st.button("Mostra contenuto completo", key=f"full_{hit['_id']}"):
+                                    st.session_state.full_content_ids.add(hit['_id'])
+                                    st.rerun()
 
             total_pages = (result['total_hits'] + st.session_state.page_size - 1) // st.session_state.page_size
 
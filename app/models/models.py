@@ -1,15 +1,29 @@
 from functools import lru_cache
 from pathlib import Path
-from pydantic import BaseModel, Field
+from typing import Optional
+from pydantic import BaseModel, Field, computed_field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
+PREVIEW_CHARS = 500
 
 class FileDocument(BaseModel):
     """modello per il documento indicizzato"""
     nome_file: str
     contenuto_file: str
     percorso_completo: str
+    id_file: str
+    numero_passaggio: Optional[int] = None
+    title: Optional[str] = None
+    summary: Optional[str] = None
+    link: Optional[str] = None
+    duplicate_of: Optional[str] = None
+
+    @computed_field
+    @property
+    def anteprima(self) -> str:
+        """anteprima salvata all'indicizzazione, restituita dalle ricerche al posto del contenuto completo"""
+        return self.contenuto_file[:PREVIEW_CHARS]
 
 class Settings(BaseSettings):
     """carica le configurazioni del file .env"""
@@ -18,6 +32,67 @@ class Settings(BaseSettings):
     DIRECTORY_PATH: str
     LOG_LEVEL: str = "INFO"
     LOG_FORMAT: str = "{time:YYYY-MM-DD HH:mm:ss} | {level} | {name} | {function} | {line} | {message}"
+    STATE_DIR: str = str(BASE_DIR / ".index_state")
+    INGEST_READER_THREADS: int = 4
+    INGEST_SENDER_THREADS: int = 2
+    BULK_MAX_DOCS: int = 200
+    BULK_MAX_BYTES: int = 10 * 1024 * 1024
+    BULK_MAX_RETRIES: int = 3
+    PASSAGE_MAX_BYTES: int = 512 * 1024
+    INDEX_NUMBER_OF_REPLICAS: int = 1
+    INDEX_GENERATIONS_TO_KEEP: int = 2
+    SEARCH_CACHE_SIZE: int = 1024
+    SEARCH_CACHE_TTL: float = 300
+    ES_CONNECTIONS_PER_NODE: int = 10
+    ES_MAX_RETRIES: int = 2
+    ES_RETRY_BACKOFF: float = 0.25
+    ES_HEALTH_CHECK_INTERVAL: float = 30
+    ES_HEALTH_CHECK_TIMEOUT: float = 2
+    ES_BREAKER_THRESHOLD: int = 3
+    ES_BREAKER_COOLDOWN: float = 30
+    ES_ASYNC: bool = False
+    PIT_KEEP_ALIVE: str = "5m"
+    PIT_CURSOR_TTL: float = 240
+    PIT_CURSORS_PER_SESSION: int = 5
+    MGET_BATCH_SIZE: int = 50
+    MSEARCH_BATCH_SIZE: int = 100
+    MSEARCH_CONCURRENCY: int = 4
+    SUGGEST_LIMIT: int = 8
+    SUGGEST_PAGE_SIZE: int = 10000
+    SUGGEST_REFRESH_INTERVAL: float = 300
+    HIGHLIGHT_MODE: str = "reanalyze"
+    FILENAME_MATCH_MODE: str = "ngram"
+    INGEST_EXTRACTORS: str = "article"
+    DEDUP_ENABLED: bool = False
+    DEDUP_THRESHOLD: float = 0.8
+    DEDUP_SHINGLE_SIZE: int = 5
+    DEDUP_NUM_PERM: int = 64
+    DEDUP_BANDS: int = 16
+    SEARCH_ADAPTIVE: bool = False
+    SEARCH_ADAPTIVE_MIN_HITS: int = 10
+    INDEX_META_TTL: float = 60
+    SEARCH_BACKEND: str = "elasticsearch"
+    LOCAL_INDEX_PATH: str = ""
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int = 0
+    METRICS_FILE: str = ""
+    METRICS_FILE_INTERVAL: float = 15
+    PROFILER_OUTPUT: str = ""
+    PROFILER_INTERVAL: float = 0.01
+    INDEX_CHECKPOINT_DOCS: int = 2000
+    SNAPSHOT_PATH: str = ""
+    SNAPSHOT_CHUNK_DOCS: int = 5000
+    SNAPSHOT_WORKERS: int = 4
+    JOB_HISTORY_SIZE: int = 20
+    WATCH_ENABLED: bool = False
+    WATCH_MODE: str = "auto"
+    WATCH_DEBOUNCE: float = 1.0
+    WATCH_MAX_DELAY: float = 10
+    WATCH_BATCH_MAX_FILES: int = 500
+    WATCH_POLL_INTERVAL: float = 2.0
+    WATCH_REFRESH: str = "auto"
+    WATCH_REFRESH_MIN_INTERVAL: float = 1.0
+    WATCH_LOCAL_INTERVAL: float = 30
 
 
     model_config = SettingsConfigDict(
@@ -0,0 +1,286 @@
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.models.models import config
+from app.utils.logger_config import logger_index_txt
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """contatore monotono con etichette, in formato prometheus"""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+            if not self._values:
+                lines.append(f"{self.name} 0")
+        return lines
+
+
+class Histogram:
+    """istogramma cumulativo con bucket fissi ed etichette, in formato prometheus"""
+
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelKey, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """misura la durata del blocco, anche se solleva un'eccezione"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self, **labels) -> Dict[str, float]:
+        """numero di osservazioni e somma per un insieme di etichette"""
+        with self._lock:
+            state = self._values.get(_label_key(labels))
+            return {"count": state[2], "sum": state[1]} if state else {"count": 0, "sum": 0.0}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """registro delle metriche del processo, esportato in formato testo prometheus"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+metrics = MetricsRegistry()
+
+INGEST_STAGE_SECONDS = metrics.histogram(
+    "filtrare_ingest_stage_seconds", "Durata delle fasi di indicizzazione (scan, read, validate, serialize, bulk, refresh)")
+SEARCH_STAGE_SECONDS = metrics.histogram(
+    "filtrare_search_stage_seconds", "Durata delle fasi di ricerca (build_query, took, transport, decode, render, total)")
+INGEST_DOCS = metrics.counter("filtrare_ingest_docs_total", "Documenti inviati all'indice")
+INGEST_BYTES = metrics.counter("filtrare_ingest_bytes_total", "Byte stimati dei documenti inviati all'indice")
+INGEST_ERRORS = metrics.counter("filtrare_ingest_errors_total", "Azioni di indicizzazione fallite")
+INGEST_DUPLICATES = metrics.counter("filtrare_ingest_duplicates_total", "File indicizzati come duplicati (exact o near)")
+INGEST_RETRIES = metrics.counter("filtrare_ingest_retries_total", "Batch bulk ritentati dopo timeout o errori di rete")
+SEARCH_REQUESTS = metrics.counter("filtrare_search_requests_total", "Ricerche eseguite per backend ed esito")
+SEARCH_PHASES = metrics.counter("filtrare_search_phase_total", "Ricerche per fase che ha fornito i risultati")
+
+
+def record_es_timings(response, wall_seconds: float, histogram: Histogram = None, **labels) -> None:
+    """
+    scompone la durata di una chiamata elasticsearch in took (tempo del cluster), transport
+    (rete e code, durata della richiesta http meno took) e decode (deserializzazione del json).
+
+    :param response: risposta del client elasticsearch
+    :param wall_seconds: durata complessiva della chiamata lato client
+    :param histogram: istogramma su cui registrare (default SEARCH_STAGE_SECONDS)
+    """
+
+    histogram = histogram or SEARCH_STAGE_SECONDS
+    took = response.get("took", 0) / 1000
+    duration = getattr(getattr(response, "meta", None), "duration", wall_seconds)
+    histogram.observe(took, stage="took", **labels)
+    histogram.observe(max(duration - took, 0.0), stage="transport", **labels)
+    histogram.observe(max(wall_seconds - duration, 0.0), stage="decode", **labels)
+
+
+def write_metrics_file(path: str) -> None:
+    """scrive le metriche in formato prometheus (textfile collector), con sostituzione atomica"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        file.write(metrics.render())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+class SamplingProfiler:
+    """
+    profiler a campionamento: un thread legge periodicamente gli stack di tutti i thread
+    e li accumula in formato "collapsed" (una riga per stack con il numero di campioni),
+    leggibile da flamegraph.pl o speedscope. l'overhead dipende solo dall'intervallo.
+    """
+
+    def __init__(self, interval: float, output: str):
+        self.interval = interval
+        self.output = output
+        self.samples: _Tally = _Tally()
+        self._samples_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_filename.rsplit(os.sep, 1)[-1]}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            stacks.append(";".join([names.get(ident, str(ident))] + stack[::-1]))
+        with self._samples_lock:
+            self.samples.update(stacks)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.write()
+
+    def write(self) -> None:
+        """scrive gli stack campionati nel file di output, da una copia presa mentre il campionamento continua"""
+        with self._samples_lock:
+            samples = self.samples.copy()
+        with open(self.output, "w", encoding="utf-8") as file:
+            for stack, count in samples.most_common():
+                file.write(f"{stack} {count}\n")
+
+
+_exporter_lock = threading.Lock()
+_exporter_started = False
+profiler: Optional[SamplingProfiler] = None
+
+
+def start_metrics_exporter() -> None:
+    """
+    avvia, una sola volta per processo, gli esportatori configurati: endpoint http /metrics
+    (config.METRICS_PORT), file in formato prometheus riscritto ogni config.METRICS_FILE_INTERVAL secondi
+    (config.METRICS_FILE) e profiler a campionamento (config.PROFILER_OUTPUT).
+    """
+
+    global _exporter_started, profiler
+    with _exporter_lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+
+    if config.METRICS_PORT:
+        try:
+            server = ThreadingHTTPServer((config.METRICS_HOST, config.METRICS_PORT), _MetricsHandler)
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            logger_index_txt.info(f"Metriche disponibili su http://{config.METRICS_HOST}:{config.METRICS_PORT}/metrics")
+        except Exception as e:
+            logger_index_txt.warning(f"Endpoint metriche non avviato: {e}")
+
+    if config.PROFILER_OUTPUT:
+        profiler = SamplingProfiler(config.PROFILER_INTERVAL, config.PROFILER_OUTPUT)
+        profiler.start()
+        logger_index_txt.info(f"Profiler a campionamento attivo, output: {config.PROFILER_OUTPUT}")
+
+    if config.METRICS_FILE or profiler is not None:
+        def export_loop():
+            while True:
+                time.sleep(config.METRICS_FILE_INTERVAL)
+                try:
+                    if config.METRICS_FILE:
+                        write_metrics_file(config.METRICS_FILE)
+                    if profiler is not None:
+                        profiler.write()
+                except Exception as e:
+                    # qualsiasi errore va solo registrato: se il thread terminasse il file smetterebbe di aggiornarsi
+                    logger_index_txt.error(f"Esportazione metriche fallita: {e}")
+
+        threading.Thread(target=export_loop, name="metrics-file", daemon=True).start()